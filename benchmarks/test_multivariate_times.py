@@ -1,3 +1,6 @@
+import functools
+import itertools
+
 import pytest
 
 import unified_map as ue
@@ -82,6 +85,95 @@ def test_parallel_multiprocessing(benchmark):
     assert results == expected_results
 
 
+# Parallel with skewed workloads, where the expensive arguments come last
+
+def f_skewed(n, x):
+    for _ in range(n):
+        slow_computation()
+    return n + x
+
+
+skewed_args = [(n, x) for x, n in enumerate([1] * 16 + [8] * 4)]
+skewed_expected_results = [n + x for n, x in skewed_args]
+
+
+def skewed_cost(n, x):
+    return n
+
+
+def test_parallel_futures_skewed(benchmark):
+    results = benchmark(ue.multivariate.parallel.futures, f_skewed, skewed_args)
+    assert results == skewed_expected_results
+
+
+def test_parallel_futures_skewed_with_cost(benchmark):
+    results = benchmark(ue.multivariate.parallel.futures, f_skewed, skewed_args,
+                        cost=skewed_cost)
+    assert results == skewed_expected_results
+
+
+def test_parallel_multiprocessing_skewed(benchmark):
+    results = benchmark(ue.multivariate.parallel.multiprocessing, f_skewed, skewed_args)
+    assert results == skewed_expected_results
+
+
+def test_parallel_multiprocessing_skewed_with_cost(benchmark):
+    results = benchmark(ue.multivariate.parallel.multiprocessing, f_skewed, skewed_args,
+                        cost=skewed_cost)
+    assert results == skewed_expected_results
+
+
+# Parallel with reductions, where large results are only needed as their element-wise sum
+
+def f_vector(x, y):
+    return [float(x + y)] * 100000
+
+
+def add_vectors(vector1, vector2):
+    return [v1 + v2 for v1, v2 in zip(vector1, vector2)]
+
+
+vector_args = [(x, x) for x in range(100)]
+expected_vector_sum = [float(sum(x + y for x, y in vector_args))] * 100000
+
+
+def map_then_reduce(mapper):
+    return functools.reduce(add_vectors, mapper.starmap(f_vector, vector_args))
+
+
+def test_parallel_multiprocessing_map_then_reduce(benchmark):
+    with ue.mapper.Mapper('parallel.multiprocessing') as mapper:
+        result = benchmark(map_then_reduce, mapper)
+    assert result == expected_vector_sum
+
+
+def test_parallel_multiprocessing_map_reduce(benchmark):
+    with ue.mapper.Mapper('parallel.multiprocessing') as mapper:
+        result = benchmark(mapper.starmap_reduce, f_vector, add_vectors, vector_args)
+    assert result == expected_vector_sum
+
+
+# Parallel with parameter grids, where all combinations of three axes are evaluated
+
+grid_axes = (range(100), range(100), range(50))
+grid_expected_results = [f_fast(*args) for args in itertools.product(*grid_axes)]
+
+
+def map_product(function, *axes):
+    return ue.multivariate.parallel.multiprocessing(function, list(itertools.product(*axes)))
+
+
+def test_parallel_multiprocessing_product(benchmark):
+    results = benchmark(map_product, f_fast, *grid_axes)
+    assert results == grid_expected_results
+
+
+def test_parallel_multiprocessing_grid(benchmark):
+    grid = ue.grid.Grid(*grid_axes)
+    results = benchmark(ue.multivariate.parallel.multiprocessing, f_fast, grid)
+    assert results == grid_expected_results
+
+
 # Distributed
 
 # Cannot be tested in a general way since it includes starting workers on a cluster
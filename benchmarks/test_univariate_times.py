@@ -1,3 +1,6 @@
+import functools
+import pickle
+
 import pytest
 
 import unified_map as ue
@@ -82,6 +85,153 @@ def test_parallel_multiprocessing(benchmark):
     assert results == expected_results
 
 
+# Parallel with skewed workloads, where the expensive arguments come last
+
+def f_skewed(n):
+    for _ in range(n):
+        slow_computation()
+    return n
+
+
+skewed_args = [1] * 16 + [8] * 4
+
+
+def skewed_cost(n):
+    return n
+
+
+def test_parallel_futures_skewed(benchmark):
+    results = benchmark(ue.univariate.parallel.futures, f_skewed, skewed_args)
+    assert results == skewed_args
+
+
+def test_parallel_futures_skewed_with_cost(benchmark):
+    results = benchmark(ue.univariate.parallel.futures, f_skewed, skewed_args, cost=skewed_cost)
+    assert results == skewed_args
+
+
+def test_parallel_multiprocessing_skewed(benchmark):
+    results = benchmark(ue.univariate.parallel.multiprocessing, f_skewed, skewed_args)
+    assert results == skewed_args
+
+
+def test_parallel_multiprocessing_skewed_with_cost(benchmark):
+    results = benchmark(ue.univariate.parallel.multiprocessing, f_skewed, skewed_args,
+                        cost=skewed_cost)
+    assert results == skewed_args
+
+
+# Parallel with reductions, where large results are only needed as their element-wise sum
+
+def f_vector(x):
+    return [float(x)] * 100000
+
+
+def add_vectors(vector1, vector2):
+    return [v1 + v2 for v1, v2 in zip(vector1, vector2)]
+
+
+n_vector_args = 200
+expected_vector_sum = [float(sum(range(n_vector_args)))] * 100000
+
+
+def map_then_reduce(mapper):
+    return functools.reduce(add_vectors, mapper.map(f_vector, range(n_vector_args)))
+
+
+def test_parallel_multiprocessing_map_then_reduce(benchmark):
+    with ue.mapper.Mapper('parallel.multiprocessing') as mapper:
+        result = benchmark(map_then_reduce, mapper)
+    assert result == expected_vector_sum
+
+
+def test_parallel_multiprocessing_map_reduce(benchmark):
+    with ue.mapper.Mapper('parallel.multiprocessing') as mapper:
+        result = benchmark(mapper.map_reduce, f_vector, add_vectors, range(n_vector_args))
+    assert result == expected_vector_sum
+
+
+# Parallel with a large closure, which is sent to each worker once instead of with each task
+
+class LookupTable:
+    """Callable with a large closure that counts how often it is pickled in this process."""
+
+    num_pickled = 0
+
+    def __init__(self, size):
+        self.values = list(range(size))
+
+    def __call__(self, x):
+        return self.values[x]
+
+    def __getstate__(self):
+        LookupTable.num_pickled += 1
+        return self.__dict__
+
+
+lookup_table = LookupTable(1000000)
+lookup_table_bytes = len(pickle.dumps(lookup_table))
+
+
+def benchmark_large_closure(benchmark, backend):
+    # With a timeout, every argument is sent as a task of its own
+    with ue.mapper.Mapper(backend, timeout=60) as mapper:
+        results = benchmark(mapper.map, lookup_table, args)
+        report = ue.instrumentation.Report()
+        LookupTable.num_pickled = 0
+        mapper.map(lookup_table, args, report=report)
+    benchmark.extra_info['function_bytes_sent'] = LookupTable.num_pickled * lookup_table_bytes
+    benchmark.extra_info['function_bytes_sent_with_each_task'] = (
+        report.num_tasks * lookup_table_bytes)
+    assert results == args
+    assert LookupTable.num_pickled == 1
+
+
+def test_parallel_futures_large_closure(benchmark):
+    benchmark_large_closure(benchmark, 'parallel.futures')
+
+
+def test_parallel_multiprocessing_large_closure(benchmark):
+    benchmark_large_closure(benchmark, 'parallel.multiprocessing')
+
+
+# Parallel with large payloads, which are sent to and from workers by different serializers
+
+def f_identity(x):
+    return x
+
+
+payloads = {
+    'numbers': [list(range(100000))] * 20,
+    'buffers': [bytearray(4 * 2**20)] * 20,
+    'text': [' '.join(['unified map'] * 200000)] * 20,
+}
+
+serializers = {
+    'default': None,
+    'pickle': 'pickle',
+    'cloudpickle': 'cloudpickle',
+    'lz4': ue.policies.Serializer(compression='lz4'),
+    'zstd': ue.policies.Serializer(compression='zstd'),
+}
+
+required_modules = {
+    'cloudpickle': 'cloudpickle',
+    'lz4': 'lz4.frame',
+    'zstd': 'zstandard',
+}
+
+
+@pytest.mark.parametrize('payload', sorted(payloads))
+@pytest.mark.parametrize('serializer', sorted(serializers))
+def test_parallel_multiprocessing_payload(benchmark, payload, serializer):
+    if serializer in required_modules:
+        pytest.importorskip(required_modules[serializer])
+    results = benchmark(ue.univariate.parallel.multiprocessing, f_identity, payloads[payload],
+                        serializer=serializers[serializer])
+    assert results == payloads[payload]
+
+
 # Distributed
 
 # Cannot be tested in a general way since it includes starting workers on a cluster
@@ -1,4 +1,10 @@
+import gc
+import itertools
 import multiprocessing
+import operator
+import os
+import signal
+import threading
 import time
 
 import pytest
@@ -112,6 +118,930 @@ def test_parallel_multiprocessing(f, args, expected_results):
     assert results == expected_results
 
 
+@pytest.mark.parametrize('f, args, expected_results', testdata)
+def test_parallel_multiprocessing_inherit_arguments(f, args, expected_results):
+    results = umap.multivariate.parallel.multiprocessing(f, args, inherit_arguments=True)
+    assert results == expected_results
+
+
+# Worker setup - tested with all parallel backends
+
+def initializer_offset(offset):
+    umap.worker.state['offset'] = offset
+    umap.worker.state['num_initializations'] = (
+        umap.worker.state.get('num_initializations', 0) + 1)
+
+
+def warmup_sleep():
+    time.sleep(0.01)
+
+
+def f_offset(x, y):
+    return x + y + umap.worker.state['offset'], umap.worker.state['num_initializations']
+
+args_offset = [(x, 2*x) for x in range(12)]
+expected_results_offset = [(x + y + 100, 1) for x, y in args_offset]
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_initializer_and_warmup(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_offset, args_offset, num_cores=2, initializer=initializer_offset,
+                           initargs=(100,), warmup=warmup_sleep, report=report)
+    assert results == expected_results_offset
+    assert report.num_items == len(args_offset)
+    assert 1 <= report.num_workers <= 2
+    assert report.setup_time >= 0.01 * report.num_workers
+    for worker in report.workers.values():
+        assert worker['setup_time'] >= 0.01
+    assert report.wall_time > 0.0
+
+
+def test_parallel_multiprocessing_initializer_with_inherited_arguments():
+    report = umap.instrumentation.Report()
+    results = umap.multivariate.parallel.multiprocessing(
+        f_offset, args_offset, num_cores=2, inherit_arguments=True,
+        initializer=initializer_offset, initargs=(100,), report=report)
+    assert results == expected_results_offset
+    assert report.num_tasks == 8
+
+
+# Straggler mitigation
+
+def f_straggler(x, marker_filepath):
+    # The first attempt for x=0 is artificially delayed, a speculative duplicate is not
+    if x == 0 and not os.path.exists(marker_filepath):
+        open(marker_filepath, 'w').close()
+        time.sleep(5.0)
+    time.sleep(0.05)
+    return x**2
+
+
+def test_parallel_futures_speculation(tmpdir):
+    marker_filepath = str(tmpdir.join('marker'))
+    args = [(x, marker_filepath) for x in range(8)]
+    expected_results = [x**2 for x in range(8)]
+    speculation = umap.policies.Speculation(quantile=0.5, multiplier=3.0, poll_interval=0.01)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    results = umap.multivariate.parallel.futures(f_straggler, args, num_cores=3,
+                                                 speculation=speculation, report=report)
+    assert time.time() - start < 4.0
+    assert results == expected_results
+    assert report.events['speculative_launches'] >= 1
+    assert report.events['speculative_wins'] >= 1
+
+
+def test_speculation_validation():
+    with pytest.raises(ValueError):
+        umap.policies.Speculation(quantile=1.5)
+    with pytest.raises(ValueError):
+        umap.policies.Speculation(multiplier=0.0)
+
+
+# Fault tolerance
+
+def f_inverse(x, y):
+    return y/x
+
+
+def f_flaky(x, directory):
+    # Fails at the first attempt for each odd x
+    marker_filepath = os.path.join(directory, 'flaky_{}'.format(x))
+    if x % 2 == 1 and not os.path.exists(marker_filepath):
+        open(marker_filepath, 'w').close()
+        raise ValueError('flaky')
+    return x**2
+
+
+def f_crash(x, directory):
+    # Kills its own worker process at the first attempt for x=3, always for x=5
+    marker_filepath = os.path.join(directory, 'crash_{}'.format(x))
+    if x == 5 or (x == 3 and not os.path.exists(marker_filepath)):
+        open(marker_filepath, 'w').close()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return x**2
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_error_policies(backend, tmpdir):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    with pytest.raises(ZeroDivisionError):
+        parallel_map(f_inverse, [(1, 1), (0, 1), (2, 1)], num_cores=2)
+
+    results = parallel_map(f_inverse, [(1, 1), (0, 1), (2, 1)], num_cores=2,
+                           error_policy='return_exceptions')
+    assert results[0] == 1.0
+    assert isinstance(results[1], ZeroDivisionError)
+    assert results[2] == 0.5
+
+    args = [(x, str(tmpdir)) for x in range(6)]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_flaky, args, num_cores=2, error_policy=umap.policies.Retry(1),
+                           report=report)
+    assert results == [x**2 for x in range(6)]
+    assert report.events['retries'] == 3
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_crash(backend, tmpdir):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    args = [(x, str(tmpdir)) for x in range(5)]
+    with pytest.raises(umap.exceptions.WorkerCrashError):
+        parallel_map(f_crash, args, num_cores=2)
+
+    for marker_filepath in tmpdir.listdir():
+        marker_filepath.remove()
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_crash, args, num_cores=2, error_policy=umap.policies.Retry(2),
+                           report=report)
+    assert results == [x**2 for x in range(5)]
+    assert report.events['worker_crashes'] >= 1
+
+    args = [(x, str(tmpdir)) for x in range(7)]
+    results = parallel_map(f_crash, args, num_cores=2, error_policy='return_exceptions')
+    assert isinstance(results[5], umap.exceptions.WorkerCrashError)
+    assert results[:5] == [x**2 for x in range(5)]
+    assert results[6] == 36
+
+
+def test_error_policy_validation():
+    with pytest.raises(ValueError):
+        umap.multivariate.parallel.futures(
+            f_inverse, [(1, 1), (0, 1), (2, 1)], error_policy='ignore')
+    with pytest.raises(ValueError):
+        umap.policies.Retry(num_retries=-1)
+    with pytest.raises(ValueError):
+        umap.policies.Retry(then='ignore')
+
+
+# Time limits
+
+def f_hang(x, y):
+    # Hangs for x=2
+    if x == 2:
+        time.sleep(60)
+    return x + y
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_timeout(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    args = [(x, 1) for x in range(5)]
+    results = parallel_map(f_hang, args, num_cores=2, timeout=1.0, report=report)
+    assert time.time() - start < 10
+    assert isinstance(results[2], umap.exceptions.TaskTimeoutError)
+    results[2] = None
+    assert results == [1, 2, None, 4, 5]
+    assert report.events['timeouts'] == 1
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_deadline(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    args = [(x, 1) for x in range(4)]
+    results = parallel_map(f_hang, args, num_cores=1, deadline=2.0, report=report)
+    assert time.time() - start < 10
+    # The task for x=2 was still running at the deadline and the one for x=3 never started
+    for result in results[2:]:
+        assert isinstance(result, umap.exceptions.DeadlineExceededError)
+    results[2:] = [None, None]
+    assert results == [1, 2, None, None]
+    assert report.events['deadline_exceeded'] == 2
+
+
+# Cost-aware scheduling
+
+def f_cost(x, y):
+    return x * y
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_cost(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    args = [(x, y) for x, y in zip([3, 1, 4, 1, 5, 9, 2, 6], [2, 7, 1, 8, 2, 8, 1, 8])]
+    expected_results = [x * y for x, y in args]
+    assert parallel_map(f_cost, args, num_cores=2, cost=f_cost) == expected_results
+    assert parallel_map(f_cost, args, num_cores=2, cost=[x for x, _ in args]) == expected_results
+    with pytest.raises(ValueError):
+        parallel_map(f_cost, args, num_cores=2, cost=[1, 2])
+
+
+def test_parallel_multiprocessing_cost_with_inherited_arguments():
+    args = [(x, 2*x) for x in range(30)]
+    results = umap.multivariate.parallel.multiprocessing(
+        f_cost, args, num_cores=2, inherit_arguments=True, cost=f_cost)
+    assert results == [x * y for x, y in args]
+
+
+# Worker recycling
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_recycling(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args_numerical, num_cores=2, max_tasks_per_worker=2,
+                           report=report)
+    assert results == expected_results_numerical
+    assert report.events['worker_recycles'] >= 1
+    assert report.num_workers > 2
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, max_worker_memory=1,
+                           report=report)
+    assert results == expected_results_numerical
+    assert report.events['worker_recycles'] >= 2
+    for worker in report.workers.values():
+        assert worker['peak_memory'] > 1
+
+
+# Memory-aware concurrency
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_memory_budget(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args_numerical, num_cores=4, memory_per_task=100,
+                           max_inflight_bytes=150, report=report)
+    assert results == expected_results_numerical
+    assert report.num_workers == 1
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, memory_per_task=1)
+    assert results == expected_results_numerical
+
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args_numerical, max_inflight_bytes=100)
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args_numerical, memory_per_task=0)
+
+
+# Streaming
+
+def generate_arguments(pulled):
+    for x in itertools.count():
+        pulled.append(x)
+        yield (x, x+1, x+2)
+
+
+@pytest.mark.parametrize('name', ['generator_expression', 'generator_function', 'map', 'starmap'])
+def test_serial_stream(name):
+    serial_map = getattr(umap.multivariate.serial, name)
+    pulled = []
+    results = serial_map(f_num, generate_arguments(pulled), stream=True)
+    assert list(itertools.islice(results, 10)) == [f_num(x, x+1, x+2) for x in range(10)]
+    assert len(pulled) == 10
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_stream(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    pulled = []
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, generate_arguments(pulled), num_cores=2, stream=True,
+                           prefetch=4, report=report)
+    assert list(itertools.islice(results, 10)) == [f_num(x, x+1, x+2) for x in range(10)]
+    results.close()
+    assert len(pulled) <= 10 + 4
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, stream=True, report=report)
+    assert list(results) == expected_results_numerical
+    assert report.num_items == len(args_numerical)
+
+
+def test_parallel_stream_validation():
+    with pytest.raises(ValueError):
+        umap.multivariate.parallel.futures(f_num, args_numerical, stream=True, cost=[1] * 10)
+    with pytest.raises(ValueError):
+        umap.multivariate.parallel.multiprocessing(
+            f_num, args_numerical, stream=True, inherit_arguments=True)
+
+
+# Background producer
+
+def generate_slowly(num_arguments):
+    for x in range(num_arguments):
+        time.sleep(0.01)
+        yield (x, x+1, x+2)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+@pytest.mark.parametrize('producer', ['thread', 'process'])
+def test_parallel_producer(backend, producer):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, generate_slowly(10), num_cores=2, producer=producer,
+                           report=report)
+    assert results == [f_num(x, x+1, x+2) for x in range(10)]
+    assert report.production_time >= 0.1
+    assert report.consumer_stall_time > 0.0
+
+    producer = umap.policies.Producer(kind=producer, buffer_size=2)
+    results = parallel_map(f_num, generate_slowly(10), num_cores=2, producer=producer,
+                           stream=True, report=report)
+    assert list(results) == [f_num(x, x+1, x+2) for x in range(10)]
+    assert report.production_time >= 0.1
+
+
+def test_producer_validation():
+    with pytest.raises(ValueError):
+        umap.multivariate.parallel.futures(f_num, args_numerical, producer='fiber')
+    with pytest.raises(ValueError):
+        umap.policies.Producer(buffer_size=0)
+
+
+# Teardown and cancellation
+
+def f_slow(x, y):
+    time.sleep(0.5)
+    return x + y
+
+
+def count_open_files():
+    gc.collect()
+    return len(os.listdir('/proc/self/fd'))
+
+
+def no_new_children(children_before):
+    return set(multiprocessing.active_children()) <= children_before
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='requires /proc/self/fd')
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_teardown(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    parallel_map(f_num, args_numerical, num_cores=2)
+    num_open_files = count_open_files()
+    for _ in range(3):
+        parallel_map(f_num, args_numerical, num_cores=2)
+        with pytest.raises(ZeroDivisionError):
+            parallel_map(f_inverse, [(1, 1), (0, 1), (2, 1)], num_cores=2)
+        results = parallel_map(f_num, args_numerical, num_cores=2, stream=True)
+        next(results)
+        results.close()
+    assert no_new_children(children)
+    assert count_open_files() <= num_open_files
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+@pytest.mark.parametrize('stream', [False, True])
+def test_parallel_cancel(backend, stream):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    token = umap.policies.CancelToken()
+    timer = threading.Timer(0.3, token.cancel)
+    timer.start()
+    start_time = time.perf_counter()
+    with pytest.raises(umap.exceptions.MapCancelledError):
+        results = parallel_map(f_slow, [(x, x) for x in range(20)], num_cores=2, prefetch=2,
+                               stream=stream, cancel_token=token)
+        list(results)
+    assert time.perf_counter() - start_time < 3.0
+    assert no_new_children(children)
+    assert token.cancelled
+
+    # A cancelled token stops further calls before any argument is evaluated
+    with pytest.raises(umap.exceptions.MapCancelledError):
+        parallel_map(f_num, args_numerical, num_cores=2, cancel_token=token)
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_keyboard_interrupt(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    timer = threading.Timer(0.3, os.kill, args=(os.getpid(), signal.SIGINT))
+    timer.start()
+    start_time = time.perf_counter()
+    with pytest.raises(KeyboardInterrupt):
+        parallel_map(f_slow, [(x, x) for x in range(20)], num_cores=2)
+    assert time.perf_counter() - start_time < 3.0
+    assert no_new_children(children)
+
+
+# Mapper
+
+def f_pid(x, y):
+    return os.getpid()
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_mapper(backend):
+    children = set(multiprocessing.active_children())
+    report = umap.instrumentation.Report()
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2,
+                            initializer=initializer_offset, initargs=(100,),
+                            report=report) as mapper:
+        # Worker processes and their setup are kept alive between map calls
+        pids = set()
+        for _ in range(3):
+            assert mapper.starmap(f_offset, args_offset) == expected_results_offset
+            pids.update(mapper.starmap(f_pid, [(x, x) for x in range(20)]))
+        assert len(pids) <= 2
+        assert report.num_items == 20
+
+        results = mapper.istarmap(f_num, iter(args_numerical))
+        assert not isinstance(results, list)
+        assert list(results) == expected_results_numerical
+        assert mapper.starmap(f_str, args_str, report=None) == expected_results_str
+
+        # A failed map call does not affect later ones
+        with pytest.raises(ZeroDivisionError):
+            mapper.starmap(f_inverse, [(1, 1), (0, 1), (2, 1)])
+        assert mapper.starmap(f_offset, args_offset) == expected_results_offset
+
+        futures = [mapper.submit(f_offset, x, y) for x, y in args_offset]
+        assert [future.result() for future in futures] == expected_results_offset
+        assert isinstance(mapper.submit(f_inverse, 0, 1).exception(), ZeroDivisionError)
+    assert no_new_children(children)
+
+    # Without a with statement each map call has its own worker processes
+    mapper = umap.mapper.Mapper('parallel.' + backend, num_workers=2)
+    assert mapper.starmap(f_num, args_numerical) == expected_results_numerical
+    assert mapper.submit(f_num, 1, 2, 3).result() == 14
+    mapper.close()
+    assert no_new_children(children)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'joblib'])
+def test_mapper_without_persistent_workers(backend):
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        assert mapper.starmap(f_num, args_numerical) == expected_results_numerical
+        assert list(mapper.istarmap(f_str, args_str)) == expected_results_str
+        assert mapper.submit(f_num, 1, 2, 3).result() == 14
+
+
+def test_mapper_serial():
+    mapper = umap.mapper.Mapper()
+    assert mapper.starmap(f_num, args_numerical) == expected_results_numerical
+    assert list(mapper.istarmap(f_str, args_str)) == expected_results_str
+    assert mapper.submit(f_num, 1, 2, 3).result() == 14
+    assert isinstance(mapper.submit(f_inverse, 0, 1).exception(), ZeroDivisionError)
+
+
+def test_mapper_validation():
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.threads')
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('serial', num_workers=2)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('distributed.dask', num_workers=2)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures', num_workers=0)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures', stream=True)
+    with pytest.raises(ConnectionError):
+        umap.mapper.Mapper('distributed.spark').starmap(f_num, args_numerical)
+
+
+# Non-blocking map calls
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.futures', 'parallel.multiprocessing'])
+def test_mapper_submit_map(backend):
+    children = set(multiprocessing.active_children())
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        handle = mapper.submit_starmap(f_slow, [(x, x) for x in range(6)])
+        next_handle = mapper.submit_starmap(f_num, args_numerical)
+        with pytest.raises(TimeoutError):
+            handle.result(timeout=0.01)
+        assert not handle.done()
+        assert next_handle.result() == expected_results_numerical
+        assert handle.result() == [2*x for x in range(6)]
+        assert handle.done()
+        assert handle.partial_results() == [2*x for x in range(6)]
+        assert not handle.cancel()
+
+        handle = mapper.submit_starmap(f_slow, [(x, x) for x in range(20)])
+        while not handle.partial_results():
+            time.sleep(0.05)
+        assert handle.cancel()
+        with pytest.raises(umap.exceptions.MapCancelledError):
+            handle.result(timeout=3.0)
+        assert 0 < len(handle.partial_results()) < 20
+        with pytest.raises(ZeroDivisionError):
+            mapper.submit_starmap(f_inverse, [(1, 1), (0, 1), (2, 1)]).result()
+    assert no_new_children(children)
+
+
+# Pipelines
+
+def is_odd(x):
+    return x % 2 == 1
+
+
+def duplicate(x):
+    return x, x
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.futures', 'parallel.multiprocessing'])
+def test_pipeline(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        squares = umap.pipeline.Pipeline(args_numerical).starmap(f_num)
+        odd_squares = squares.filter(is_odd)
+        expected_results = [x for x in expected_results_numerical if is_odd(x)]
+        assert squares.run(mapper) == expected_results_numerical
+        assert odd_squares.run(mapper) == expected_results
+        assert list(odd_squares.run(mapper, stream=True)) == expected_results
+        assert odd_squares.map(str).map(duplicate).starmap(f_str).run(mapper) == [
+            f_str(str(x), str(x)) for x in expected_results]
+
+        # All stages are evaluated in the same worker process
+        pids = odd_squares.map(duplicate).starmap(f_pid).run(mapper)
+        assert len(pids) == len(expected_results)
+        if backend != 'serial':
+            assert os.getpid() not in pids
+
+        with pytest.raises(ZeroDivisionError):
+            umap.pipeline.Pipeline([(1, 1), (0, 1)]).starmap(f_inverse).run(mapper)
+        if backend != 'serial':
+            results = umap.pipeline.Pipeline([(1, 1), (0, 1)]).starmap(f_inverse).run(
+                mapper, error_policy='return_exceptions')
+            assert results[0] == 1.0
+            assert isinstance(results[1], ZeroDivisionError)
+
+
+def test_pipeline_validation():
+    with pytest.raises(ValueError):
+        umap.pipeline.Pipeline(args_numerical).run()
+
+
+# Map-reduce
+
+def concatenate(s1, s2):
+    return s1 + s2
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.dask', 'parallel.futures',
+                                     'parallel.joblib', 'parallel.multiprocessing'])
+def test_map_reduce(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        expected_result = sum(expected_results_numerical)
+        assert mapper.starmap_reduce(f_num, operator.add, args_numerical) == expected_result
+        assert mapper.starmap_reduce(f_num, operator.add, iter(args_numerical),
+                                     chunk_size=3) == expected_result
+        assert mapper.starmap_reduce(f_num, max, args_numerical, chunk_size=1) == max(
+            expected_results_numerical)
+
+        # Results are reduced in input order, which matters for non-commutative reducers
+        assert mapper.starmap_reduce(f_str, concatenate, args_str, initial='>') == ''.join(
+            ['>'] + expected_results_str)
+
+        assert mapper.starmap_reduce(f_num, operator.add, [], initial=0) == 0
+        with pytest.raises(TypeError):
+            mapper.starmap_reduce(f_num, operator.add, [])
+        with pytest.raises(ZeroDivisionError):
+            mapper.starmap_reduce(f_inverse, operator.add, [(1, 1), (0, 1), (2, 1)])
+
+
+def test_map_reduce_validation():
+    mapper = umap.mapper.Mapper('parallel.futures', num_workers=2)
+    with pytest.raises(ValueError):
+        mapper.starmap_reduce(f_num, operator.add, args_numerical, chunk_size=0)
+    with pytest.raises(ValueError):
+        mapper.starmap_reduce(f_num, operator.add, args_numerical, timeout=1.0)
+    with pytest.raises(ValueError):
+        mapper.starmap_reduce(f_num, operator.add, args_numerical,
+                              error_policy='return_exceptions')
+
+
+# Short-circuiting searches
+
+def f_fast_seven(x, y):
+    # Only the arguments with x equal to 7 are evaluated quickly
+    time.sleep(0.01 if x == 7 else 0.5)
+    return x + y
+
+
+def is_seven(x):
+    return x == 7
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.dask', 'parallel.futures',
+                                     'parallel.joblib', 'parallel.multiprocessing'])
+def test_search(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        args = [(0, 0, 0), (0, 0, 2), (1, 2, 3), (1, 0, 0)]
+        match = mapper.starfind_first(f_num, args, is_odd)
+        assert match == (3, (1, 0, 0), 1)
+        assert match.index == 3 and match.argument == (1, 0, 0) and match.result == 1
+        assert mapper.starfind_first(f_num, [(0, 0, 0)]) is None
+        assert mapper.any_starmap(f_num, args, is_odd)
+        assert not mapper.any_starmap(f_num, args[:3], is_odd)
+        assert not mapper.any_starmap(f_num, [])
+        assert mapper.all_starmap(f_num, args[1:])
+        assert not mapper.all_starmap(f_num, args)
+        assert mapper.all_starmap(f_num, [])
+        with pytest.raises(ZeroDivisionError):
+            mapper.starfind_first(f_inverse, [(1, 1), (0, 1), (2, 1)], is_seven)
+        assert mapper.starmap(f_num, args_numerical) == expected_results_numerical
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_search_stops_early(backend):
+    children = set(multiprocessing.active_children())
+    args = [(6, 0), (7, 0), (8, 0)] + [(x, 0) for x in range(20, 40)]
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        start_time = time.perf_counter()
+        assert mapper.starfind_first(f_fast_seven, args, is_seven, ordered=False) == (
+            1, (7, 0), 7)
+        assert mapper.any_starmap(f_fast_seven, args, is_seven)
+        assert time.perf_counter() - start_time < 2.0
+
+        # The ordered variant waits for all arguments before the match
+        start_time = time.perf_counter()
+        assert mapper.starfind_first(f_fast_seven, args, is_seven) == (1, (7, 0), 7)
+        assert 0.5 <= time.perf_counter() - start_time < 2.0
+    assert no_new_children(children)
+
+
+def test_search_validation():
+    mapper = umap.mapper.Mapper('parallel.futures', num_workers=2)
+    with pytest.raises(ValueError):
+        mapper.starfind_first(f_num, args_numerical, timeout=1.0)
+    with pytest.raises(ValueError):
+        mapper.any_starmap(f_num, args_numerical, error_policy='return_exceptions')
+
+
+# Columnar inputs
+
+def f_scaled(x, y, scale=1):
+    return (x + y) * scale
+
+
+columns_x = list(range(10))
+columns_y = [10 * x for x in range(10)]
+columns_scale = [x % 3 for x in range(10)]
+expected_results_columns = [f_scaled(*args) for args in zip(columns_x, columns_y)]
+expected_results_scaled = [f_scaled(*args) for args in zip(columns_x, columns_y, columns_scale)]
+
+
+@pytest.mark.parametrize('module, name', [
+    (umap.multivariate.serial, 'for_loop'),
+    (umap.multivariate.serial, 'generator_expression'),
+    (umap.multivariate.serial, 'generator_function'),
+    (umap.multivariate.serial, 'list_comprehension'),
+    (umap.multivariate.serial, 'map'),
+    (umap.multivariate.serial, 'starmap'),
+    (umap.multivariate.parallel, 'dask'),
+    (umap.multivariate.parallel, 'futures'),
+    (umap.multivariate.parallel, 'joblib'),
+    (umap.multivariate.parallel, 'multiprocessing'),
+])
+def test_columns(module, name):
+    function = getattr(module, name)
+    columns = umap.columns.Columns(columns_x, columns_y)
+    assert function(f_scaled, columns) == expected_results_columns
+    columns = umap.columns.Columns(columns_x, columns_y, scale=columns_scale)
+    assert function(f_scaled, columns) == expected_results_scaled
+    columns = dict(scale=columns_scale, y=columns_y, x=columns_x)
+    assert function(f_scaled, columns) == expected_results_scaled
+    assert function(f_scaled, umap.columns.Columns([], [])) == []
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_columns_parallel_options(backend):
+    function = getattr(umap.multivariate.parallel, backend)
+    columns = umap.columns.Columns(columns_x, columns_y, scale=columns_scale)
+    results = function(f_scaled, columns, num_cores=2, stream=True)
+    assert list(results) == expected_results_scaled
+    results = function(f_scaled, columns, num_cores=2, cost=f_scaled)
+    assert results == expected_results_scaled
+    if backend == 'multiprocessing' and 'fork' in multiprocessing.get_all_start_methods():
+        results = function(f_scaled, columns, num_cores=2, inherit_arguments=True)
+        assert results == expected_results_scaled
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        assert mapper.starmap_reduce(f_scaled, operator.add, columns) == sum(
+            expected_results_scaled)
+        assert mapper.starmap_reduce(f_scaled, operator.add, columns, chunk_size=3) == sum(
+            expected_results_scaled)
+        assert mapper.starfind_first(f_scaled, columns, is_odd) == (1, (1, 10, 1), 11)
+
+
+def test_columns_object():
+    columns = umap.columns.Columns(range(4), [0.5, 1.5, 2.5, 3.5], label='abcd')
+    assert len(columns) == 4
+    assert columns[1] == (1, 1.5, 'b')
+    assert list(columns) == [(0, 0.5, 'a'), (1, 1.5, 'b'), (2, 2.5, 'c'), (3, 3.5, 'd')]
+    part = columns[1:3]
+    assert len(part) == 2
+    assert part.columns == (range(1, 3), [1.5, 2.5], 'bc')
+    assert part.names == ('label',)
+    assert repr(part) == "Columns(2 positional, keywords=['label'], length=2)"
+    with pytest.raises(ValueError):
+        umap.columns.Columns()
+    with pytest.raises(ValueError):
+        umap.columns.Columns([1, 2], [1, 2, 3])
+
+
+def test_columns_data_frame():
+    pandas = pytest.importorskip('pandas')
+    frame = pandas.DataFrame(dict(x=columns_x, y=columns_y, scale=columns_scale))
+    assert umap.multivariate.serial.map(f_scaled, frame) == expected_results_scaled
+    assert umap.multivariate.parallel.futures(f_scaled, frame) == expected_results_scaled
+
+
+# Parameter grids
+
+def f_grid(x, y, z):
+    return f_str(str(x) + y, str(z))
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.dask', 'parallel.futures',
+                                     'parallel.joblib', 'parallel.multiprocessing'])
+def test_grid(backend):
+    axes = (range(4), 'abc', [7, 8])
+    grid = umap.grid.Grid(*axes)
+    expected_results = [f_str(str(x) + y, str(z)) for x, y, z in itertools.product(*axes)]
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        assert mapper.starmap(f_grid, grid) == expected_results
+        assert list(mapper.istarmap(f_grid, grid)) == expected_results
+        assert mapper.starmap(f_grid, umap.grid.Grid(range(4), 'abc', z=[7, 8])) == (
+            expected_results)
+        assert mapper.starmap(f_grid, umap.grid.Grid(range(4), [], [7, 8])) == []
+
+
+def test_grid_object():
+    axes = (range(4), 'abc', iter([7, 8]), range(3))
+    grid = umap.grid.Grid(*axes)
+    combinations = list(itertools.product(range(4), 'abc', [7, 8], range(3)))
+    assert grid.shape == (4, 3, 2, 3)
+    assert len(grid) == len(combinations)
+    assert list(grid) == combinations
+    assert [grid[i] for i in range(-len(grid), len(grid))] == combinations * 2
+    for start, stop in [(0, 1), (5, 6), (5, 17), (17, 40), (3, 71), (0, 72), (40, 40)]:
+        assert list(grid[start:stop]) == combinations[start:stop]
+    assert list(grid[::5]) == combinations[::5]
+    assert list(grid[40:3:-7]) == combinations[40:3:-7]
+    assert repr(grid[1:3]) == 'Grid(shape=(4, 3, 2, 3), keywords=[], indices=range(1, 3))'
+    with pytest.raises(ValueError):
+        umap.grid.Grid()
+
+
+def test_grid_reshape():
+    numpy = pytest.importorskip('numpy')
+    grid = umap.grid.Grid([1, 2], [10, 20, 30])
+    results = umap.multivariate.parallel.futures(operator.mul, grid)
+    assert grid.reshape(results).tolist() == [[10, 20, 30], [20, 40, 60]]
+    results = umap.multivariate.serial.map(divmod, grid)
+    assert grid.reshape(results).shape == (2, 3, 2)
+    assert isinstance(grid.reshape(results), numpy.ndarray)
+    with pytest.raises(ValueError):
+        grid[1:].reshape(results[1:])
+    with pytest.raises(ValueError):
+        grid.reshape(results[1:])
+
+
+# Deduplication
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_dedupe(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    args = args_numerical + args_numerical[::-1]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args, num_cores=2, dedupe=True, report=report)
+    assert results == expected_results_numerical + expected_results_numerical[::-1]
+    assert report.num_items == len(args_numerical)
+    assert report.events['saved_evaluations'] == len(args_numerical)
+
+    # Equal arguments of different types are evaluated separately
+    args = [(1, 2), (1.0, 2), (True, 2), (1, 2)]
+    results = parallel_map(operator.truediv, args, num_cores=2, dedupe=True, report=report)
+    assert results == [0.5] * 4
+    assert report.events['saved_evaluations'] == 1
+
+    grid = umap.grid.Grid([1, 2, 1], 'ab', [0])
+    results = parallel_map(f_grid, grid, num_cores=2, dedupe=True, report=report)
+    assert results == [f_grid(*args) for args in itertools.product([1, 2, 1], 'ab', [0])]
+    assert report.events['saved_evaluations'] == 2
+
+
+# Worker caches and key affinity
+
+def f_first_and_pid(x, y):
+    return x, os.getpid()
+
+
+def f_second(x, y):
+    return y
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_affinity_key(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    args = [(x, x % 4) for x in range(24)]
+    results = parallel_map(f_first_and_pid, args, num_cores=3, affinity_key=f_second)
+    assert [x for x, pid in results] == list(range(24))
+    pids = {}
+    for (x, y), (_, pid) in zip(args, results):
+        pids.setdefault(y, set()).add(pid)
+    assert all(len(key_pids) == 1 for key_pids in pids.values())
+
+    # The key function receives the values of columns like the function
+    columns = umap.columns.Columns(range(24), y=[x % 4 for x in range(24)])
+    results = parallel_map(f_first_and_pid, columns, num_cores=3, affinity_key=f_second)
+    assert [x for x, pid in results] == list(range(24))
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_worker_cache(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    args = args_numerical + args_numerical[::-1]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args, num_cores=1, worker_cache_size=100, report=report)
+    assert results == expected_results_numerical + expected_results_numerical[::-1]
+    assert report.events['cache_misses'] == len(args_numerical)
+    assert report.events['cache_hits'] == len(args_numerical)
+
+    # Equal arguments of different types are cached separately
+    results = parallel_map(operator.truediv, [(1, 2), (1.0, 2), (True, 2)], num_cores=1,
+                           worker_cache_size=100, report=report)
+    assert report.events['cache_misses'] == 3
+
+
+# Function registry
+
+class WeightedSum:
+    """Callable with a large closure that counts how often it is unpickled."""
+
+    num_unpickled = 0
+
+    def __init__(self, size):
+        self.weights = [1] * size
+
+    def __call__(self, x, y, z):
+        return x * self.weights[0] + y + z, WeightedSum.num_unpickled
+
+    def __setstate__(self, state):
+        WeightedSum.num_unpickled += 1
+        self.__dict__.update(state)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_function_registry(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    results = parallel_map(WeightedSum(100000), args_numerical, num_cores=2)
+    assert [value for value, num_unpickled in results] == [sum(args) for args in args_numerical]
+    assert {num_unpickled for value, num_unpickled in results} == {1}
+
+
+# Serializers
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_serializer(backend):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    results = parallel_map(lambda x, y, z: x**2 + y**2 + z**2, args_numerical, num_cores=2,
+                           serializer='cloudpickle')
+    assert results == expected_results_numerical
+
+    columns = umap.columns.Columns(range(3), [bytearray(2**20)] * 3)
+    results = parallel_map(lambda x, data: x + len(data), columns, num_cores=2,
+                           serializer='cloudpickle')
+    assert results == [2**20, 2**20 + 1, 2**20 + 2]
+
+
+# Typed results
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_result_dtype(backend):
+    numpy = pytest.importorskip('numpy')
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    results = parallel_map(f_num, args_numerical, num_cores=2, result_dtype='int64')
+    assert isinstance(results, numpy.ndarray) and results.dtype == numpy.int64
+    assert results.tolist() == expected_results_numerical
+
+    grid = umap.grid.Grid(range(10), range(20), [0.5, 1.5])
+    results = parallel_map(f_num, grid, num_cores=2, result_dtype='float64')
+    assert grid.reshape(results).tolist() == grid.reshape(
+        umap.multivariate.serial.map(f_num, grid)).tolist()
+
+
+# Sinks
+
+def f_record(x, y):
+    return dict(x=x, y=y, product=x * y)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_sink(backend, tmpdir):
+    parallel_map = getattr(umap.multivariate.parallel, backend)
+    sink = umap.sinks.Sink(str(tmpdir), batch_size=4)
+    manifest = parallel_map(f_num, args_numerical, num_cores=2, sink=sink)
+    assert list(manifest.read()) == expected_results_numerical
+
+    grid = umap.grid.Grid(range(5), range(7))
+    manifest = parallel_map(f_record, grid, num_cores=2, sink=sink)
+    assert manifest.num_results == len(grid)
+    assert list(manifest.read()) == umap.multivariate.serial.map(f_record, grid)
+
+
 # Distributed - tested by spawning scheduler and workers only locally on this machine
 
 @pytest.mark.parametrize('f, args, expected_results', testdata)
@@ -151,6 +1081,50 @@ def test_distributed_dask(f, args, expected_results):
         proc.terminate()  # "exit handlers and finally clauses, etc., will not be executed."
 
 
+def test_distributed_remote_validation():
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures').starmap_remote(f_num, args_numerical)
+    umap.cluster_setup.dask._connection = None
+    with pytest.raises(ConnectionError):
+        umap.mapper.Mapper('distributed.dask').starmap_remote(f_num, args_numerical)
+
+
+def test_distributed_dask_remote():
+    scheduler_address = get_unused_port('127.0.0.1', start_port=8789)
+    processes = []
+    proc = run_func_in_background_process(
+        umap.cluster_setup.dask.start_scheduler, scheduler_address)
+    processes.append(proc)
+    time.sleep(0.3)
+    for _ in range(4):
+        proc = run_func_in_background_process(
+            umap.cluster_setup.dask.start_worker, scheduler_address)
+        processes.append(proc)
+    umap.cluster_setup.dask.connect_to_scheduler(scheduler_address)
+
+    # Follow-up steps on results that stay on the cluster
+    mapper = umap.mapper.Mapper('distributed.dask')
+    expected_odd_results = [x for x in expected_results_numerical if is_odd(x)]
+    with mapper.starmap_remote(f_num, args_numerical) as results:
+        odd_results = results.filter(is_odd)
+        assert results.gather() == expected_results_numerical
+        assert odd_results.map(str).gather() == [str(x) for x in expected_odd_results]
+        assert results.reduce(operator.add) == sum(expected_results_numerical)
+        assert odd_results.reduce(operator.add, 100) == 100 + sum(expected_odd_results)
+        assert results.map(duplicate).starmap(operator.add).gather() == [
+            2*x for x in expected_results_numerical]
+
+    # Derived results stay available when the results they were derived from are released
+    results = mapper.starmap_remote(f_num, args_numerical)
+    str_results = results.map(str)
+    results.release()
+    assert str_results.gather() == [str(x) for x in expected_results_numerical]
+    str_results.release()
+
+    for proc in processes:
+        proc.terminate()  # "exit handlers and finally clauses, etc., will not be executed."
+
+
 @pytest.mark.parametrize('f, args, expected_results', testdata)
 def test_distributed_spark_fail(f, args, expected_results):
     # No connection to scheduler (problem: dependency on other tests -> set to None explicitely)
@@ -1,4 +1,11 @@
+import gc
+import itertools
 import multiprocessing
+import operator
+import os
+import signal
+import sys
+import threading
 import time
 
 import pytest
@@ -112,6 +119,1130 @@ def test_parallel_multiprocessing(f, args, expected_results):
     assert results == expected_results
 
 
+@pytest.mark.parametrize('f, args, expected_results', testdata)
+def test_parallel_multiprocessing_inherit_arguments(f, args, expected_results):
+    results = umap.univariate.parallel.multiprocessing(f, args, inherit_arguments=True)
+    assert results == expected_results
+
+
+def test_parallel_multiprocessing_inherit_unpicklable_arguments():
+    # Lambdas can not be pickled, but forked workers inherit them without serialization
+    args = [lambda i=i: i*10 for i in range(7)]
+    results = umap.univariate.parallel.multiprocessing(
+        lambda g: g()+1, args, num_cores=2, inherit_arguments=True)
+    assert results == [i*10+1 for i in range(7)]
+    assert umap.univariate.parallel.multiprocessing(f_num, [], inherit_arguments=True) == []
+
+
+def test_parallel_multiprocessing_inherit_arguments_concurrently():
+    # Calls from several threads each evaluate their own inherited arguments
+    def run(offset, results):
+        args = list(range(offset, offset + 50))
+        results[offset] = umap.univariate.parallel.multiprocessing(
+            f_num, args, num_cores=2, inherit_arguments=True, max_tasks_per_worker=2)
+
+    results = {}
+    threads = [threading.Thread(target=run, args=(offset, results))
+               for offset in range(0, 400, 100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {offset: [x**2 for x in range(offset, offset + 50)]
+                       for offset in range(0, 400, 100)}
+
+
+# Worker setup - tested with all parallel backends
+
+def initializer_offset(offset):
+    umap.worker.state['offset'] = offset
+    umap.worker.state['num_initializations'] = (
+        umap.worker.state.get('num_initializations', 0) + 1)
+
+
+def warmup_sleep():
+    time.sleep(0.01)
+
+
+def f_offset(x):
+    return x + umap.worker.state['offset'], umap.worker.state['num_initializations']
+
+args_offset = list(range(12))
+expected_results_offset = [(x + 100, 1) for x in args_offset]
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_initializer_and_warmup(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_offset, args_offset, num_cores=2, initializer=initializer_offset,
+                           initargs=(100,), warmup=warmup_sleep, report=report)
+    assert results == expected_results_offset
+    assert report.num_items == len(args_offset)
+    assert 1 <= report.num_workers <= 2
+    assert report.setup_time >= 0.01 * report.num_workers
+    for worker in report.workers.values():
+        assert worker['setup_time'] >= 0.01
+    assert report.wall_time > 0.0
+
+
+def test_parallel_multiprocessing_initializer_with_inherited_arguments():
+    report = umap.instrumentation.Report()
+    results = umap.univariate.parallel.multiprocessing(
+        f_offset, args_offset, num_cores=2, inherit_arguments=True,
+        initializer=initializer_offset, initargs=(100,), report=report)
+    assert results == expected_results_offset
+    assert report.num_tasks == 8
+
+
+def initializer_pid():
+    umap.worker.state['initialized_in'] = os.getpid()
+
+
+def f_initialized_here(x):
+    return umap.worker.state.get('initialized_in') == os.getpid()
+
+
+def test_parallel_initializer_after_in_process_call():
+    pytest.importorskip('joblib')
+    with umap.mapper.Mapper('parallel.joblib', num_workers=2,
+                            initializer=initializer_pid) as mapper:
+        # A memory budget for a single job evaluates the tasks in this process
+        assert all(mapper.map(f_initialized_here, args_numerical, memory_per_task=100,
+                              max_inflight_bytes=150))
+        # Forked workers run the shared setup again instead of inheriting its token
+        assert all(mapper.map(f_initialized_here, args_numerical))
+
+
+# Straggler mitigation
+
+def f_straggler(arg):
+    # The first attempt for x=0 is artificially delayed, a speculative duplicate is not
+    x, marker_filepath = arg
+    if x == 0 and not os.path.exists(marker_filepath):
+        open(marker_filepath, 'w').close()
+        time.sleep(5.0)
+    time.sleep(0.05)
+    return x**2
+
+
+def test_parallel_futures_speculation(tmpdir):
+    marker_filepath = str(tmpdir.join('marker'))
+    args = [(x, marker_filepath) for x in range(8)]
+    expected_results = [x**2 for x in range(8)]
+    speculation = umap.policies.Speculation(quantile=0.5, multiplier=3.0, poll_interval=0.01)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    results = umap.univariate.parallel.futures(f_straggler, args, num_cores=3,
+                                               speculation=speculation, report=report)
+    assert time.time() - start < 4.0
+    assert results == expected_results
+    assert report.events['speculative_launches'] >= 1
+    assert report.events['speculative_wins'] >= 1
+
+
+def test_speculation_validation():
+    with pytest.raises(ValueError):
+        umap.policies.Speculation(quantile=1.5)
+    with pytest.raises(ValueError):
+        umap.policies.Speculation(multiplier=0.0)
+
+
+# Fault tolerance
+
+def f_inverse(x):
+    return 1/x
+
+
+def f_flaky(arg):
+    x, directory = arg
+    # Fails at the first attempt for each odd x
+    marker_filepath = os.path.join(directory, 'flaky_{}'.format(x))
+    if x % 2 == 1 and not os.path.exists(marker_filepath):
+        open(marker_filepath, 'w').close()
+        raise ValueError('flaky')
+    return x**2
+
+
+def f_crash(arg):
+    x, directory = arg
+    # Kills its own worker process at the first attempt for x=3, always for x=5
+    marker_filepath = os.path.join(directory, 'crash_{}'.format(x))
+    if x == 5 or (x == 3 and not os.path.exists(marker_filepath)):
+        open(marker_filepath, 'w').close()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return x**2
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_error_policies(backend, tmpdir):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    with pytest.raises(ZeroDivisionError):
+        parallel_map(f_inverse, [1, 0, 2], num_cores=2)
+
+    results = parallel_map(f_inverse, [1, 0, 2], num_cores=2, error_policy='return_exceptions')
+    assert results[0] == 1.0
+    assert isinstance(results[1], ZeroDivisionError)
+    assert results[2] == 0.5
+
+    args = [(x, str(tmpdir)) for x in range(6)]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_flaky, args, num_cores=2, error_policy=umap.policies.Retry(1),
+                           report=report)
+    assert results == [x**2 for x in range(6)]
+    assert report.events['retries'] == 3
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_crash(backend, tmpdir):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = [(x, str(tmpdir)) for x in range(5)]
+    with pytest.raises(umap.exceptions.WorkerCrashError):
+        parallel_map(f_crash, args, num_cores=2)
+
+    for marker_filepath in tmpdir.listdir():
+        marker_filepath.remove()
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_crash, args, num_cores=2, error_policy=umap.policies.Retry(2),
+                           report=report)
+    assert results == [x**2 for x in range(5)]
+    assert report.events['worker_crashes'] >= 1
+
+    args = [(x, str(tmpdir)) for x in range(7)]
+    results = parallel_map(f_crash, args, num_cores=2, error_policy='return_exceptions')
+    assert isinstance(results[5], umap.exceptions.WorkerCrashError)
+    assert results[:5] == [x**2 for x in range(5)]
+    assert results[6] == 36
+
+
+def test_error_policy_validation():
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.futures(f_inverse, [1, 0, 2], error_policy='ignore')
+    with pytest.raises(ValueError):
+        umap.policies.Retry(num_retries=-1)
+    with pytest.raises(ValueError):
+        umap.policies.Retry(then='ignore')
+
+
+# Time limits
+
+def f_hang(x):
+    # Hangs for x=2
+    if x == 2:
+        time.sleep(60)
+    return x**2
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_timeout(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    results = parallel_map(f_hang, [0, 1, 2, 3, 4], num_cores=2, timeout=1.0, report=report)
+    assert time.time() - start < 10
+    assert isinstance(results[2], umap.exceptions.TaskTimeoutError)
+    results[2] = None
+    assert results == [0, 1, None, 9, 16]
+    assert report.events['timeouts'] == 1
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_deadline(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    start = time.time()
+    results = parallel_map(f_hang, [0, 1, 2, 3], num_cores=1, deadline=2.0, report=report)
+    assert time.time() - start < 10
+    # The task for x=2 was still running at the deadline and the one for x=3 never started
+    for result in results[2:]:
+        assert isinstance(result, umap.exceptions.DeadlineExceededError)
+    results[2:] = [None, None]
+    assert results == [0, 1, None, None]
+    assert report.events['deadline_exceeded'] == 2
+
+
+# Cost-aware scheduling
+
+def f_cost(x):
+    return x
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_cost(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+    expected_results = [x**2 for x in args]
+    assert parallel_map(f_num, args, num_cores=2, cost=f_cost) == expected_results
+    assert parallel_map(f_num, args, num_cores=2, cost=args) == expected_results
+    assert parallel_map(f_num, args, num_cores=2, cost=[0] * len(args)) == expected_results
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args, num_cores=2, cost=[1, 2])
+
+
+def test_parallel_multiprocessing_cost_with_inherited_arguments():
+    args = list(range(30))
+    results = umap.univariate.parallel.multiprocessing(
+        f_num, args, num_cores=2, inherit_arguments=True, cost=f_cost)
+    assert results == [x**2 for x in args]
+
+
+# Worker recycling
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_recycling(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args_numerical, num_cores=2, max_tasks_per_worker=2,
+                           report=report)
+    assert results == expected_results_numerical
+    assert report.events['worker_recycles'] >= 1
+    assert report.num_workers > 2
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, max_worker_memory=1,
+                           report=report)
+    assert results == expected_results_numerical
+    assert report.events['worker_recycles'] >= 2
+    for worker in report.workers.values():
+        assert worker['peak_memory'] > 1
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_recycling_after_in_process_call(backend):
+    pytest.importorskip('joblib')
+    # A single job evaluates its tasks in this process, whose forks must not count them
+    umap.univariate.parallel.joblib(f_num, list(range(40)), num_cores=1)
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args_numerical, num_cores=2, max_tasks_per_worker=2,
+                           report=report)
+    assert results == expected_results_numerical
+    assert 1 <= report.events['worker_recycles'] <= len(args_numerical) // 2
+
+
+# Memory-aware concurrency
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_memory_budget(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args_numerical, num_cores=4, memory_per_task=100,
+                           max_inflight_bytes=150, report=report)
+    assert results == expected_results_numerical
+    assert report.num_workers == 1
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, memory_per_task=1)
+    assert results == expected_results_numerical
+
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args_numerical, max_inflight_bytes=100)
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args_numerical, memory_per_task=0)
+
+
+# Streaming
+
+def generate_arguments(pulled):
+    for x in itertools.count():
+        pulled.append(x)
+        yield x
+
+
+@pytest.mark.parametrize('name', ['generator_expression', 'generator_function', 'map', 'starmap'])
+def test_serial_stream(name):
+    serial_map = getattr(umap.univariate.serial, name)
+    pulled = []
+    results = serial_map(f_num, generate_arguments(pulled), stream=True)
+    assert list(itertools.islice(results, 10)) == [f_num(x) for x in range(10)]
+    assert len(pulled) == 10
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_stream(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    pulled = []
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, generate_arguments(pulled), num_cores=2, stream=True,
+                           prefetch=4, report=report)
+    assert list(itertools.islice(results, 10)) == [f_num(x) for x in range(10)]
+    results.close()
+    assert len(pulled) <= 10 + 4
+
+    results = parallel_map(f_num, args_numerical, num_cores=2, stream=True, report=report)
+    assert list(results) == expected_results_numerical
+    assert report.num_items == len(args_numerical)
+
+
+def test_parallel_stream_validation():
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.futures(f_num, args_numerical, stream=True, cost=[1] * 10)
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.multiprocessing(
+            f_num, args_numerical, stream=True, inherit_arguments=True)
+
+
+# Background producer
+
+def generate_slowly(num_arguments):
+    for x in range(num_arguments):
+        time.sleep(0.01)
+        yield x
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+@pytest.mark.parametrize('producer', ['thread', 'process'])
+def test_parallel_producer(backend, producer):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, generate_slowly(10), num_cores=2, producer=producer,
+                           report=report)
+    assert results == [f_num(x) for x in range(10)]
+    assert report.production_time >= 0.1
+    assert report.consumer_stall_time > 0.0
+
+    producer = umap.policies.Producer(kind=producer, buffer_size=2)
+    results = parallel_map(f_num, generate_slowly(10), num_cores=2, producer=producer,
+                           stream=True, report=report)
+    assert list(results) == [f_num(x) for x in range(10)]
+    assert report.production_time >= 0.1
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_producer_closed_early(backend):
+    # The producer thread is inside next() of the generator when the stream is closed and
+    # then finds the buffer full, which must not block closing
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    producer = umap.policies.Producer(kind='thread', buffer_size=1)
+    results = parallel_map(f_num, generate_slowly(100), num_cores=2, producer=producer,
+                           stream=True)
+    assert [next(results) for _ in range(3)] == [0, 1, 4]
+    closer = threading.Thread(target=results.close, daemon=True)
+    closer.start()
+    closer.join(timeout=10.0)
+    assert not closer.is_alive()
+
+
+def test_producer_validation():
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.futures(f_num, args_numerical, producer='fiber')
+    with pytest.raises(ValueError):
+        umap.policies.Producer(buffer_size=0)
+
+
+# Teardown and cancellation
+
+def f_slow(x):
+    time.sleep(0.5)
+    return x
+
+
+def count_open_files():
+    gc.collect()
+    return len(os.listdir('/proc/self/fd'))
+
+
+def no_new_children(children_before):
+    return set(multiprocessing.active_children()) <= children_before
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='requires /proc/self/fd')
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_teardown(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    parallel_map(f_num, args_numerical, num_cores=2)
+    num_open_files = count_open_files()
+    for _ in range(3):
+        parallel_map(f_num, args_numerical, num_cores=2)
+        with pytest.raises(ZeroDivisionError):
+            parallel_map(f_inverse, [1, 0, 2], num_cores=2)
+        results = parallel_map(f_num, args_numerical, num_cores=2, stream=True)
+        next(results)
+        results.close()
+    assert no_new_children(children)
+    assert count_open_files() <= num_open_files
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+@pytest.mark.parametrize('stream', [False, True])
+def test_parallel_cancel(backend, stream):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    token = umap.policies.CancelToken()
+    timer = threading.Timer(0.3, token.cancel)
+    timer.start()
+    start_time = time.perf_counter()
+    with pytest.raises(umap.exceptions.MapCancelledError):
+        results = parallel_map(f_slow, list(range(20)), num_cores=2, prefetch=2, stream=stream,
+                               cancel_token=token)
+        list(results)
+    assert time.perf_counter() - start_time < 3.0
+    assert no_new_children(children)
+    assert token.cancelled
+
+    # A cancelled token stops further calls before any argument is evaluated
+    with pytest.raises(umap.exceptions.MapCancelledError):
+        parallel_map(f_num, args_numerical, num_cores=2, cancel_token=token)
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_keyboard_interrupt(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    children = set(multiprocessing.active_children())
+    timer = threading.Timer(0.3, os.kill, args=(os.getpid(), signal.SIGINT))
+    timer.start()
+    start_time = time.perf_counter()
+    with pytest.raises(KeyboardInterrupt):
+        parallel_map(f_slow, list(range(20)), num_cores=2)
+    assert time.perf_counter() - start_time < 3.0
+    assert no_new_children(children)
+
+
+# Mapper
+
+def f_pid(x):
+    return os.getpid()
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_mapper(backend):
+    children = set(multiprocessing.active_children())
+    report = umap.instrumentation.Report()
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2,
+                            initializer=initializer_offset, initargs=(100,),
+                            report=report) as mapper:
+        # Worker processes and their setup are kept alive between map calls
+        pids = set()
+        for _ in range(3):
+            assert mapper.map(f_offset, args_offset) == expected_results_offset
+            pids.update(mapper.map(f_pid, list(range(20))))
+        assert len(pids) <= 2
+        assert report.num_items == 20
+
+        results = mapper.imap(f_num, iter(args_numerical))
+        assert not isinstance(results, list)
+        assert list(results) == expected_results_numerical
+        assert mapper.map(f_str, args_str, report=None) == expected_results_str
+
+        # A failed map call does not affect later ones
+        with pytest.raises(ZeroDivisionError):
+            mapper.map(f_inverse, [1, 0, 2])
+        assert mapper.map(f_offset, args_offset) == expected_results_offset
+
+        futures = [mapper.submit(f_offset, x) for x in args_offset]
+        assert [future.result() for future in futures] == expected_results_offset
+        assert isinstance(mapper.submit(f_inverse, 0).exception(), ZeroDivisionError)
+    assert no_new_children(children)
+
+    # Without a with statement each map call has its own worker processes
+    mapper = umap.mapper.Mapper('parallel.' + backend, num_workers=2)
+    assert mapper.map(f_num, args_numerical) == expected_results_numerical
+    assert mapper.submit(f_num, 3).result() == 9
+    mapper.close()
+    assert no_new_children(children)
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_mapper_submit_worker_crash(backend, tmpdir):
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        futures = [mapper.submit(f_slow, 1), mapper.submit(f_crash, (5, str(tmpdir)))]
+        for future in futures:
+            exception = future.exception(timeout=30.0)
+            assert exception is None or isinstance(exception, umap.exceptions.WorkerCrashError)
+        assert isinstance(futures[1].exception(), umap.exceptions.WorkerCrashError)
+        # Later calls run on fresh workers
+        assert mapper.submit(f_num, 3).result(timeout=30.0) == 9
+
+
+@pytest.mark.parametrize('backend', ['dask', 'joblib'])
+def test_mapper_without_persistent_workers(backend):
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        assert mapper.map(f_num, args_numerical) == expected_results_numerical
+        assert list(mapper.imap(f_str, args_str)) == expected_results_str
+        assert mapper.submit(f_num, 3).result() == 9
+
+
+def test_mapper_serial():
+    mapper = umap.mapper.Mapper()
+    assert mapper.map(f_num, args_numerical) == expected_results_numerical
+    assert list(mapper.imap(f_str, args_str)) == expected_results_str
+    assert mapper.submit(f_num, 3).result() == 9
+    assert isinstance(mapper.submit(f_inverse, 0).exception(), ZeroDivisionError)
+
+
+def test_mapper_validation():
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.threads')
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('serial', num_workers=2)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('distributed.dask', num_workers=2)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures', num_workers=0)
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures', stream=True)
+    with pytest.raises(ConnectionError):
+        umap.mapper.Mapper('distributed.spark').map(f_num, args_numerical)
+
+
+# Non-blocking map calls
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.futures', 'parallel.multiprocessing'])
+def test_mapper_submit_map(backend):
+    children = set(multiprocessing.active_children())
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        handle = mapper.submit_map(f_slow, list(range(6)))
+        next_handle = mapper.submit_map(f_num, args_numerical)
+        with pytest.raises(TimeoutError):
+            handle.result(timeout=0.01)
+        assert not handle.done()
+        assert next_handle.result() == expected_results_numerical
+        assert handle.result() == list(range(6))
+        assert handle.done()
+        assert handle.partial_results() == list(range(6))
+        assert not handle.cancel()
+
+        handle = mapper.submit_map(f_slow, list(range(20)))
+        while not handle.partial_results():
+            time.sleep(0.05)
+        assert handle.cancel()
+        with pytest.raises(umap.exceptions.MapCancelledError):
+            handle.result(timeout=3.0)
+        assert 0 < len(handle.partial_results()) < 20
+        with pytest.raises(ZeroDivisionError):
+            mapper.submit_map(f_inverse, [1, 0, 2]).result()
+    assert no_new_children(children)
+
+
+# Pipelines
+
+def is_odd(x):
+    return x % 2 == 1
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.futures', 'parallel.multiprocessing'])
+def test_pipeline(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        squares = umap.pipeline.Pipeline(args_numerical).map(f_num)
+        odd_squares = squares.filter(is_odd)
+        expected_results = [x for x in expected_results_numerical if is_odd(x)]
+        assert squares.run(mapper) == expected_results_numerical
+        assert odd_squares.run(mapper) == expected_results
+        assert list(odd_squares.run(mapper, stream=True)) == expected_results
+        assert odd_squares.map(str).map(f_str).run(mapper) == [
+            f_str(str(x)) for x in expected_results]
+
+        # All stages are evaluated in the same worker process
+        pids = odd_squares.map(f_pid).run(mapper)
+        assert len(pids) == len(expected_results)
+        if backend != 'serial':
+            assert os.getpid() not in pids
+
+        with pytest.raises(ZeroDivisionError):
+            umap.pipeline.Pipeline([1, 0]).map(f_inverse).run(mapper)
+        if backend != 'serial':
+            results = umap.pipeline.Pipeline([1, 0]).map(f_inverse).run(
+                mapper, error_policy='return_exceptions')
+            assert results[0] == 1.0
+            assert isinstance(results[1], ZeroDivisionError)
+
+
+def test_pipeline_validation():
+    with pytest.raises(ValueError):
+        umap.pipeline.Pipeline(args_numerical).run()
+
+
+# Map-reduce
+
+def concatenate(s1, s2):
+    return s1 + s2
+
+
+# Processes in which add_and_record() was called, as seen by the calling process
+reducing_pids = []
+
+
+def add_and_record(x, y):
+    reducing_pids.append(os.getpid())
+    return x + y
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.dask', 'parallel.futures',
+                                     'parallel.joblib', 'parallel.multiprocessing'])
+def test_map_reduce(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        expected_result = sum(expected_results_numerical)
+        assert mapper.map_reduce(f_num, operator.add, args_numerical) == expected_result
+        assert mapper.map_reduce(f_num, operator.add, iter(args_numerical),
+                                 chunk_size=3) == expected_result
+        assert mapper.map_reduce(f_num, max, args_numerical, chunk_size=1) == max(
+            expected_results_numerical)
+
+        # Results are reduced in input order, which matters for non-commutative reducers
+        assert mapper.map_reduce(f_str, concatenate, args_str, initial='>') == ''.join(
+            ['>'] + expected_results_str)
+
+        assert mapper.map_reduce(f_num, operator.add, [], initial=0) == 0
+        with pytest.raises(TypeError):
+            mapper.map_reduce(f_num, operator.add, [])
+        with pytest.raises(ZeroDivisionError):
+            mapper.map_reduce(f_inverse, operator.add, [1, 0, 2])
+
+        # Partial values are reduced as a tree, mostly by the workers
+        del reducing_pids[:]
+        assert mapper.map_reduce(f_num, add_and_record, args_numerical, chunk_size=1) == (
+            expected_result)
+        if backend != 'serial':
+            assert len(reducing_pids) <= 1
+
+
+def test_map_reduce_validation():
+    mapper = umap.mapper.Mapper('parallel.futures', num_workers=2)
+    with pytest.raises(ValueError):
+        mapper.map_reduce(f_num, operator.add, args_numerical, chunk_size=0)
+    with pytest.raises(ValueError):
+        mapper.map_reduce(f_num, operator.add, args_numerical, timeout=1.0)
+    with pytest.raises(ValueError):
+        mapper.map_reduce(f_num, operator.add, args_numerical,
+                          error_policy='return_exceptions')
+
+
+# Short-circuiting searches
+
+def f_fast_seven(x):
+    # Only the argument 7 is evaluated quickly
+    time.sleep(0.01 if x == 7 else 0.5)
+    return x
+
+
+def is_seven(x):
+    return x == 7
+
+
+@pytest.mark.parametrize('backend', ['serial', 'parallel.dask', 'parallel.futures',
+                                     'parallel.joblib', 'parallel.multiprocessing'])
+def test_search(backend):
+    num_workers = None if backend == 'serial' else 2
+    with umap.mapper.Mapper(backend, num_workers=num_workers) as mapper:
+        match = mapper.find_first(f_num, [0, 0, 3, -4, 0], is_odd)
+        assert match == (2, 3, 9)
+        assert match.index == 2 and match.argument == 3 and match.result == 9
+        assert mapper.find_first(f_num, [0, 0]) is None
+        assert mapper.any_map(f_num, args_numerical, is_odd)
+        assert not mapper.any_map(f_num, [0, 2, 4], is_odd)
+        assert not mapper.any_map(f_num, [])
+        assert mapper.all_map(f_num, [1, 3, 5], is_odd)
+        assert not mapper.all_map(f_num, [1, 2, 3], is_odd)
+        assert mapper.all_map(f_num, [])
+        with pytest.raises(ZeroDivisionError):
+            mapper.find_first(f_inverse, [1, 0, 2], is_seven)
+        assert mapper.map(f_num, args_numerical) == expected_results_numerical
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_search_stops_early(backend):
+    children = set(multiprocessing.active_children())
+    args = [6, 7, 8] + list(range(20, 40))
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2) as mapper:
+        start_time = time.perf_counter()
+        assert mapper.find_first(f_fast_seven, args, is_seven, ordered=False) == (1, 7, 7)
+        assert mapper.any_map(f_fast_seven, args, is_seven)
+        assert time.perf_counter() - start_time < 2.0
+
+        # The ordered variant waits for all arguments before the match
+        start_time = time.perf_counter()
+        assert mapper.find_first(f_fast_seven, args, is_seven) == (1, 7, 7)
+        assert 0.5 <= time.perf_counter() - start_time < 2.0
+    assert no_new_children(children)
+
+
+def test_search_validation():
+    mapper = umap.mapper.Mapper('parallel.futures', num_workers=2)
+    with pytest.raises(ValueError):
+        mapper.find_first(f_num, args_numerical, timeout=1.0)
+    with pytest.raises(ValueError):
+        mapper.any_map(f_num, args_numerical, error_policy='return_exceptions')
+
+
+# Deduplication
+
+def f_len(x):
+    return len(x)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_dedupe(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args, num_cores=2, dedupe=True, report=report)
+    assert results == [x**2 for x in args]
+    assert report.num_items == 7
+    assert report.events['saved_evaluations'] == 4
+
+    # Unhashable arguments are compared by their pickled bytes
+    args = [[1, 2], [3], [1, 2], 'ab']
+    results = parallel_map(f_len, args, num_cores=2, dedupe=True, report=report)
+    assert results == [2, 1, 2, 2]
+    assert report.events['saved_evaluations'] == 1
+
+    # Equal arguments of different types are evaluated separately
+    results = parallel_map(repr, [1, 1.0, True, 1], num_cores=2, dedupe=True, report=report)
+    assert results == ['1', '1.0', 'True', '1']
+    assert report.events['saved_evaluations'] == 1
+    args = [((1,),), ((1.0,),), (frozenset([True]),), (frozenset([1]),), ((1,),)]
+    results = parallel_map(repr, args, num_cores=2, dedupe=True, report=report)
+    assert results == [repr(arg) for arg in args]
+    assert report.events['saved_evaluations'] == 1
+
+    assert parallel_map(f_num, [], num_cores=2, dedupe=True) == []
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args, num_cores=2, dedupe=True, stream=True)
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_dedupe_with_options(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+    expected_results = [x**2 for x in args]
+    assert parallel_map(f_num, args, num_cores=2, dedupe=True, cost=args) == expected_results
+    assert parallel_map(f_num, args, num_cores=2, dedupe=True, cost=f_cost) == (
+        expected_results)
+    with pytest.raises(ValueError):
+        parallel_map(f_num, args, num_cores=2, dedupe=True, cost=[1, 2])
+    results = parallel_map(f_inverse, [1, 0, 1, 0], num_cores=2, dedupe=True,
+                           error_policy='return_exceptions')
+    assert results[0] == results[2] == 1.0
+    assert isinstance(results[1], ZeroDivisionError) and results[1] is results[3]
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2, dedupe=True) as mapper:
+        assert mapper.map(f_num, args) == expected_results
+        with pytest.raises(ValueError):
+            mapper.map_reduce(f_num, operator.add, args)
+
+    # Arguments that can neither be hashed nor pickled are evaluated each time
+    pytest.importorskip('cloudpickle')
+    args = [[1, 2], [lambda: None], [lambda: None], [1, 2]]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_len, args, num_cores=2, dedupe=True, serializer='cloudpickle',
+                           report=report)
+    assert results == [2, 1, 1, 2]
+    assert report.events['saved_evaluations'] == 1
+
+
+# Worker caches and key affinity
+
+def f_num_and_pid(x):
+    return x**2, os.getpid()
+
+
+def f_mod_3(x):
+    return x % 3
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_affinity_key(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = list(range(30))
+    for timeout in [None, 10]:
+        results = parallel_map(f_num_and_pid, args, num_cores=3, affinity_key=f_mod_3,
+                               timeout=timeout)
+        assert [value for value, pid in results] == [x**2 for x in args]
+        pids = {}
+        for x, (value, pid) in zip(args, results):
+            pids.setdefault(f_mod_3(x), set()).add(pid)
+        assert all(len(key_pids) == 1 for key_pids in pids.values())
+    for options in [dict(stream=True), dict(cost=args)]:
+        with pytest.raises(ValueError):
+            list(parallel_map(f_num, args, affinity_key=f_mod_3, **options))
+    with umap.mapper.Mapper('parallel.' + backend, affinity_key=f_mod_3) as mapper:
+        with pytest.raises(ValueError):
+            mapper.map_reduce(f_num, operator.add, args)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_worker_cache(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    args = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+    report = umap.instrumentation.Report()
+    results = parallel_map(f_num, args, num_cores=1, worker_cache_size=100, report=report)
+    assert results == [x**2 for x in args]
+    assert report.events['cache_misses'] == 7
+    assert report.events['cache_hits'] == 4
+    assert list(report.cache_hit_rates.values()) == [4 / 11]
+
+    # Unhashable arguments are evaluated without the cache
+    results = parallel_map(f_len, [[1], [1]], num_cores=1, worker_cache_size=100,
+                           report=report)
+    assert results == [1, 1]
+    assert 'cache_hits' not in report.events
+
+    # Equal arguments of different types are cached separately
+    results = parallel_map(repr, [1, 1.0, True, 1], num_cores=1, worker_cache_size=100)
+    assert results == ['1', '1.0', 'True', '1']
+    results = parallel_map(repr, [(1,), (1.0,), ((True,),)], num_cores=1, worker_cache_size=100)
+    assert results == ['(1,)', '(1.0,)', '((True,),)']
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_cache_after_in_process_call(backend):
+    pytest.importorskip('joblib')
+    args = [3, 1, 4, 1, 5]
+    # A single job fills the cache of this process, which forked workers must not inherit
+    umap.univariate.parallel.joblib(f_num, args, num_cores=1, worker_cache_size=100)
+    report = umap.instrumentation.Report()
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    results = parallel_map(f_num, args, num_cores=1, worker_cache_size=100, report=report)
+    assert results == [x**2 for x in args]
+    assert report.events['cache_misses'] == 4
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_worker_cache_with_mapper(backend):
+    args = list(range(20))
+    report = umap.instrumentation.Report()
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2, affinity_key=f_mod_3,
+                            worker_cache_size=100, report=report) as mapper:
+        assert mapper.map(f_num, args) == [x**2 for x in args]
+        assert report.events['cache_misses'] == 20
+        # Workers stay alive and each key is routed to the same worker as before
+        assert mapper.map(f_num, args) == [x**2 for x in args]
+        assert report.events['cache_hits'] == 20
+        assert 'cache_misses' not in report.events
+        assert set(report.cache_hit_rates.values()) == {1.0}
+
+
+# Function registry
+
+class LookupTable:
+    """Callable with a large closure that counts how often it is pickled and unpickled."""
+
+    num_pickled = 0
+    num_unpickled = 0
+
+    def __init__(self, size):
+        self.values = list(range(size))
+
+    def __call__(self, x):
+        return self.values[x], LookupTable.num_unpickled
+
+    def __getstate__(self):
+        LookupTable.num_pickled += 1
+        return self.__dict__
+
+    def __setstate__(self, state):
+        LookupTable.num_unpickled += 1
+        self.__dict__.update(state)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_function_registry(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    table = LookupTable(100000)
+    LookupTable.num_pickled = 0
+    results = parallel_map(table, args_numerical, num_cores=2)
+    assert [value for value, num_unpickled in results] == args_numerical
+    # Each worker loads the function once, no matter how many chunks it evaluates
+    assert {num_unpickled for value, num_unpickled in results} == {1}
+    assert LookupTable.num_pickled == 1
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_function_registry_with_mapper(backend):
+    table = LookupTable(100000)
+    LookupTable.num_pickled = 0
+    with umap.mapper.Mapper('parallel.' + backend, num_workers=2, timeout=10) as mapper:
+        for num_calls in range(1, 4):
+            results = mapper.map(table, args_numerical)
+            assert [value for value, num_unpickled in results] == args_numerical
+            # Workers that stay alive do not load the function again
+            assert {num_unpickled for value, num_unpickled in results} == {1}
+            assert LookupTable.num_pickled == num_calls
+
+    # Small functions are sent with each task
+    small_table = LookupTable(10)
+    results = umap.univariate.parallel.futures(small_table, args_numerical, num_cores=2,
+                                               timeout=10)
+    assert max(num_unpickled for value, num_unpickled in results) > 1
+
+
+# Serializers
+
+def f_zeros(n):
+    return bytearray(n)
+
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_serializer(backend):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    # Lambdas can only be sent to workers if they are pickled by value
+    results = parallel_map(lambda x: x**2, args_numerical, num_cores=2,
+                           serializer='cloudpickle')
+    assert results == expected_results_numerical
+
+    # Buffers are sent out-of-band in both directions
+    args = [bytearray(b'abc'), bytearray(2**20)]
+    assert parallel_map(f_len, args, num_cores=2, serializer='pickle') == [3, 2**20]
+    results = parallel_map(f_zeros, [3, 2**20], num_cores=2, serializer='pickle')
+    assert results == [bytearray(3), bytearray(2**20)]
+
+    serializer = umap.policies.Serializer(out_of_band=False)
+    results = parallel_map(f_inverse, [1, 0], num_cores=2, serializer=serializer,
+                           error_policy='return_exceptions')
+    assert results[0] == 1.0 and isinstance(results[1], ZeroDivisionError)
+
+
+@pytest.mark.parametrize('compression', ['lz4', 'zstd'])
+def test_parallel_serializer_compression(compression):
+    pytest.importorskip({'lz4': 'lz4.frame', 'zstd': 'zstandard'}[compression])
+    serializer = umap.policies.Serializer(compression=compression, compression_threshold=1000)
+    args = [bytearray(10), bytearray(2**20), bytes(2**20)]
+    results = umap.univariate.parallel.multiprocessing(f_len, args, serializer=serializer)
+    assert results == [10, 2**20, 2**20]
+
+
+def test_parallel_serializer_with_mapper():
+    with umap.mapper.Mapper('parallel.futures', num_workers=2,
+                            serializer='cloudpickle') as mapper:
+        assert mapper.map(lambda x: -x, [1, 2, 3]) == [-1, -2, -3]
+        assert mapper.map(lambda x: -x, [1, 2, 3], timeout=10) == [-1, -2, -3]
+        assert list(mapper.imap(lambda x: -x, [1, 2, 3])) == [-1, -2, -3]
+        assert mapper.submit(lambda x, y: x + y, 1, 2).result() == 3
+        assert mapper.map_reduce(f_num, operator.add, range(5)) == 30
+
+
+def test_serializer_validation():
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.futures(f_num, args_numerical, serializer='json')
+    with pytest.raises(ValueError):
+        umap.policies.Serializer(pickler='dill')
+    with pytest.raises(ValueError):
+        umap.policies.Serializer(compression='gzip')
+    with pytest.raises(ValueError):
+        umap.policies.Serializer(compression_threshold=-1)
+
+
+# Typed results
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_result_dtype(backend):
+    numpy = pytest.importorskip('numpy')
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    results = parallel_map(f_num, args_numerical, num_cores=2, result_dtype='int64')
+    assert isinstance(results, numpy.ndarray) and results.dtype == numpy.int64
+    assert results.tolist() == expected_results_numerical
+
+    results = parallel_map(f_inverse, [1, 2, 4, 1, 2], num_cores=2, result_dtype=numpy.float32,
+                           dedupe=True)
+    assert results.dtype == numpy.float32
+    assert results.tolist() == [1.0, 0.5, 0.25, 1.0, 0.5]
+
+    assert parallel_map(f_num, [], num_cores=2, result_dtype='float64').shape == (0,)
+
+
+@pytest.mark.parametrize('backend', ['futures', 'multiprocessing'])
+def test_parallel_result_dtype_out_of_order(backend):
+    pytest.importorskip('numpy')
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    # Chunks that are formed by cost or by key are put back into input order
+    results = parallel_map(f_num, args_numerical, num_cores=2, cost=f_cost,
+                           result_dtype='float64')
+    assert results.tolist() == expected_results_numerical
+    results = parallel_map(f_num, args_numerical, num_cores=2, affinity_key=f_mod_3,
+                           result_dtype='int32', serializer='pickle')
+    assert results.tolist() == expected_results_numerical
+
+
+def test_result_dtype_validation():
+    for options in [dict(stream=True), dict(timeout=10), dict(deadline=10),
+                    dict(error_policy='return_exceptions')]:
+        with pytest.raises(ValueError):
+            umap.univariate.parallel.futures(f_num, args_numerical, result_dtype='float64',
+                                             **options)
+    with umap.mapper.Mapper('parallel.futures', num_workers=2) as mapper:
+        with pytest.raises(ValueError):
+            mapper.map_reduce(f_num, operator.add, args_numerical, result_dtype='float64')
+
+    pytest.importorskip('numpy')
+    for result_dtype in ['bool', 'complex128', '>f8' if sys.byteorder == 'little' else '<f8']:
+        with pytest.raises(ValueError):
+            umap.univariate.parallel.futures(f_num, args_numerical, result_dtype=result_dtype)
+    # A result that does not fit into the dtype is reported by the worker
+    with pytest.raises(TypeError):
+        umap.univariate.parallel.futures(f_str, args_str, result_dtype='int64')
+
+
+# Sinks
+
+@pytest.mark.parametrize('backend', ['dask', 'futures', 'joblib', 'multiprocessing'])
+def test_parallel_sink(backend, tmpdir):
+    parallel_map = getattr(umap.univariate.parallel, backend)
+    directory = tmpdir.join('results')
+    sink = umap.sinks.Sink(str(directory), batch_size=3)
+    manifest = parallel_map(f_num, args_numerical, num_cores=2, sink=sink)
+    assert isinstance(manifest, umap.sinks.Manifest)
+    assert manifest.num_results == len(args_numerical)
+    assert list(manifest.read()) == expected_results_numerical
+
+    # Shards hold consecutive index ranges and are the only files in the directory
+    assert manifest.shards[0].start == 0
+    for shard, next_shard in zip(manifest.shards, manifest.shards[1:]):
+        assert shard.start < shard.stop == next_shard.start
+    assert sorted(os.path.basename(shard.path) for shard in manifest) == sorted(
+        path.basename for path in directory.listdir())
+    with open(manifest.shards[-1].path) as file:
+        assert file.read().splitlines()[-1] == str(expected_results_numerical[-1])
+
+
+@pytest.mark.parametrize('format, module', [('npy', 'numpy'), ('parquet', 'pyarrow')])
+def test_parallel_sink_formats(format, module, tmpdir):
+    pytest.importorskip(module)
+    sink = umap.sinks.Sink(str(tmpdir), format=format, batch_size=2)
+    manifest = umap.univariate.parallel.multiprocessing(f_num, args_numerical, sink=sink)
+    assert all(shard.path.endswith('.' + format) for shard in manifest)
+    assert [int(result) for result in manifest.read()] == expected_results_numerical
+
+
+def test_parallel_sink_with_errors(tmpdir):
+    sink = umap.sinks.Sink(str(tmpdir))
+    with pytest.raises(ZeroDivisionError):
+        umap.univariate.parallel.futures(f_inverse, [1, 2, 0, 4], sink=sink)
+    assert tmpdir.listdir() == []
+
+    # Shards of chunks without results are left out
+    manifest = umap.univariate.parallel.multiprocessing(f_num, [], sink=sink)
+    assert manifest.num_results == len(manifest) == 0
+
+
+def test_parallel_sink_with_mapper(tmpdir):
+    sink = umap.sinks.Sink(str(tmpdir), prefix='squares-')
+    with umap.mapper.Mapper('parallel.multiprocessing', num_workers=2, sink=sink) as mapper:
+        manifest = mapper.map(f_num, iter(args_numerical), producer='thread')
+        assert list(manifest.read()) == expected_results_numerical
+        assert len(mapper.map(f_num, args_numerical, inherit_arguments=True)) > 1
+    assert all(path.basename.startswith('squares-') for path in tmpdir.listdir())
+
+
+def test_sink_validation(tmpdir):
+    sink = umap.sinks.Sink(str(tmpdir))
+    for options in [dict(stream=True), dict(dedupe=True), dict(cost=f_cost),
+                    dict(result_dtype='float64'), dict(timeout=10),
+                    dict(error_policy='return_exceptions')]:
+        with pytest.raises(ValueError):
+            umap.univariate.parallel.futures(f_num, args_numerical, sink=sink, **options)
+    with pytest.raises(ValueError):
+        umap.univariate.parallel.futures(f_num, args_numerical, sink=str(tmpdir))
+    with umap.mapper.Mapper('parallel.futures', num_workers=2) as mapper:
+        with pytest.raises(ValueError):
+            mapper.map_reduce(f_num, operator.add, args_numerical, sink=sink)
+    with pytest.raises(ValueError):
+        umap.sinks.Sink(str(tmpdir), format='csv')
+    with pytest.raises(ValueError):
+        umap.sinks.Sink(str(tmpdir), batch_size=0)
+    assert tmpdir.listdir() == []
+
+
 # Distributed - tested by spawning scheduler and workers only locally on this machine
 
 @pytest.mark.parametrize('f, args, expected_results', testdata)
@@ -151,6 +1282,56 @@ def test_distributed_dask(f, args, expected_results):
         proc.terminate()  # "exit handlers and finally clauses, etc., will not be executed."
 
 
+def test_distributed_remote_validation():
+    with pytest.raises(ValueError):
+        umap.mapper.Mapper('parallel.futures').map_remote(f_num, args_numerical)
+    umap.cluster_setup.dask._connection = None
+    with pytest.raises(ConnectionError):
+        umap.mapper.Mapper('distributed.dask').map_remote(f_num, args_numerical)
+
+    # A subclass for another framework fails when it is created, not when it is used
+    class IncompleteResults(umap.remote.RemoteResults):
+        def gather(self):
+            return []
+
+    with pytest.raises(TypeError):
+        IncompleteResults(setup=None)
+
+
+def test_distributed_dask_remote():
+    scheduler_address = get_unused_port('127.0.0.1', start_port=8789)
+    processes = []
+    proc = run_func_in_background_process(
+        umap.cluster_setup.dask.start_scheduler, scheduler_address)
+    processes.append(proc)
+    time.sleep(0.3)
+    for _ in range(4):
+        proc = run_func_in_background_process(
+            umap.cluster_setup.dask.start_worker, scheduler_address)
+        processes.append(proc)
+    umap.cluster_setup.dask.connect_to_scheduler(scheduler_address)
+
+    # Follow-up steps on results that stay on the cluster
+    mapper = umap.mapper.Mapper('distributed.dask')
+    expected_odd_results = [x for x in expected_results_numerical if is_odd(x)]
+    with mapper.map_remote(f_num, args_numerical) as results:
+        odd_results = results.filter(is_odd)
+        assert results.gather() == expected_results_numerical
+        assert odd_results.map(str).gather() == [str(x) for x in expected_odd_results]
+        assert results.reduce(operator.add) == sum(expected_results_numerical)
+        assert odd_results.reduce(operator.add, 100) == 100 + sum(expected_odd_results)
+
+    # Derived results stay available when the results they were derived from are released
+    results = mapper.map_remote(f_num, args_numerical)
+    str_results = results.map(str)
+    results.release()
+    assert str_results.gather() == [str(x) for x in expected_results_numerical]
+    str_results.release()
+
+    for proc in processes:
+        proc.terminate()  # "exit handlers and finally clauses, etc., will not be executed."
+
+
 @pytest.mark.parametrize('f, args, expected_results', testdata)
 def test_distributed_spark_fail(f, args, expected_results):
     # No connection to scheduler (problem: dependency on other tests -> set to None explicitely)
@@ -189,5 +1370,10 @@ def test_distributed_spark():
     results = umap.univariate.distributed.spark(f, args)
     assert results == expected_results
 
+    # Arguments are sent in the format of the serializer, here by value like the function
+    args = [lambda i=i: i for i in range(5)]
+    results = umap.univariate.distributed.spark(lambda g: g(), args, serializer='cloudpickle')
+    assert results == list(range(5))
+
     for proc in processes:
         proc.terminate()  # "exit handlers and finally clauses, etc., will not be executed."
@@ -1,10 +1,22 @@
 # Copyright 2018 Robert Haas
 # For license information, see LICENSE.TXT in the package root directory
 
-from . import cluster_setup, univariate, multivariate
+from . import cluster_setup, columns, exceptions, grid, instrumentation, mapper, pipeline
+from . import policies, remote, sinks, worker
+from . import univariate, multivariate
 
 __all__ = [
     'cluster_setup',
+    'columns',
+    'exceptions',
+    'grid',
+    'instrumentation',
+    'mapper',
+    'pipeline',
+    'policies',
+    'remote',
+    'sinks',
+    'worker',
     'univariate',
     'multivariate',
 ]
@@ -0,0 +1,1443 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Private helpers that are shared by the parallel and distributed backends.
+
+All backends evaluate the user-provided function with a picklable _ChunkTask, which
+processes a chunk of arguments inside a worker and returns an envelope of the form
+(results, info). The info dictionary carries timing data and event counts that are
+collected by a :class:`~unified_map.instrumentation.Report` in the parent process.
+Results are a list, an array of the array module if the map call has a result dtype, or
+a list with the description of a single shard if the map call writes to a sink.
+"""
+
+import array as _array
+import collections as _collections
+import contextlib as _contextlib
+import functools as _functools
+import os as _os
+import pickle as _pickle
+import socket as _socket
+import sys as _sys
+import threading as _threading
+import uuid as _uuid
+from itertools import count as _count
+from itertools import islice as _islice
+from itertools import starmap as _starmap
+from multiprocessing import get_all_start_methods as _get_all_start_methods
+from multiprocessing import get_context as _get_context
+from time import perf_counter as _perf_counter
+from time import sleep as _sleep
+
+from . import _producer, _registry, _scheduling, _serialization
+from . import sinks as _sinks
+from .columns import _Layout
+from .policies import _normalize_error_policy, _normalize_serializer
+
+# Jobs (task, argument_list) of the fork-inheriting pools that are alive, keyed by job id,
+# so that concurrent calls from several threads do not see each other's job.
+# Forked child processes see their content without any pickling.
+_inherited_jobs = {}
+_inherited_job_ids = _count()
+
+# Number of arguments per execution slot that are pulled ahead when streaming
+_PREFETCH_PER_SLOT = 4
+
+# Tokens of all setups that were already executed in this process
+_completed_setups = set()
+
+# Number of chunks that were evaluated by this process, used to decide about recycling
+_num_completed_chunks = 0
+
+# Process that the state above belongs to. A forked worker inherits the state of its parent,
+# e.g. after a backend with a single job evaluated chunks in the parent, and resets it once
+# it notices that its process id differs.
+_state_pid = _os.getpid()
+
+# Marker that distinguishes keys of unhashable arguments, which are their pickled bytes
+_UNHASHABLE = object()
+
+# Results of earlier evaluations in this process, keyed by function token and the typed key
+# of the argument and ordered from least to most recently used
+_result_cache = _collections.OrderedDict()
+
+
+# Worker side
+
+def _reset_inherited_state():
+    """Reset the per-process state if this process is a fork that inherited it."""
+    global _state_pid, _num_completed_chunks
+
+    pid = _os.getpid()
+    if pid != _state_pid:
+        _state_pid = pid
+        _num_completed_chunks = 0
+        _completed_setups.clear()
+        _result_cache.clear()
+
+
+def _typed_key(value):
+    """Key of a hashable value that also holds the types of all values nested in it.
+
+    Equal values of different types, like 1, 1.0 and True, get different keys, also
+    inside tuples and frozensets.
+
+    Example:
+        >>> _typed_key(((1,), 'a')) == _typed_key(((1.0,), 'a'))
+        False
+    """
+    if isinstance(value, tuple):
+        return type(value), tuple(_typed_key(element) for element in value)
+    if isinstance(value, frozenset):
+        return type(value), frozenset(_typed_key(element) for element in value)
+    return type(value), value
+
+
+def _worker_id():
+    """Identify the current worker process by host name and process id."""
+    return '{}:{}'.format(_socket.gethostname(), _os.getpid())
+
+
+def _current_rss():
+    """Resident set size of the current process in bytes.
+
+    Uses psutil if it is installed and /proc on Linux otherwise. As last resort, the
+    peak resident set size reported by the resource module is used.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * _os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if _sys.platform == 'darwin' else peak * 1024
+
+
+def _read_number(filepath, key=None):
+    """Read a number from a file in /proc or /sys, optionally from a line starting with key."""
+    try:
+        with open(filepath) as file:
+            for line in file:
+                if key is None:
+                    return int(line.split()[0])
+                if line.startswith(key):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _available_memory():
+    """Memory in bytes that can still be used by this machine or container.
+
+    The limit of a cgroup is respected if the process runs in a container, because the
+    memory of the host is often much larger than what the container is allowed to use.
+    """
+    try:
+        import psutil
+    except ImportError:
+        available = _read_number('/proc/meminfo', 'MemAvailable:')
+        if available is None:
+            available = _os.sysconf('SC_AVPHYS_PAGES') * _os.sysconf('SC_PAGE_SIZE')
+    else:
+        available = psutil.virtual_memory().available
+    for limit_filepath, usage_filepath in [
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes')]:
+        limit = _read_number(limit_filepath)
+        usage = _read_number(usage_filepath)
+        if limit is not None and usage is not None:
+            available = min(available, max(0, limit - usage))
+            break
+    return available
+
+
+def _create_info(num_items, setup_time=0.0, task_time=0.0, events=None):
+    return dict(
+        worker=_worker_id(),
+        setup_time=setup_time,
+        task_time=task_time,
+        num_items=num_items,
+        events=events or {},
+    )
+
+
+class _Setup:
+    """Picklable description of the per-worker initialization of a map call.
+
+    The token is created in the parent process, so that each worker runs a given
+    setup exactly once, no matter how many chunks it evaluates.
+    """
+
+    def __init__(self, initializer=None, initargs=(), warmup=None):
+        self.token = _uuid.uuid4().hex
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.warmup = warmup
+
+    def __bool__(self):
+        return self.initializer is not None or self.warmup is not None
+
+    def ensure_done(self):
+        """Run initializer and warmup if this has not happened yet in the current process.
+
+        Returns:
+            Seconds spent on the setup, which is 0.0 if it was done before.
+        """
+        _reset_inherited_state()
+        if not self or self.token in _completed_setups:
+            return 0.0
+        start = _perf_counter()
+        if self.initializer is not None:
+            self.initializer(*self.initargs)
+        if self.warmup is not None:
+            self.warmup()
+        _completed_setups.add(self.token)
+        return _perf_counter() - start
+
+
+def _function_token(function):
+    """Token that is equal for equal functions, also in later map calls and other processes."""
+    try:
+        return _scheduling._stable_hash(function)
+    except (_pickle.PicklingError, AttributeError, TypeError):
+        # Such a function can only be sent to workers that inherit it, so its cached
+        # results are only reused within this map call
+        return _uuid.uuid4().hex
+
+
+class _ChunkTask:
+    """Picklable callable that evaluates a function on a chunk of arguments in a worker.
+
+    With a cache size, results are also stored in a least-recently-used cache of the
+    worker process, which is shared by all tasks whose functions are equal, so that a
+    worker that stays alive across map calls keeps the results of earlier ones.
+
+    With a result typecode, the results of a chunk are packed into an array of the array
+    module, which is pickled as a single buffer instead of one object per result. With a
+    shard writer, they are written to a shard while they are computed, and only the
+    shard is returned.
+    """
+
+    def __init__(self, function, unpack, setup=None, error_policy='raise',
+                 measure_memory=False, cache_size=None, result_typecode=None,
+                 shard_writer=None):
+        self.function = function
+        self.unpack = unpack
+        self.setup = setup if setup is not None else _Setup()
+        self.error_policy = error_policy
+        self.measure_memory = measure_memory
+        self.cache_size = cache_size
+        self.result_typecode = result_typecode
+        self.shard_writer = shard_writer
+        self.cache_token = None
+        if cache_size and isinstance(function, _registry._FunctionReference):
+            self.cache_token = function.function_id
+        elif cache_size:
+            self.cache_token = _function_token(function)
+
+    def __call__(self, chunk):
+        global _num_completed_chunks
+
+        _reset_inherited_state()
+        setup_time = self.setup.ensure_done()
+        function = _registry._resolve(self.function)
+        events = _collections.Counter()
+        start = _perf_counter()
+        if self.cache_size:
+            results = (self._evaluate_cached(function, arg, events) for arg in chunk)
+        elif self.error_policy != 'raise':
+            results = (self._evaluate_with_policy(function, arg, events) for arg in chunk)
+        elif self.unpack:
+            results = _starmap(function, chunk)
+        else:
+            results = map(function, chunk)
+        if self.shard_writer is not None:
+            shard = self.shard_writer.write(results)
+            results, num_items = [shard], shard.stop
+        else:
+            if self.result_typecode is not None:
+                results = _array.array(self.result_typecode, results)
+            else:
+                results = list(results)
+            num_items = len(results)
+        task_time = _perf_counter() - start
+        _num_completed_chunks += 1
+        info = _create_info(num_items, setup_time, task_time, events)
+        info['worker_tasks'] = _num_completed_chunks
+        if self.measure_memory:
+            info['memory'] = _current_rss()
+        return results, info
+
+    def _evaluate_cached(self, function, arg, events):
+        """Look up the result of one argument in the cache of this worker or evaluate it."""
+        key = (self.cache_token, _typed_key(arg))
+        try:
+            result = _result_cache[key]
+        except KeyError:
+            hashable = True
+        except TypeError:
+            hashable = False
+        else:
+            _result_cache.move_to_end(key)
+            events['cache_hits'] += 1
+            return result
+        events['cache_misses'] += 1
+        if self.error_policy != 'raise':
+            result = self._evaluate_with_policy(function, arg, events)
+            if isinstance(result, Exception):
+                return result
+        elif self.unpack:
+            result = function(*arg)
+        else:
+            result = function(arg)
+        if hashable:
+            _result_cache[key] = result
+            while len(_result_cache) > self.cache_size:
+                _result_cache.popitem(last=False)
+        return result
+
+    def _evaluate_with_policy(self, function, arg, events):
+        """Evaluate the function on one argument with retries and optionally return errors."""
+        policy = self.error_policy
+        num_retries = 0
+        while True:
+            try:
+                if self.unpack:
+                    return function(*arg)
+                return function(arg)
+            except Exception as exception:
+                if num_retries < policy.num_retries:
+                    _sleep(policy.backoff * 2 ** num_retries)
+                    num_retries += 1
+                    events['retries'] += 1
+                    continue
+                if policy.then == 'raise':
+                    raise
+                events['returned_exceptions'] += 1
+                return exception
+
+    def map_partition(self, iterator):
+        """Evaluate a whole Spark partition as one chunk."""
+        yield self(list(iterator))
+
+
+def _apply_to_inherited_indices(job_id, indices):
+    """Evaluate an inherited task on a range or a list of indices of its inherited arguments."""
+    task, argument_list = _inherited_jobs[job_id]
+    if isinstance(indices, range):
+        return task(argument_list[indices.start:indices.stop])
+    return task([argument_list[index] for index in indices])
+
+
+# Parent side
+
+def _split_into_ranges(num_items, num_chunks):
+    """Split the indices 0..num_items-1 into at most num_chunks contiguous ranges.
+
+    Example:
+        >>> _split_into_ranges(10, 3)
+        [range(0, 4), range(4, 7), range(7, 10)]
+    """
+    num_chunks = max(1, min(num_chunks, num_items))
+    chunk_size, remainder = divmod(num_items, num_chunks)
+    ranges = []
+    start = 0
+    for i in range(num_chunks):
+        stop = start + chunk_size + (1 if i < remainder else 0)
+        if stop > start:
+            ranges.append(range(start, stop))
+        start = stop
+    return ranges
+
+
+def _split_into_chunks(argument_list, chunk_size):
+    """Split a list of arguments into consecutive lists of at most chunk_size elements.
+
+    Columnar arguments and grids are split into slices of the same kind.
+    """
+    return [argument_list[i:i+chunk_size] for i in range(0, len(argument_list), chunk_size)]
+
+
+def _pool_chunk_size(num_items, num_cores):
+    """Chunk size heuristic that is also used by multiprocessing.Pool.map."""
+    chunk_size, extra = divmod(num_items, num_cores * 4)
+    if extra:
+        chunk_size += 1
+    return max(1, chunk_size)
+
+
+def _layout_chunk_size(argument_list, num_slots, shard_writer=None):
+    """Number of arguments per chunk for backends that otherwise send arguments one by one.
+
+    Each slice of columnar arguments or of a grid carries its own columns or axes, and
+    the results of each chunk that is written to a sink become a file of their own, so
+    such map calls split the arguments into a few large chunks per slot instead. The
+    argument list then needs a length.
+    """
+    if isinstance(argument_list, _Layout) or shard_writer is not None:
+        return _pool_chunk_size(len(argument_list), num_slots)
+    return 1
+
+
+def _estimate_costs(cost, argument_list, unpack):
+    """Turn the cost argument of a backend into a list with one estimated cost per argument.
+
+    Raises:
+        ValueError: If a list of cost hints does not have one entry per argument.
+    """
+    if callable(cost):
+        if unpack:
+            return [cost(*args) for args in argument_list]
+        return [cost(arg) for arg in argument_list]
+    costs = list(cost)
+    if len(costs) != len(argument_list):
+        raise ValueError(
+            'cost needs to be a callable or a list with one entry per argument, got {} '
+            'entries for {} arguments'.format(len(costs), len(argument_list)))
+    return costs
+
+
+def _plan_cost_aware_chunks(argument_list, unpack, cost, num_slots, max_chunk_size=None):
+    """Split arguments into chunks in longest-processing-time order with shrinking sizes.
+
+    Returns:
+        A tuple (chunks, index_chunks), where index_chunks holds the input position of
+        each argument and is required to restore the input order of the results.
+    """
+    costs = _estimate_costs(cost, argument_list, unpack)
+    index_chunks = _scheduling._plan_guided_chunks(costs, num_slots, max_chunk_size)
+    chunks = [[argument_list[index] for index in indices] for indices in index_chunks]
+    return chunks, index_chunks
+
+
+def _plan_affinity_chunks(argument_list, unpack, affinity_key, nodes, timeout=None,
+                          cost=None):
+    """Split arguments into chunks that are each evaluated by the node of their affinity key.
+
+    Returns:
+        A tuple (chunks, index_chunks, routes), where index_chunks holds the input position
+        of each argument and routes holds the position of the node of each chunk in nodes
+
+    Raises:
+        ValueError: If a cost estimate is given as well, which would place arguments
+            by their costs instead.
+    """
+    if cost is not None:
+        raise ValueError('cost can not be combined with affinity_key, which already decides '
+                         'where each argument is evaluated.')
+    argument_list = _as_list(argument_list)
+    if unpack:
+        keys = [affinity_key(*args) for args in argument_list]
+    else:
+        keys = [affinity_key(arg) for arg in argument_list]
+    chunk_size = 1 if timeout is not None else _pool_chunk_size(len(keys), len(nodes))
+    index_chunks, routes = _scheduling._plan_routed_chunks(keys, nodes, chunk_size)
+    chunks = [[argument_list[index] for index in indices] for indices in index_chunks]
+    return chunks, index_chunks, routes
+
+
+def _memory_limited_slots(num_slots, memory_per_task, max_inflight_bytes, available_memory):
+    """Number of tasks that may run at once without exceeding a memory budget.
+
+    Args:
+        num_slots: Number of tasks that could run at once without a budget
+        memory_per_task: Estimated peak memory in bytes that is needed by one task
+        max_inflight_bytes: Budget in bytes for all tasks in flight. If it is None, the
+            value returned by available_memory() is used.
+        available_memory: A callable that returns the memory in bytes that is available
+            to the workers
+
+    Returns:
+        num_slots if memory_per_task is None, otherwise a number between 1 and num_slots
+
+    Raises:
+        ValueError: If memory_per_task is not positive or max_inflight_bytes is given
+            without memory_per_task.
+    """
+    if memory_per_task is None:
+        if max_inflight_bytes is not None:
+            raise ValueError('max_inflight_bytes requires an estimate of memory_per_task')
+        return num_slots
+    if memory_per_task <= 0:
+        raise ValueError('memory_per_task needs to be positive, got {}'.format(memory_per_task))
+    if max_inflight_bytes is None:
+        max_inflight_bytes = available_memory()
+    return max(1, min(num_slots, int(max_inflight_bytes // memory_per_task)))
+
+
+def _cluster_memory(client):
+    """Memory in bytes that is still available on all workers of a Dask cluster."""
+    available = 0
+    for worker in client.scheduler_info()['workers'].values():
+        used = worker.get('metrics', {}).get('memory', 0)
+        available += max(0, worker.get('memory_limit', 0) - used)
+    return available
+
+
+def _collect(envelopes, report, start_time, events=None, index_chunks=None):
+    """Flatten the results of all envelopes and hand their infos and events to a report.
+
+    If the chunks did not follow the input order, index_chunks holds the input position
+    of each argument in each chunk and the results are put back into input order.
+
+    Results that arrive as arrays of the array module are concatenated into one array,
+    so that no Python object is created per result.
+    """
+    result_list = None
+    infos = []
+    for results, info in envelopes:
+        if result_list is None:
+            result_list = results[:0] if isinstance(results, _array.array) else []
+        result_list.extend(results)
+        infos.append(info)
+    if result_list is None:
+        result_list = []
+    if index_chunks is not None:
+        if isinstance(result_list, _array.array):
+            ordered_result_list = result_list[:1] * len(result_list)
+        else:
+            ordered_result_list = [None] * len(result_list)
+        positions = (index for indices in index_chunks for index in indices)
+        for index, result in zip(positions, result_list):
+            ordered_result_list[index] = result
+        result_list = ordered_result_list
+    if report is not None:
+        report._record(infos, _perf_counter() - start_time, events)
+    return result_list
+
+
+class _Session:
+    """Resources that a :class:`~unified_map.mapper.Mapper` keeps alive across map calls.
+
+    Executor adapters are checked out by one map call at a time and returned afterwards,
+    so that the next map call that needs an adapter with the same key, e.g. the same
+    backend and number of workers, finds its worker processes already running. Setups
+    are shared by all map calls with the same initializer, initargs and warmup, so that
+    workers which stay alive do not run them again. Large functions are registered once
+    per connection, so that workers which stay alive find them among the functions they
+    already loaded.
+    """
+
+    def __init__(self):
+        self._lock = _threading.Lock()
+        self._idle_adapters = _collections.defaultdict(list)
+        self._keys = {}
+        self._setups = {}
+        self._registries = {}
+        self._closed = False
+
+    def acquire(self, key, create_adapter):
+        """Take an idle adapter with the given key, or create a new one."""
+        with self._lock:
+            idle_adapters = self._idle_adapters[key]
+            adapter = idle_adapters.pop() if idle_adapters else None
+        if adapter is None:
+            adapter = create_adapter()
+        with self._lock:
+            self._keys[adapter] = key
+        return adapter
+
+    def release(self, adapter, abandoned):
+        """Keep an adapter for the next map call, unless it has abandoned tasks."""
+        with self._lock:
+            key = self._keys.pop(adapter)
+            keep = not abandoned and not self._closed
+            if keep:
+                self._idle_adapters[key].append(adapter)
+        if not keep:
+            adapter.shutdown(abandoned)
+
+    def setup(self, initializer, initargs, warmup):
+        """Return a setup whose token is shared by all calls with the same objects."""
+        initargs = tuple(initargs)
+        key = (id(initializer), tuple(id(arg) for arg in initargs), id(warmup))
+        with self._lock:
+            if key not in self._setups:
+                # The setup refers to the objects, so that their ids can not be reused
+                self._setups[key] = _Setup(initializer, initargs, warmup)
+            return self._setups[key]
+
+    def registry(self, connection=None):
+        """Return the function registry of a connection, or of the local worker processes."""
+        with self._lock:
+            registry = self._registries.get(id(connection))
+            if registry is None:
+                # The registry refers to the connection, so that its id can not be reused
+                registry = _registry._FunctionRegistry(connection)
+                self._registries[id(connection)] = registry
+            return registry
+
+    def close(self):
+        """Shut down all idle adapters and those of running map calls once they finish."""
+        with self._lock:
+            self._closed = True
+            adapters = [adapter for idle_adapters in self._idle_adapters.values()
+                        for adapter in idle_adapters]
+            self._idle_adapters.clear()
+            registries, self._registries = list(self._registries.values()), {}
+        for adapter in adapters:
+            adapter.shutdown(abandoned=False)
+        for registry in registries:
+            registry.close()
+
+
+def _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                 measure_memory=False, session=None, cache_size=None, connection=None,
+                 serializer=None, result_typecode=None, shard_writer=None):
+    """Create a chunk task whose function is shipped once per worker if it is large.
+
+    Without a session, the registry of the function lives as long as the task. With a
+    serializer, the task is wrapped, so that it is sent in the serializer's format, and
+    chunks need to be wrapped by _serialization._pack_chunks() as well.
+
+    Raises:
+        ValueError: If the serializer is invalid.
+    """
+    serializer = _normalize_serializer(serializer)
+    if session is None:
+        setup = _Setup(initializer, initargs, warmup)
+        registry = _registry._FunctionRegistry(connection)
+    else:
+        setup = session.setup(initializer, initargs, warmup)
+        registry = session.registry(connection)
+    function = registry.reference(function, _serialization._dumps_function(serializer))
+    task = _ChunkTask(function, unpack, setup, error_policy, measure_memory, cache_size,
+                      result_typecode, shard_writer)
+    if serializer is None:
+        return task
+    return _serialization._SerializingTask(task, serializer)
+
+
+def _acquire_adapter(session, key, create_adapter, task):
+    """Create an executor adapter, or reuse the one of a session that has the same key."""
+    if session is None:
+        return create_adapter()
+    adapter = session.acquire(key, create_adapter)
+    adapter.task = task
+    return adapter
+
+
+def _release_adapter(session, adapter, abandoned):
+    """Shut down an adapter, or leave it to its session if it can be reused."""
+    if session is None:
+        adapter.shutdown(abandoned)
+    else:
+        session.release(adapter, abandoned)
+
+
+def _create_dispatcher(adapter, error_policy, speculation=None, timeout=None, deadline=None,
+                       max_tasks_per_worker=None, max_worker_memory=None, max_in_flight=None,
+                       cancel_token=None):
+    """Create a dispatcher whose crash handling follows the error policy."""
+    if error_policy == 'raise':
+        max_crash_retries = None
+        return_crashes = False
+    else:
+        max_crash_retries = error_policy.num_retries
+        return_crashes = error_policy.then == 'return_exceptions'
+    return _scheduling._Dispatcher(
+        adapter, speculation=speculation, max_crash_retries=max_crash_retries,
+        return_crashes=return_crashes, timeout=timeout, deadline=deadline,
+        max_tasks_per_worker=max_tasks_per_worker, max_worker_memory=max_worker_memory,
+        max_in_flight=max_in_flight, chunk_info=_create_info, cancel_token=cancel_token)
+
+
+def _run_dispatcher(dispatcher, adapter, chunks, session=None):
+    """Run a dispatcher and release the resources of its adapter in any case."""
+    try:
+        envelopes = dispatcher.run(chunks)
+    except BaseException:
+        _release_adapter(session, adapter, abandoned=True)
+        raise
+    _release_adapter(session, adapter, abandoned=dispatcher.num_abandoned > 0)
+    return envelopes
+
+
+def _iter_chunks(iterable, chunk_size):
+    """Lazily split an iterable of arguments into consecutive lists of at most chunk_size elements.
+
+    Example:
+        >>> list(_iter_chunks(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+    """
+    if isinstance(iterable, _Layout):
+        for start in range(0, len(iterable), chunk_size):
+            yield iterable[start:start+chunk_size]
+        return
+    iterator = iter(iterable)
+    while True:
+        chunk = list(_islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _as_list(argument_list):
+    """Materialize an iterable of arguments, but keep columnar arguments as they are."""
+    if isinstance(argument_list, _Layout):
+        return argument_list
+    return list(argument_list)
+
+
+def _reject_for_streaming(**options):
+    """Raise an error for options that require all arguments up front.
+
+    Raises:
+        ValueError: If one of the options is set.
+    """
+    for name, value in sorted(options.items()):
+        if value is not None and value is not False:
+            raise ValueError(
+                '{} can not be combined with stream=True, because it requires all '
+                'arguments up front.'.format(name))
+
+
+def _stream(envelopes, report, start_time, events=None):
+    """Yield the results of envelopes one by one and fill a report incrementally."""
+    if report is not None:
+        report._reset()
+    for results, info in envelopes:
+        if report is not None:
+            report._add(info)
+        yield from results
+    if report is not None:
+        report._close(_perf_counter() - start_time, events)
+
+
+def _stream_dispatched(create_adapter, chunks, window, report, start_time, error_policy,
+                       session=None, ordered=True, **options):
+    """Stream results of a dispatcher and release the resources of its adapter in any case.
+
+    The adapter is only created when the first result is requested, so that an iterator
+    that is never consumed does not leave worker processes behind. If ordered is False,
+    results are yielded in the order in which their chunks are finished.
+    """
+    adapter = create_adapter()
+    dispatcher = _create_dispatcher(adapter, error_policy, **options)
+    envelopes = dispatcher.stream(chunks, window, ordered)
+    try:
+        yield from _stream(envelopes, report, start_time, dispatcher.events)
+    except BaseException:
+        envelopes.close()
+        _release_adapter(session, adapter, abandoned=True)
+        raise
+    _release_adapter(session, adapter, abandoned=dispatcher.num_abandoned > 0)
+
+
+def _evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token=None):
+    """Yield envelopes of consecutive batches of arguments that are evaluated one by one.
+
+    A cancel token is checked before each batch, because backends that only return
+    results as a whole can not be interrupted in between.
+    """
+    for batch in _iter_chunks(argument_list, batch_size):
+        _scheduling._check_cancelled(cancel_token)
+        yield from evaluate(batch)
+
+
+def _deduplication_key(argument):
+    """Key under which equal arguments of equal types are found, also if they are not hashable.
+
+    Returns:
+        The key, or None if the argument can neither be hashed nor pickled, in which case it
+        is not compared to other arguments
+    """
+    try:
+        hash(argument)
+    except TypeError:
+        try:
+            # Pickled bytes differ for equal values of different types as well
+            return _UNHASHABLE, _pickle.dumps(argument)
+        except Exception:
+            return None
+    return _typed_key(argument)
+
+
+def _deduplicate(argument_list):
+    """Find the distinct arguments of an argument list.
+
+    Returns:
+        A tuple (unique_arguments, first_positions, slots), where first_positions holds the
+        input position of each distinct argument and slots holds, for every input
+        position, the index of its distinct argument
+
+    Example:
+        >>> _deduplicate(['a', 'b', 'a', [1], 'b', [1], 1.0, 1])
+        (['a', 'b', [1], 1.0, 1], [0, 1, 3, 6, 7], [0, 1, 0, 2, 1, 2, 3, 4])
+    """
+    unique_arguments, first_positions, slots = [], [], []
+    seen = {}
+    for position, argument in enumerate(argument_list):
+        key = _deduplication_key(argument)
+        slot = None if key is None else seen.get(key)
+        if slot is None:
+            slot = len(unique_arguments)
+            if key is not None:
+                seen[key] = slot
+            unique_arguments.append(argument)
+            first_positions.append(position)
+        slots.append(slot)
+    return unique_arguments, first_positions, slots
+
+
+def _with_deduplication(run):
+    """Let a runner of the engine evaluate equal arguments only once.
+
+    The decorated runner accepts an additional keyword argument dedupe. If it is True, the
+    arguments are collected up front, only the distinct ones are passed to the runner and
+    their results are copied to the positions of all equal arguments. The number of
+    evaluations that were saved is counted as event 'saved_evaluations' in the report.
+
+    Raises:
+        ValueError: If dedupe is combined with stream.
+    """
+    @_functools.wraps(run)
+    def run_deduplicated(function, argument_list, dedupe=False, **kwargs):
+        if not dedupe:
+            return run(function, argument_list, **kwargs)
+        if kwargs.get('stream'):
+            _reject_for_streaming(dedupe=dedupe)
+        unique_arguments, first_positions, slots = _deduplicate(argument_list)
+        cost = kwargs.get('cost')
+        if cost is not None and not callable(cost):
+            costs = list(cost)
+            if len(costs) == len(slots):
+                kwargs['cost'] = [costs[position] for position in first_positions]
+        unique_results = run(function, unique_arguments, **kwargs)
+        report = kwargs.get('report')
+        if report is not None:
+            report.events['saved_evaluations'] = len(slots) - len(unique_arguments)
+        if isinstance(unique_results, _array.array):
+            return _array.array(unique_results.typecode, map(unique_results.__getitem__, slots))
+        return [unique_results[slot] for slot in slots]
+
+    return run_deduplicated
+
+
+def _result_typecode(result_dtype):
+    """Find the typecode of the array module whose items are laid out like a NumPy dtype.
+
+    Returns:
+        A tuple (typecode, dtype)
+
+    Raises:
+        ImportError: If NumPy is not installed.
+        ValueError: If the dtype is not a native integer or floating point type.
+    """
+    import numpy
+
+    dtype = numpy.dtype(result_dtype)
+    if dtype.isnative:
+        for typecode in 'bBhHiIlLqQfd':
+            kind = 'f' if typecode in 'fd' else 'i' if typecode.islower() else 'u'
+            if (kind, _array.array(typecode).itemsize) == (dtype.kind, dtype.itemsize):
+                return typecode, dtype
+    raise ValueError('result_dtype needs to be a native integer or floating point type, '
+                     'got {}'.format(dtype))
+
+
+def _with_result_dtype(run):
+    """Let a runner of the engine return numeric results as a NumPy array.
+
+    The decorated runner accepts an additional keyword argument result_dtype. If it is
+    given, each worker packs the results of a chunk into an array of the array module,
+    which travels as one buffer instead of one pickled object per result. The arrays of
+    all chunks are concatenated in this process without creating an object per result,
+    and a NumPy array that shares their memory is returned.
+
+    Raises:
+        ImportError: If result_dtype is given and NumPy is not installed.
+        ValueError: If result_dtype is not a native integer or floating point type, or if
+            it is combined with stream or with an option that puts exceptions instead of
+            results into the result list, i.e. timeout, deadline and error policies that
+            return exceptions.
+    """
+    @_functools.wraps(run)
+    def run_typed(function, argument_list, result_dtype=None, **kwargs):
+        if result_dtype is None:
+            return run(function, argument_list, **kwargs)
+        if kwargs.get('stream'):
+            raise ValueError('result_dtype can not be combined with stream=True, because '
+                             'results are returned as one array.')
+        error_policy = _normalize_error_policy(kwargs.get('error_policy', 'raise'))
+        returns_exceptions = error_policy != 'raise' and error_policy.then != 'raise'
+        if returns_exceptions or any(kwargs.get(name) is not None
+                                     for name in ('timeout', 'deadline')):
+            raise ValueError('result_dtype can not be combined with timeout, deadline or an '
+                             'error policy that returns exceptions, because an array can '
+                             'not hold exceptions instead of results.')
+        import numpy
+
+        typecode, dtype = _result_typecode(result_dtype)
+        results = run(function, argument_list, result_typecode=typecode, **kwargs)
+        if not isinstance(results, _array.array):
+            # No chunk was evaluated
+            results = _array.array(typecode, results)
+        if not results:
+            return numpy.empty(0, dtype)
+        return numpy.frombuffer(results, dtype)
+
+    return run_typed
+
+
+def _with_sink(run):
+    """Let a runner of the engine write results to shard files inside the workers.
+
+    The decorated runner accepts an additional keyword argument sink, which is a
+    :class:`~unified_map.sinks.Sink` object or None. If it is given, each chunk task writes
+    the results of its chunk to a shard and sends back only its description, and a
+    :class:`~unified_map.sinks.Manifest` of all shards in input order is returned. Shards
+    of attempts that are not part of the manifest, e.g. of speculative duplicates, and all
+    shards of a map call that raised an exception are removed, as far as this process can
+    see the directory.
+
+    Raises:
+        ValueError: If sink is not a Sink object, or if it is combined with an option that
+            does not give consecutive results of all arguments, i.e. stream, dedupe, cost,
+            affinity_key, result_dtype, timeout, deadline and error policies that return
+            exceptions.
+    """
+    @_functools.wraps(run)
+    def run_with_sink(function, argument_list, sink=None, **kwargs):
+        if sink is None:
+            return run(function, argument_list, **kwargs)
+        if not isinstance(sink, _sinks.Sink):
+            raise ValueError('sink needs to be None or a Sink object, got {!r}'.format(sink))
+        for name in ('stream', 'dedupe', 'cost', 'affinity_key', 'result_dtype', 'timeout',
+                     'deadline'):
+            value = kwargs.get(name)
+            if value is not None and value is not False:
+                raise ValueError('sink can not be combined with {}, because shards hold the '
+                                 'consecutive results of all arguments.'.format(name))
+        error_policy = _normalize_error_policy(kwargs.get('error_policy', 'raise'))
+        if error_policy != 'raise' and error_policy.then != 'raise':
+            raise ValueError('sink can not be combined with an error policy that returns '
+                             'exceptions, because shards only hold results.')
+        shard_writer = _sinks._ShardWriter(sink)
+        try:
+            shards = run(function, argument_list, shard_writer=shard_writer, **kwargs)
+        except BaseException:
+            shard_writer.remove_unlisted([])
+            raise
+        return shard_writer.manifest(shards)
+
+    return run_with_sink
+
+
+@_contextlib.contextmanager
+def _pool(num_workers):
+    """Provide a multiprocessing pool that is joined at the end in any case.
+
+    Its worker processes are terminated if the block raises an exception, including a
+    KeyboardInterrupt, and otherwise finish their tasks before the pool is closed.
+    """
+    pool = _get_context().Pool(num_workers, initializer=_scheduling._ignore_interrupts)
+    try:
+        yield pool
+    except BaseException:
+        _scheduling._terminate_pool(pool)
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+@_producer._with_producer
+def run_dask(function, argument_list, unpack, num_cores,
+             initializer=None, initargs=(), warmup=None, error_policy='raise',
+             memory_per_task=None, max_inflight_bytes=None, stream=False, prefetch=None,
+             cancel_token=None, worker_cache_size=None, serializer=None,
+             result_typecode=None, shard_writer=None, session=None, report=None):
+    """Evaluate chunks with Dask's delayed() and compute() on the multiprocessing scheduler.
+
+    The scheduler receives the whole task graph at once, therefore a memory budget is
+    enforced by reducing the number of worker processes. For the same reason, streamed
+    arguments are evaluated in consecutive batches of prefetch arguments, and with a
+    cancel token the same batches are used to check for cancellation in between.
+
+    The scheduler runs on a pool that is owned by this function, so that its worker
+    processes are terminated when an exception or a KeyboardInterrupt occurs.
+    """
+    from dask import compute, delayed
+    from dask import multiprocessing as _multiprocessing
+
+    num_cores = _memory_limited_slots(
+        num_cores, memory_per_task, max_inflight_bytes, _available_memory)
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        session=session, cache_size=worker_cache_size,
+                        serializer=serializer, result_typecode=result_typecode,
+                        shard_writer=shard_writer)
+
+    def evaluate(argument_list):
+        chunks = _split_into_chunks(
+            argument_list, _layout_chunk_size(argument_list, num_cores, shard_writer))
+        chunks = _serialization._pack_chunks(task, chunks)
+        jobs_generator = (delayed(task)(chunk) for chunk in chunks)
+        with _pool(num_cores) as pool:
+            return compute(*jobs_generator, get=_multiprocessing.get, pool=pool)
+
+    batch_size = prefetch or _PREFETCH_PER_SLOT * num_cores
+    if stream:
+        envelopes = _evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token)
+        return _stream(envelopes, report, start_time)
+    if cancel_token is not None:
+        envelopes = list(_evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token))
+    else:
+        envelopes = evaluate(_as_list(argument_list))
+    return _collect(envelopes, report, start_time)
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+@_producer._with_producer
+def run_futures(function, argument_list, unpack, num_cores,
+                initializer=None, initargs=(), warmup=None, speculation=None,
+                error_policy='raise', timeout=None, deadline=None, cost=None,
+                max_tasks_per_worker=None, max_worker_memory=None, memory_per_task=None,
+                max_inflight_bytes=None, stream=False, prefetch=None, cancel_token=None,
+                ordered=True, affinity_key=None, worker_cache_size=None, serializer=None,
+                result_typecode=None, shard_writer=None, session=None, report=None):
+    """Evaluate chunks with a process pool executor from concurrent.futures.
+
+    Chunks are submitted by a dispatcher that keeps a bounded number of tasks in flight,
+    which enables speculative re-execution of stragglers and the replacement of a pool
+    that broke because a worker crashed. If losing attempts are still running at the
+    end, the worker processes are terminated instead of waiting for them. The same
+    happens to tasks that exceed the timeout or are still running at the deadline.
+
+    An executor cannot retire single workers, therefore all of them are recycled together:
+    once a worker reaches max_tasks_per_worker or max_worker_memory, no further chunks are
+    submitted until the running ones are finished, and then the executor is replaced.
+
+    A memory budget reduces the number of worker processes and thereby the number of
+    tasks in flight, so that arguments are only submitted when a worker becomes free.
+
+    With an affinity key, each worker is an executor with a single process, and chunks
+    are routed to them by consistent hashing of the keys of their arguments.
+
+    Streamed arguments are pulled from the iterable one by one, at most prefetch of them
+    ahead of the oldest result that was not yielded yet. If ordered is False, their results
+    are yielded in the order in which they are finished.
+
+    The executor is shut down in any case. Errors like a function that can not be pickled
+    are raised instead of leaving the executor waiting forever, which was a known cause of
+    freezes with the executor's own map(). On a KeyboardInterrupt or a cancelled token, the
+    worker processes are terminated and killed if they do not exit within a grace period.
+
+    References:
+        - https://stackoverflow.com/questions/48218897
+    """
+    num_cores = _memory_limited_slots(
+        num_cores, memory_per_task, max_inflight_bytes, _available_memory)
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        max_worker_memory is not None, session, worker_cache_size,
+                        serializer=serializer, result_typecode=result_typecode,
+                        shard_writer=shard_writer)
+    max_in_flight = None if memory_per_task is None else num_cores
+    if affinity_key is None:
+        key = ('futures', num_cores)
+
+        def create_adapter():
+            return _scheduling._FuturesAdapter(task, num_cores)
+    else:
+        key = ('futures-affinity', num_cores)
+
+        def create_adapter():
+            return _scheduling._AffinityAdapter(
+                [_scheduling._FuturesAdapter(task, 1) for _ in range(num_cores)])
+
+    if stream:
+        _reject_for_streaming(cost=cost, affinity_key=affinity_key)
+        return _stream_dispatched(
+            lambda: _acquire_adapter(session, key, create_adapter, task),
+            _serialization._pack_chunks(task, _iter_chunks(argument_list, 1)),
+            prefetch or _PREFETCH_PER_SLOT * num_cores,
+            report, start_time, error_policy, session, ordered, speculation=speculation,
+            timeout=timeout, deadline=deadline, max_tasks_per_worker=max_tasks_per_worker,
+            max_worker_memory=max_worker_memory, max_in_flight=max_in_flight,
+            cancel_token=cancel_token)
+
+    routes = None
+    if affinity_key is not None:
+        chunks, index_chunks, routes = _plan_affinity_chunks(
+            argument_list, unpack, affinity_key, range(num_cores), timeout, cost)
+    elif cost is None:
+        if shard_writer is not None:
+            argument_list = _as_list(argument_list)
+        chunk_size = 1 if timeout is not None else _layout_chunk_size(
+            argument_list, num_cores, shard_writer)
+        chunks, index_chunks = _iter_chunks(argument_list, chunk_size), None
+    else:
+        argument_list = _as_list(argument_list)
+        max_chunk_size = 1 if timeout is not None else None
+        chunks, index_chunks = _plan_cost_aware_chunks(
+            argument_list, unpack, cost, num_cores, max_chunk_size)
+    adapter = _acquire_adapter(session, key, create_adapter, task)
+    if routes is not None:
+        adapter.routes = routes
+    dispatcher = _create_dispatcher(adapter, error_policy, speculation, timeout, deadline,
+                                    max_tasks_per_worker, max_worker_memory, max_in_flight,
+                                    cancel_token)
+    envelopes = _run_dispatcher(
+        dispatcher, adapter, _serialization._pack_chunks(task, chunks), session)
+    return _collect(envelopes, report, start_time, dispatcher.events, index_chunks)
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+@_producer._with_producer
+def run_joblib(function, argument_list, unpack, num_cores,
+               initializer=None, initargs=(), warmup=None, error_policy='raise',
+               memory_per_task=None, max_inflight_bytes=None, stream=False, prefetch=None,
+               cancel_token=None, worker_cache_size=None, serializer=None,
+               result_typecode=None, shard_writer=None, session=None, report=None):
+    """Evaluate chunks with Joblib's delayed() and a multiprocessing parallel executor.
+
+    A memory budget is enforced by reducing the number of worker processes. Joblib
+    consumes the generator of tasks lazily, so arguments are not submitted all at once.
+    Its results are only returned as a whole, therefore streamed arguments are evaluated
+    in consecutive batches of prefetch arguments, and with a cancel token the same
+    batches are used to check for cancellation in between. Joblib terminates its own
+    worker processes when an exception or a KeyboardInterrupt occurs.
+    """
+    from joblib import delayed, Parallel
+
+    num_cores = _memory_limited_slots(
+        num_cores, memory_per_task, max_inflight_bytes, _available_memory)
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        session=session, cache_size=worker_cache_size,
+                        serializer=serializer, result_typecode=result_typecode,
+                        shard_writer=shard_writer)
+    parallel_executor = Parallel(n_jobs=num_cores, backend='multiprocessing')
+
+    def evaluate(argument_list):
+        chunk_size = _layout_chunk_size(argument_list, num_cores, shard_writer)
+        chunks = _serialization._pack_chunks(task, _iter_chunks(argument_list, chunk_size))
+        return parallel_executor(delayed(task)(chunk) for chunk in chunks)
+
+    batch_size = prefetch or _PREFETCH_PER_SLOT * num_cores
+    if stream:
+        envelopes = _evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token)
+        return _stream(envelopes, report, start_time)
+    if cancel_token is not None:
+        envelopes = list(_evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token))
+    elif shard_writer is not None:
+        envelopes = evaluate(_as_list(argument_list))
+    else:
+        envelopes = evaluate(argument_list)
+    return _collect(envelopes, report, start_time)
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+@_producer._with_producer
+def run_multiprocessing(function, argument_list, unpack, num_cores, inherit_arguments=False,
+                        initializer=None, initargs=(), warmup=None, error_policy='raise',
+                        timeout=None, deadline=None, cost=None, max_tasks_per_worker=None,
+                        max_worker_memory=None, memory_per_task=None, max_inflight_bytes=None,
+                        stream=False, prefetch=None, cancel_token=None, ordered=True,
+                        affinity_key=None, worker_cache_size=None, serializer=None,
+                        result_typecode=None, shard_writer=None, session=None, report=None):
+    """Evaluate chunks with the apply_async() function of a multiprocessing pool.
+
+    Chunks are submitted by a dispatcher, which detects crashed workers instead of
+    waiting forever for their results and replaces the pool if necessary. With a timeout,
+    each chunk holds a single argument, so that the timeout applies to each argument.
+
+    If inherit_arguments is True, the task and the argument list are stored in a
+    module-level slot before the pool is forked, so that the workers can read them
+    directly from the copy-on-write memory of the parent. Tasks then only carry index
+    ranges and only results are sent over pipes.
+
+    Workers are recycled by the pool itself after max_tasks_per_worker chunks. Once a
+    worker exceeds max_worker_memory, no further chunks are submitted until the running
+    ones are finished, and then the whole pool is replaced.
+
+    A memory budget reduces the number of worker processes and the number of chunks in
+    flight, so that chunks are only submitted when a worker becomes free.
+
+    With a cost estimate, chunks are formed in longest-processing-time order with
+    shrinking sizes instead of the static chunk size used by Pool.map.
+
+    With an affinity key, each worker is a pool with a single process, and chunks are
+    routed to them by consistent hashing of the keys of their arguments.
+
+    Streamed arguments and arguments from a background producer are submitted one by one
+    like in Pool.imap. When streaming, at most prefetch of them are pulled ahead of the
+    oldest result that was not yielded yet, and if ordered is False, results are yielded
+    in the order in which they are finished like in Pool.imap_unordered.
+
+    The pool is closed and joined in any case. On an exception, a KeyboardInterrupt or a
+    cancelled token, its worker processes are terminated and killed if they do not exit
+    within a grace period.
+
+    Raises:
+        ValueError: If inherit_arguments is True but the "fork" start method is unavailable
+            or an affinity key is given, or if an option that requires all arguments up
+            front is combined with stream.
+    """
+    num_cores = _memory_limited_slots(
+        num_cores, memory_per_task, max_inflight_bytes, _available_memory)
+    max_in_flight = None if memory_per_task is None else num_cores
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        max_worker_memory is not None, session, worker_cache_size,
+                        serializer=serializer, result_typecode=result_typecode,
+                        shard_writer=shard_writer)
+    if affinity_key is None:
+        key = ('multiprocessing', num_cores, max_tasks_per_worker)
+
+        def create_adapter():
+            return _scheduling._PoolAdapter(task, num_cores, None, max_tasks_per_worker)
+    else:
+        key = ('multiprocessing-affinity', num_cores, max_tasks_per_worker)
+
+        def create_adapter():
+            return _scheduling._AffinityAdapter(
+                [_scheduling._PoolAdapter(task, 1, None, max_tasks_per_worker)
+                 for _ in range(num_cores)])
+
+    if inherit_arguments and affinity_key is not None:
+        raise ValueError('inherit_arguments can not be combined with affinity_key, because '
+                         'inherited arguments are evaluated by a single forked pool.')
+    if stream:
+        _reject_for_streaming(inherit_arguments=inherit_arguments, cost=cost,
+                              affinity_key=affinity_key)
+        return _stream_dispatched(
+            lambda: _acquire_adapter(session, key, create_adapter, task),
+            _serialization._pack_chunks(task, _iter_chunks(argument_list, 1)),
+            prefetch or _PREFETCH_PER_SLOT * num_cores,
+            report, start_time, error_policy, session, ordered, timeout=timeout,
+            deadline=deadline, max_tasks_per_worker=max_tasks_per_worker,
+            max_worker_memory=max_worker_memory, max_in_flight=max_in_flight,
+            cancel_token=cancel_token)
+
+    # Shards of a sink should hold many results, so their chunks are formed up front
+    produced_lazily = (isinstance(argument_list, _producer._BackgroundProducer)
+                       and shard_writer is None)
+    if not produced_lazily or inherit_arguments or cost is not None:
+        argument_list = _as_list(argument_list)
+    index_chunks = routes = None
+    if affinity_key is not None:
+        chunks, index_chunks, routes = _plan_affinity_chunks(
+            argument_list, unpack, affinity_key, range(num_cores), timeout, cost)
+    elif cost is not None:
+        max_chunk_size = 1 if timeout is not None else None
+        chunks, index_chunks = _plan_cost_aware_chunks(
+            argument_list, unpack, cost, num_cores, max_chunk_size)
+    if inherit_arguments:
+        if 'fork' not in _get_all_start_methods():
+            raise ValueError(
+                'Inheriting arguments requires the "fork" start method of multiprocessing, '
+                'which is not available on this platform.')
+        if index_chunks is not None:
+            chunks = index_chunks
+        else:
+            num_chunks = len(argument_list) if timeout is not None else num_cores * 4
+            chunks = _split_into_ranges(len(argument_list), num_chunks)
+        job_id = next(_inherited_job_ids)
+        _inherited_jobs[job_id] = (task, argument_list)
+        try:
+            adapter = _scheduling._PoolAdapter(
+                _functools.partial(_apply_to_inherited_indices, job_id), num_cores,
+                _get_context('fork'), max_tasks_per_worker)
+            dispatcher = _create_dispatcher(adapter, error_policy, None, timeout, deadline,
+                                            max_tasks_per_worker, max_worker_memory,
+                                            max_in_flight, cancel_token)
+            envelopes = _run_dispatcher(dispatcher, adapter, chunks)
+        finally:
+            del _inherited_jobs[job_id]
+    else:
+        if index_chunks is None and (produced_lazily or timeout is not None):
+            # Arguments of a background producer are submitted as soon as they arrive
+            chunks = _iter_chunks(argument_list, 1)
+        elif index_chunks is None:
+            chunk_size = _pool_chunk_size(len(argument_list), num_cores)
+            chunks = _split_into_chunks(argument_list, chunk_size)
+        adapter = _acquire_adapter(session, key, create_adapter, task)
+        if routes is not None:
+            adapter.routes = routes
+        dispatcher = _create_dispatcher(adapter, error_policy, None, timeout, deadline,
+                                        max_tasks_per_worker, max_worker_memory, max_in_flight,
+                                        cancel_token)
+        envelopes = _run_dispatcher(
+            dispatcher, adapter, _serialization._pack_chunks(task, chunks), session)
+    return _collect(envelopes, report, start_time, dispatcher.events, index_chunks)
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+def run_distributed_dask(function, argument_list, unpack, connection,
+                         initializer=None, initargs=(), warmup=None, speculation=None,
+                         error_policy='raise', timeout=None, deadline=None, cost=None,
+                         memory_per_task=None, max_inflight_bytes=None, stream=False,
+                         prefetch=None, cancel_token=None, ordered=True, affinity_key=None,
+                         worker_cache_size=None, serializer=None, result_typecode=None,
+                         shard_writer=None, session=None, report=None):
+    """Evaluate chunks with Dask's delayed() and compute() via a connected scheduler.
+
+    With speculation, a timeout, a deadline, a cost estimate or a memory budget, chunks are
+    instead submitted as individual futures by a dispatcher, which places speculative
+    duplicates of stragglers on idle workers, cancels futures that run out of time,
+    submits expensive chunks first and only keeps as many tasks in flight as the memory
+    of the cluster allows. Tasks of crashed workers are rescheduled by the Dask scheduler
+    as often as the error policy allows. Streamed arguments are always submitted by a
+    dispatcher, at most prefetch of them ahead of the oldest result that was not yielded,
+    and in the order in which they are finished if ordered is False. A cancel token also
+    requires a dispatcher, which cancels the futures in flight. With an affinity key, the
+    dispatcher asks the scheduler to place each chunk on the worker of its keys.
+    """
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        session=session, cache_size=worker_cache_size,
+                        connection=connection, serializer=serializer,
+                        result_typecode=result_typecode, shard_writer=shard_writer)
+    retries = 0 if error_policy == 'raise' else error_policy.num_retries
+    if stream:
+        _reject_for_streaming(cost=cost, affinity_key=affinity_key)
+        adapter = _scheduling._DaskClientAdapter(task, connection, retries)
+        num_slots = _memory_limited_slots(
+            adapter.num_slots, memory_per_task, max_inflight_bytes,
+            lambda: _cluster_memory(connection))
+        max_in_flight = None if memory_per_task is None else num_slots
+        return _stream_dispatched(
+            lambda: adapter, _serialization._pack_chunks(task, _iter_chunks(argument_list, 1)),
+            prefetch or _PREFETCH_PER_SLOT * num_slots, report, start_time, error_policy,
+            ordered=ordered, speculation=speculation, timeout=timeout, deadline=deadline,
+            max_in_flight=max_in_flight, cancel_token=cancel_token)
+
+    argument_list = _as_list(argument_list)
+    chunk_size = 1
+    if timeout is None:
+        chunk_size = _layout_chunk_size(
+            argument_list, sum(connection.ncores().values()), shard_writer)
+    chunks = _split_into_chunks(argument_list, chunk_size)
+    use_dispatcher = any(option is not None for option in (
+        speculation, timeout, deadline, cost, memory_per_task, max_inflight_bytes,
+        cancel_token, affinity_key))
+    if not use_dispatcher:
+        from dask import compute, delayed
+
+        jobs = [delayed(task)(chunk) for chunk in _serialization._pack_chunks(task, chunks)]
+        envelopes = compute(*jobs, get=connection.get, retries=retries)
+        return _collect(envelopes, report, start_time)
+
+    adapter = _scheduling._DaskClientAdapter(task, connection, retries)
+    num_slots = _memory_limited_slots(
+        adapter.num_slots, memory_per_task, max_inflight_bytes,
+        lambda: _cluster_memory(connection))
+    max_in_flight = None if memory_per_task is None else num_slots
+    index_chunks = None
+    if affinity_key is not None:
+        addresses = sorted(connection.ncores())
+        chunks, index_chunks, adapter.routes = _plan_affinity_chunks(
+            argument_list, unpack, affinity_key, addresses, timeout, cost)
+        adapter.addresses = addresses
+    elif cost is not None:
+        max_chunk_size = 1 if timeout is not None else None
+        chunks, index_chunks = _plan_cost_aware_chunks(
+            argument_list, unpack, cost, num_slots, max_chunk_size)
+    dispatcher = _create_dispatcher(
+        adapter, error_policy, speculation, timeout, deadline, max_in_flight=max_in_flight,
+        cancel_token=cancel_token)
+    envelopes = _run_dispatcher(
+        dispatcher, adapter, _serialization._pack_chunks(task, chunks))
+    return _collect(envelopes, report, start_time, dispatcher.events, index_chunks)
+
+
+@_with_sink
+@_with_result_dtype
+@_with_deduplication
+def run_spark(function, argument_list, unpack, connection,
+              initializer=None, initargs=(), warmup=None, error_policy='raise',
+              timeout=None, deadline=None, cost=None, stream=False, prefetch=None,
+              cancel_token=None, worker_cache_size=None, serializer=None,
+              result_typecode=None, shard_writer=None, session=None, report=None):
+    """Evaluate each partition of a resilient distributed dataset (RDD) as one chunk.
+
+    Tasks of crashed executors are retried by Spark itself, as configured by its
+    spark.task.maxFailures setting.
+
+    With a serializer, arguments are sent as packed chunks, one per partition, because
+    Spark would otherwise pickle them itself.
+
+    With a timeout, a deadline or a cost estimate, each partition is instead evaluated by
+    a job of its own, which a dispatcher submits in order of decreasing cost and cancels
+    via Spark's job groups.
+
+    Streamed arguments are evaluated in consecutive batches of prefetch arguments, each of
+    which becomes a resilient distributed dataset of its own. With a cancel token, all
+    arguments are evaluated in such batches, so that the token is checked in between.
+    """
+    start_time = _perf_counter()
+    error_policy = _normalize_error_policy(error_policy)
+    task = _create_task(function, unpack, initializer, initargs, warmup, error_policy,
+                        session=session, cache_size=worker_cache_size,
+                        connection=connection, serializer=serializer,
+                        result_typecode=result_typecode, shard_writer=shard_writer)
+
+    def evaluate(argument_list):
+        if isinstance(argument_list, _Layout) or serializer is not None:
+            # Each partition receives a slice of columns or of a grid instead of value tuples,
+            # or a chunk that is packed in the format of the serializer
+            argument_list = _as_list(argument_list)
+            num_slots = connection.defaultParallelism
+            chunks = _split_into_chunks(
+                argument_list, _pool_chunk_size(len(argument_list), num_slots))
+            chunks = _serialization._pack_chunks(task, chunks)
+            return connection.parallelize(chunks, max(1, len(chunks))).map(task).collect()
+        input_rdd = connection.parallelize(argument_list)
+        output_rdd = input_rdd.mapPartitions(task.map_partition)
+        return output_rdd.collect()
+
+    if stream:
+        _reject_for_streaming(timeout=timeout, deadline=deadline, cost=cost)
+        batch_size = prefetch or _PREFETCH_PER_SLOT * connection.defaultParallelism
+        envelopes = _evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token)
+        return _stream(envelopes, report, start_time)
+    if timeout is not None or deadline is not None or cost is not None:
+        argument_list = _as_list(argument_list)
+        num_slots = connection.defaultParallelism
+        if cost is None:
+            chunk_size = _pool_chunk_size(len(argument_list), num_slots)
+            chunks, index_chunks = _split_into_chunks(argument_list, chunk_size), None
+        else:
+            chunks, index_chunks = _plan_cost_aware_chunks(
+                argument_list, unpack, cost, num_slots)
+        chunks = _serialization._pack_chunks(task, chunks)
+        adapter = _scheduling._SparkAdapter(task, connection, chunks)
+        dispatcher = _create_dispatcher(
+            adapter, error_policy, None, timeout, deadline, cancel_token=cancel_token)
+        envelopes = _run_dispatcher(dispatcher, adapter, chunks)
+        return _collect(envelopes, report, start_time, dispatcher.events, index_chunks)
+    if cancel_token is not None:
+        batch_size = _PREFETCH_PER_SLOT * connection.defaultParallelism
+        envelopes = list(_evaluate_in_batches(evaluate, argument_list, batch_size, cancel_token))
+        return _collect(envelopes, report, start_time)
+
+    envelopes = evaluate(argument_list)
+    return _collect(envelopes, report, start_time)
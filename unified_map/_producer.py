@@ -0,0 +1,185 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Private background production of input arguments.
+
+A _BackgroundProducer iterates over an expensive iterable of arguments in a thread or a
+process and passes the arguments through a bounded buffer, so that producing the next
+arguments overlaps with evaluating the previous ones in the workers.
+
+Both sides measure how long they were blocked by the buffer. A producer that often
+waits for free space indicates that the workers are the bottleneck, a consumer that
+often waits for arguments indicates that the input is the bottleneck.
+"""
+
+import functools as _functools
+import queue as _queue
+import threading as _threading
+from multiprocessing import get_all_start_methods as _get_all_start_methods
+from multiprocessing import get_context as _get_context
+from time import perf_counter as _perf_counter
+
+from .policies import _normalize_producer
+
+_ITEM = 0
+_END = 1
+_ERROR = 2
+
+
+def _put(buffer, message, stop_event):
+    """Put a message into a buffer unless the consumer stopped reading from it.
+
+    Returns:
+        False if the stop event was set before there was free space, otherwise True
+    """
+    if stop_event is None:
+        buffer.put(message)
+        return True
+    while not stop_event.is_set():
+        try:
+            buffer.put(message, timeout=0.1)
+            return True
+        except _queue.Full:
+            pass
+    return False
+
+
+def _produce(iterable, buffer, stop_event=None):
+    """Put all arguments of an iterable into a buffer, followed by a message with timings."""
+    production_time = 0.0
+    stall_time = 0.0
+    try:
+        iterator = iter(iterable)
+        while stop_event is None or not stop_event.is_set():
+            start = _perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            production_time += _perf_counter() - start
+            start = _perf_counter()
+            if not _put(buffer, (_ITEM, item), stop_event):
+                return
+            stall_time += _perf_counter() - start
+    except Exception as exception:
+        _put(buffer, (_ERROR, (exception, production_time, stall_time)), stop_event)
+    else:
+        _put(buffer, (_END, (production_time, stall_time)), stop_event)
+
+
+class _BackgroundProducer:
+    """Iterator over the arguments of an iterable that is consumed in a thread or a process.
+
+    The background thread or process is started when the first argument is requested.
+    A process is forked if possible, so that generators do not need to be pickled.
+    """
+
+    def __init__(self, iterable, kind, buffer_size):
+        self._iterable = iterable
+        self._kind = kind
+        self._buffer_size = buffer_size
+        self._worker = None
+        self._stop_event = None
+        self._finished = False
+        self.production_time = 0.0
+        self.producer_stall_time = 0.0
+        self.consumer_stall_time = 0.0
+
+    def _start(self):
+        if self._kind == 'thread':
+            self._buffer = _queue.Queue(maxsize=self._buffer_size)
+            self._stop_event = _threading.Event()
+            self._worker = _threading.Thread(
+                target=_produce, args=(self._iterable, self._buffer, self._stop_event),
+                daemon=True)
+        else:
+            if 'fork' in _get_all_start_methods():
+                context = _get_context('fork')
+            else:
+                context = _get_context()
+            self._buffer = context.Queue(maxsize=self._buffer_size)
+            self._worker = context.Process(
+                target=_produce, args=(self._iterable, self._buffer), daemon=True)
+        self._worker.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        if self._worker is None:
+            self._start()
+        start = _perf_counter()
+        kind, value = self._buffer.get()
+        self.consumer_stall_time += _perf_counter() - start
+        if kind == _ITEM:
+            return value
+        self._finished = True
+        if kind == _ERROR:
+            exception, self.production_time, self.producer_stall_time = value
+            self.close()
+            raise exception
+        self.production_time, self.producer_stall_time = value
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """Stop the background thread or process and release its resources."""
+        self._finished = True
+        if self._worker is None:
+            return
+        if self._kind == 'thread':
+            self._stop_event.set()
+            self._worker.join()
+        else:
+            if self._worker.is_alive():
+                self._worker.terminate()
+            self._worker.join()
+            self._buffer.close()
+            self._buffer.join_thread()
+        self._worker = None
+
+    def _record(self, report):
+        """Add the timings of producer and consumer to a report."""
+        if report is not None:
+            report.production_time = self.production_time
+            report.producer_stall_time = self.producer_stall_time
+            report.consumer_stall_time = self.consumer_stall_time
+
+
+def _close_after(iterator, producer, report):
+    """Yield from a result iterator and stop the producer of its arguments at the end."""
+    try:
+        yield from iterator
+    finally:
+        producer.close()
+    producer._record(report)
+
+
+def _with_producer(run):
+    """Let a runner of the engine pull its arguments from an optional background producer.
+
+    The decorated runner accepts an additional keyword argument producer, which is a
+    :class:`~unified_map.policies.Producer` object, 'thread', 'process' or None.
+    """
+    @_functools.wraps(run)
+    def run_with_producer(function, argument_list, producer=None, **kwargs):
+        producer = _normalize_producer(producer)
+        if producer is None:
+            return run(function, argument_list, **kwargs)
+        stream = kwargs.get('stream', False)
+        report = kwargs.get('report')
+        background = _BackgroundProducer(argument_list, producer.kind, producer.buffer_size)
+        try:
+            result = run(function, background, **kwargs)
+        except BaseException:
+            background.close()
+            raise
+        if stream:
+            return _close_after(result, background, report)
+        background.close()
+        background._record(report)
+        return result
+
+    return run_with_producer
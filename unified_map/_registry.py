@@ -0,0 +1,203 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Private registry that ships large functions to each worker process only once.
+
+Every task that is sent to a worker carries the function it applies, which is pickled
+again for each task. For a function with a large closure, e.g. a callable object that
+holds a model or a lookup table, this dominates the bytes that are sent. The registry
+instead pickles such a function once, identifies it by a hash of its bytes and makes the
+bytes available through a channel that each worker reads at most once:
+
+- A file in a temporary directory for the worker processes of this machine.
+- An object that is scattered to all workers of a Dask cluster.
+- A broadcast variable of a Spark context.
+
+Tasks only carry a small reference with the function id, and each worker keeps the
+functions it loaded, so that later tasks and later map calls of a
+:class:`~unified_map.mapper.Mapper` with an equal function do not load it again.
+Functions are pickled by the pickle module, or by cloudpickle if a
+:class:`~unified_map.policies.Serializer` asks for it. Functions that can not be pickled
+that way, e.g. lambdas that Dask, Joblib and Spark pickle by value themselves, are sent
+with each task as before.
+"""
+
+import collections as _collections
+import functools as _functools
+import hashlib as _hashlib
+import os as _os
+import pickle as _pickle
+import shutil as _shutil
+import tempfile as _tempfile
+import threading as _threading
+import weakref as _weakref
+
+# Functions with fewer pickled bytes are sent with each task, which is cheaper than a lookup
+_MIN_REGISTERED_SIZE = 64 * 1024
+
+# Number of functions that a worker process keeps after loading them
+_MAX_LOADED_FUNCTIONS = 8
+
+# Functions that were loaded in this process, keyed by function id and ordered from least
+# to most recently used
+_loaded_functions = _collections.OrderedDict()
+
+
+class _FileLocation:
+    """Bytes of a function in a file that is readable by all processes of this machine."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+
+class _DaskLocation:
+    """Bytes of a function that were scattered to all workers of a Dask cluster."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def load(self):
+        from distributed import Future, get_client, get_worker
+
+        data = get_worker().data
+        if self.key in data:
+            return data[self.key]
+        # A worker that joined after the function was scattered fetches it from a peer
+        return Future(self.key, get_client()).result()
+
+
+class _BroadcastLocation:
+    """Bytes of a function in a broadcast variable of a Spark context."""
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+
+    def load(self):
+        return self.broadcast.value
+
+
+class _FunctionReference:
+    """Picklable reference to a registered function, which a worker loads at most once.
+
+    In the parent process, the reference also keeps its registry alive, so that the bytes
+    of the function remain available as long as a task refers to them.
+    """
+
+    def __init__(self, function_id, location, size, registry=None):
+        self.function_id = function_id
+        self.location = location
+        self.size = size
+        self._registry = registry
+
+    def __reduce__(self):
+        return self.__class__, (self.function_id, self.location, self.size)
+
+    def __repr__(self):
+        return '<{} {} of {} bytes>'.format(self.__class__.__name__, self.function_id, self.size)
+
+    def resolve(self):
+        """Return the function, loading it only if this process has not done so before."""
+        try:
+            function = _loaded_functions[self.function_id]
+        except KeyError:
+            function = _pickle.loads(self.location.load())
+            _loaded_functions[self.function_id] = function
+            while len(_loaded_functions) > _MAX_LOADED_FUNCTIONS:
+                _loaded_functions.popitem(last=False)
+        else:
+            _loaded_functions.move_to_end(self.function_id)
+        return function
+
+
+def _resolve(function):
+    """Return the function behind a reference, or the function itself."""
+    if isinstance(function, _FunctionReference):
+        return function.resolve()
+    return function
+
+
+def _release(resources):
+    """Release the files and broadcast variables of a registry."""
+    while resources:
+        release = resources.pop()
+        release()
+
+
+class _FunctionRegistry:
+    """Functions of this process that were made available to the workers of a backend.
+
+    Each function id is published once, so that a registry which is kept by a session
+    serves all map calls with an equal function. Published bytes are released when the
+    registry is closed or garbage collected.
+
+    Args:
+        connection (optional): A Dask client or a Spark context whose workers receive the
+            functions. If it is None, functions are stored in files that can be read by
+            the worker processes of this machine.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self._lock = _threading.Lock()
+        self._locations = {}
+        self._directory = None
+        # Scattered Dask futures, which keep their data on the cluster while referenced
+        self._futures = []
+        self._resources = []
+        self._finalizer = _weakref.finalize(self, _release, self._resources)
+
+    def reference(self, function, dumps=_pickle.dumps):
+        """Return a reference to a registered function, or the function if it is small.
+
+        Args:
+            function: A callable object
+            dumps (optional): The dumps() function of a pickler, e.g. of cloudpickle
+
+        Returns:
+            A :class:`_FunctionReference`, or the function itself if it can not be
+            pickled or its pickled bytes are fewer than _MIN_REGISTERED_SIZE
+        """
+        try:
+            payload = dumps(function, protocol=_pickle.HIGHEST_PROTOCOL)
+        except (_pickle.PicklingError, AttributeError, TypeError):
+            return function
+        if len(payload) < _MIN_REGISTERED_SIZE:
+            return function
+        function_id = _hashlib.blake2b(payload, digest_size=16).hexdigest()
+        with self._lock:
+            if function_id not in self._locations:
+                self._locations[function_id] = self._publish(function_id, payload)
+            location = self._locations[function_id]
+        return _FunctionReference(function_id, location, len(payload), self)
+
+    def _publish(self, function_id, payload):
+        """Make the bytes of a function available to all workers of the backend."""
+        connection = self.connection
+        if connection is None:
+            if self._directory is None:
+                self._directory = _tempfile.mkdtemp(prefix='unified_map-functions-')
+                self._resources.append(_functools.partial(
+                    _shutil.rmtree, self._directory, ignore_errors=True))
+            path = _os.path.join(self._directory, function_id + '.pickle')
+            with open(path, 'wb') as file:
+                file.write(payload)
+            return _FileLocation(path)
+        if hasattr(connection, 'scatter'):
+            future = connection.scatter(payload, broadcast=True, hash=False)
+            self._futures.append(future)
+            return _DaskLocation(future.key)
+        broadcast = connection.broadcast(payload)
+        self._resources.append(broadcast.unpersist)
+        return _BroadcastLocation(broadcast)
+
+    def close(self):
+        """Release all published functions."""
+        with self._lock:
+            self._locations.clear()
+            self._directory = None
+            self._futures = []
+        self._finalizer()
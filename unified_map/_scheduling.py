@@ -0,0 +1,917 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Private dynamic scheduling of chunk tasks on executors that return futures.
+
+The dispatcher keeps only a bounded number of tasks in flight, which means that the
+parent process knows when each task started running and which tasks were affected when a
+worker process crashed. This is the basis for re-executing straggling tasks speculatively
+on idle workers, for retrying crashed tasks on fresh workers and for cancelling tasks that
+exceed a time limit.
+
+Executors are accessed through small adapters with a common interface, so that the same
+dispatcher can drive a process pool executor, a multiprocessing pool, a Dask client or a
+Spark context.
+
+Worker processes ignore SIGINT, so that Ctrl+C only interrupts the parent process, which
+then terminates all workers instead of leaving them behind with half-finished tasks.
+"""
+
+import bisect as _bisect
+import collections as _collections
+import functools as _functools
+import hashlib as _hashlib
+import itertools as _itertools
+import pickle as _pickle
+import queue as _queue
+import signal as _signal
+import statistics as _statistics
+import threading as _threading
+import uuid as _uuid
+from concurrent.futures import Future as _Future
+from time import perf_counter as _perf_counter
+from time import sleep as _sleep
+
+from .exceptions import DeadlineExceededError as _DeadlineExceededError
+from .exceptions import MapCancelledError as _MapCancelledError
+from .exceptions import TaskTimeoutError as _TaskTimeoutError
+from .exceptions import WorkerCrashError as _WorkerCrashError
+
+# Seconds that terminated worker processes get to exit before they are killed
+_TERMINATION_GRACE_PERIOD = 1.0
+
+_CRASH_MESSAGE = (
+    'A worker process terminated abruptly while evaluating the function, e.g. because of a '
+    'segmentation fault or because it was killed when running out of memory.')
+
+
+def _ignore_interrupts():
+    """Let a worker process ignore SIGINT, which is handled by the parent process instead."""
+    _signal.signal(_signal.SIGINT, _signal.SIG_IGN)
+
+
+def _check_cancelled(cancel_token):
+    """Raise an error if a cancel token was cancelled.
+
+    Raises:
+        MapCancelledError: If the token is cancelled.
+    """
+    if cancel_token is not None and cancel_token.cancelled:
+        raise _MapCancelledError('The map call was cancelled.')
+
+
+class _FuturesAdapter:
+    """Adapter for a process pool executor from concurrent.futures.
+
+    Futures are never cancelled. A cancelled future that is still queued inside the
+    executor makes its management thread fail when the worker processes are terminated
+    afterwards, which leaves the pipes of the executor open. Instead, results of losing or
+    abandoned attempts are ignored and their processes are terminated at the end.
+    """
+
+    poll_interval = None
+    can_cancel_running = False
+    recycles_natively = False
+
+    def __init__(self, task, num_workers):
+        self.task = task
+        self._num_workers = num_workers
+        self.num_slots = num_workers
+        self._executor = self._create()
+
+    def _create(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(max_workers=self._num_workers, initializer=_ignore_interrupts)
+
+    def submit(self, index, chunk, duplicate):
+        return self.submit_task(self.task, chunk)
+
+    def submit_task(self, task, chunk):
+        """Submit a chunk with another task than the one of the adapter.
+
+        An executor that broke after the last completed future refuses new submissions,
+        which is turned into a failed future, so that the crash is handled as usual.
+        """
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            return self._executor.submit(task, chunk)
+        except BrokenProcessPool as exception:
+            future = Future()
+            future.set_exception(exception)
+            return future
+
+    def cancel(self, future):
+        pass
+
+    def is_broken(self):
+        return False
+
+    def is_crash(self, exception):
+        from concurrent.futures.process import BrokenProcessPool
+
+        return isinstance(exception, BrokenProcessPool)
+
+    def restart(self, abandoned=True):
+        self.shutdown(abandoned)
+        self._executor = self._create()
+
+    def shutdown(self, abandoned):
+        """Release the executor, terminating its processes if tasks were abandoned."""
+        if abandoned:
+            _terminate_executor(self._executor)
+        else:
+            self._executor.shutdown(wait=True)
+
+
+class _PoolAdapter:
+    """Adapter for a multiprocessing pool, whose apply_async() results are turned into futures.
+
+    A multiprocessing pool silently replaces crashed workers and never completes the
+    task they were running, so crashes are detected by polling the exit codes of all
+    worker processes the pool ever had. Workers that retire after max_tasks_per_worker
+    tasks exit regularly and are replaced by the pool itself.
+    """
+
+    poll_interval = 0.1
+    can_cancel_running = False
+
+    def __init__(self, task, num_workers, context=None, max_tasks_per_worker=None):
+        self.task = task
+        self._num_workers = num_workers
+        self._context = context
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self.num_slots = num_workers
+        self.recycles_natively = max_tasks_per_worker is not None
+        self._create()
+
+    def _create(self):
+        if self._context is None:
+            from multiprocessing import Pool
+        else:
+            Pool = self._context.Pool
+        self._pool = Pool(processes=self._num_workers, initializer=_ignore_interrupts,
+                          maxtasksperchild=self._max_tasks_per_worker)
+        self._processes = set(self._pool._pool)
+
+    def submit(self, index, chunk, duplicate):
+        return self.submit_task(self.task, chunk)
+
+    def submit_task(self, task, chunk):
+        """Submit a chunk with another task than the one of the adapter."""
+        future = _Future()
+        future.set_running_or_notify_cancel()
+        self._pool.apply_async(task, (chunk,), callback=future.set_result,
+                               error_callback=future.set_exception)
+        return future
+
+    def cancel(self, future):
+        pass
+
+    def is_broken(self):
+        self._processes.update(self._pool._pool)
+        # Workers that retired regularly are forgotten, so that the set does not grow
+        self._processes = {process for process in self._processes if process.exitcode != 0}
+        return any(process.exitcode is not None for process in self._processes)
+
+    def is_crash(self, exception):
+        return False
+
+    def restart(self, abandoned=True):
+        self.shutdown(abandoned)
+        self._create()
+
+    def shutdown(self, abandoned):
+        """Release the pool, terminating its processes if tasks were abandoned."""
+        if abandoned:
+            _terminate_pool(self._pool)
+        else:
+            self._pool.close()
+        self._pool.join()
+        self._processes = set()
+
+
+class _AffinityAdapter:
+    """Adapter that sends each chunk to a fixed one of several single-worker adapters.
+
+    Before a run, routes is set to a list with the position of the target adapter of each
+    chunk. A crash or a recycle restarts all of them, which the dispatcher can not tell
+    apart.
+    """
+
+    def __init__(self, adapters):
+        self._adapters = adapters
+        self.routes = []
+        self.num_slots = len(adapters)
+        self.poll_interval = adapters[0].poll_interval
+        self.can_cancel_running = adapters[0].can_cancel_running
+        self.recycles_natively = adapters[0].recycles_natively
+
+    @property
+    def task(self):
+        return self._adapters[0].task
+
+    @task.setter
+    def task(self, task):
+        for adapter in self._adapters:
+            adapter.task = task
+
+    def submit(self, index, chunk, duplicate):
+        return self._adapters[self.routes[index]].submit(index, chunk, duplicate)
+
+    def cancel(self, future):
+        self._adapters[0].cancel(future)
+
+    def is_broken(self):
+        return any(adapter.is_broken() for adapter in self._adapters)
+
+    def is_crash(self, exception):
+        return self._adapters[0].is_crash(exception)
+
+    def restart(self, abandoned=True):
+        for adapter in self._adapters:
+            adapter.restart(abandoned)
+
+    def shutdown(self, abandoned):
+        for adapter in self._adapters:
+            adapter.shutdown(abandoned)
+
+
+class _Submitter:
+    """Single tasks on the workers of an adapter, whose futures fail if a worker crashes.
+
+    Without a dispatcher, a crash would leave the futures of a multiprocessing pool
+    pending forever and an executor broken for all later submissions. Instead, a crash
+    fails all pending futures with a WorkerCrashError, as a map call with error policy
+    'raise' does, and the workers are restarted before the next submission. Crashes of a
+    pool are detected by a thread that polls its workers while futures are pending.
+    """
+
+    def __init__(self, adapter):
+        self._adapter = adapter
+        self._lock = _threading.Lock()
+        self._pending = set()
+        self._generation = 0
+        self._broken = False
+        self._watcher = None
+
+    def submit_task(self, task, chunk):
+        """Submit a chunk of a task.
+
+        Returns:
+            A future that holds the envelope of the task
+        """
+        future = _Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            if self._broken:
+                self._adapter.restart()
+                self._broken = False
+            generation = self._generation
+            self._pending.add(future)
+            inner_future = self._adapter.submit_task(task, chunk)
+            if self._adapter.poll_interval is not None and self._watcher is None:
+                self._watcher = _threading.Thread(target=self._watch, daemon=True)
+                self._watcher.start()
+        inner_future.add_done_callback(
+            _functools.partial(self._transfer, future, generation))
+        return future
+
+    def _transfer(self, future, generation, inner_future):
+        exception = inner_future.exception()
+        if exception is not None and self._adapter.is_crash(exception):
+            self._fail_pending(generation)
+            return
+        with self._lock:
+            if future not in self._pending:
+                return
+            self._pending.remove(future)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(inner_future.result())
+
+    def _watch(self):
+        while True:
+            _sleep(self._adapter.poll_interval)
+            with self._lock:
+                if not self._pending:
+                    self._watcher = None
+                    return
+                generation = self._generation
+                broken = self._adapter.is_broken()
+            if broken:
+                self._fail_pending(generation)
+
+    def _fail_pending(self, generation):
+        """Fail all futures of the workers that crashed, unless it was already done."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._generation += 1
+            self._broken = True
+            pending, self._pending = self._pending, set()
+        for future in pending:
+            future.set_exception(_WorkerCrashError(_CRASH_MESSAGE))
+
+    def shutdown(self, abandoned):
+        """Release the adapter, terminating its processes if tasks were abandoned or lost."""
+        self._adapter.shutdown(abandoned or self._broken)
+
+
+class _DaskClientAdapter:
+    """Adapter for a client that is connected to a Dask scheduler.
+
+    The scheduler itself reschedules tasks of lost workers, therefore crashes are not
+    handled here but by the retries argument of each submitted task. Cancelling a
+    running task releases it on the scheduler, but its thread keeps running in the worker.
+    """
+
+    poll_interval = None
+    can_cancel_running = True
+    recycles_natively = False
+
+    def __init__(self, task, client, retries=0):
+        self.task = task
+        self._client = client
+        self._retries = retries
+        self.num_slots = sum(client.ncores().values())
+        # Optional worker addresses and the position of the preferred one of each chunk
+        self.addresses = None
+        self.routes = None
+
+    def submit(self, index, chunk, duplicate):
+        placement = {}
+        if self.routes is not None:
+            address = self.addresses[self.routes[index]]
+            placement = dict(workers=[address], allow_other_workers=True)
+        if duplicate:
+            idle_workers = [address for address, keys in self._client.processing().items()
+                            if not keys]
+            if idle_workers:
+                placement = dict(workers=idle_workers, allow_other_workers=False)
+        return self._client.submit(
+            self.task, chunk, pure=False, retries=self._retries, **placement)
+
+    def cancel(self, future):
+        future.cancel()
+
+    def is_broken(self):
+        return False
+
+    def is_crash(self, exception):
+        return False
+
+    def restart(self, abandoned=True):
+        pass
+
+    def shutdown(self, abandoned):
+        pass
+
+
+class _SparkAdapter:
+    """Adapter for a Spark context that runs each chunk as a separate job.
+
+    Every chunk becomes one partition of an RDD. A thread per execution slot submits jobs
+    for single partitions with runJob(), and each job belongs to its own job group, so
+    that it can be cancelled individually. Spark then interrupts the executor threads.
+    """
+
+    poll_interval = None
+    can_cancel_running = True
+    recycles_natively = False
+
+    def __init__(self, task, context, chunks):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._context = context
+        self._rdd = context.parallelize(chunks, max(1, len(chunks))).map(task)
+        self._group_prefix = 'unified_map-{}'.format(_uuid.uuid4().hex)
+        self.num_slots = context.defaultParallelism
+        self._threads = ThreadPoolExecutor(max_workers=self.num_slots)
+        self._groups = {}
+
+    def _run_partition(self, index):
+        self._context.setJobGroup(
+            '{}-{}'.format(self._group_prefix, index), 'unified_map partition {}'.format(index),
+            interruptOnCancel=True)
+        return self._context.runJob(self._rdd, lambda iterator: iterator, [index])[0]
+
+    def submit(self, index, chunk, duplicate):
+        future = self._threads.submit(self._run_partition, index)
+        self._groups[future] = '{}-{}'.format(self._group_prefix, index)
+        return future
+
+    def cancel(self, future):
+        if not future.cancel():
+            self._context.cancelJobGroup(self._groups[future])
+
+    def is_broken(self):
+        return False
+
+    def is_crash(self, exception):
+        return False
+
+    def restart(self, abandoned=True):
+        pass
+
+    def shutdown(self, abandoned):
+        if abandoned:
+            for future in self._groups:
+                if not future.done():
+                    self.cancel(future)
+        self._threads.shutdown(wait=not abandoned)
+
+
+class _Dispatcher:
+    """Submit chunks to an executor adapter and gather their envelopes in input order.
+
+    Chunks are pulled lazily from an iterable, so that an unbounded stream of chunks can be
+    processed with a bounded number of chunks held in memory at any time.
+
+    Args:
+        adapter: An executor adapter, e.g. a _FuturesAdapter
+        speculation (optional): A :class:`~unified_map.policies.Speculation` object
+        max_crash_retries (optional): How often a chunk is retried on a fresh worker after
+            it crashed its worker process. None means that a crash raises immediately.
+        return_crashes (optional): If True, a chunk that crashed more often than allowed
+            gets a :class:`~unified_map.exceptions.WorkerCrashError` in each of its result
+            slots, otherwise such an error is raised.
+        timeout (optional): Seconds after which a running task is cancelled and each of
+            its result slots gets a :class:`~unified_map.exceptions.TaskTimeoutError`
+        deadline (optional): Seconds after which the whole run stops and each result slot
+            of an unfinished task gets a :class:`~unified_map.exceptions.DeadlineExceededError`
+        max_tasks_per_worker (optional): Number of tasks after which a worker is recycled.
+            If the adapter cannot do this by itself, all workers are recycled together.
+        max_worker_memory (optional): Resident set size in bytes above which all workers
+            are recycled together
+        max_in_flight (optional): Upper limit for the number of tasks in flight, e.g. to
+            keep the estimated memory usage of all running tasks within a budget
+        chunk_info (optional): A callable that creates the info of a chunk that has no
+            envelope from a worker, e.g. because it crashed or timed out
+        cancel_token (optional): A :class:`~unified_map.policies.CancelToken` object,
+            whose cancellation stops the dispatch with a
+            :class:`~unified_map.exceptions.MapCancelledError`
+    """
+
+    def __init__(self, adapter, speculation=None, max_crash_retries=None,
+                 return_crashes=False, timeout=None, deadline=None, max_tasks_per_worker=None,
+                 max_worker_memory=None, max_in_flight=None, chunk_info=None,
+                 cancel_token=None):
+        self._adapter = adapter
+        self._speculation = speculation
+        self._max_crash_retries = max_crash_retries
+        self._return_crashes = return_crashes
+        self._timeout = timeout
+        self._deadline = deadline
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._max_worker_memory = max_worker_memory
+        self._chunk_info = chunk_info or (lambda num_items: dict(num_items=num_items))
+        self._cancel_token = cancel_token
+        self._num_slots = max(1, adapter.num_slots)
+        if max_in_flight is not None:
+            self._num_slots = max(1, min(self._num_slots, max_in_flight))
+        # Exact slot accounting is needed when durations are measured or memory is limited,
+        # otherwise a small surplus of queued tasks hides the latency between a result and
+        # the next submission
+        exact = speculation is not None or timeout is not None or max_in_flight is not None
+        self._max_in_flight = self._num_slots if exact else 2 * self._num_slots
+        self.events = _collections.Counter()
+        self.num_abandoned = 0
+
+    def run(self, chunks):
+        """Evaluate all chunks and return their envelopes in the order of the chunks."""
+        return list(self.stream(chunks))
+
+    def stream(self, chunks, window=None, ordered=True):
+        """Evaluate chunks from an iterable and yield their envelopes in the order of the chunks.
+
+        If window is given, at most that many chunks are pulled ahead of the oldest chunk
+        whose envelope was not yielded yet. When the deadline passes, the stream then ends
+        after the chunks that were already pulled, otherwise all remaining chunks are pulled
+        and get errors in their result slots. If ordered is False, envelopes are yielded
+        as soon as they are finished and the window limits the number of chunks that were
+        pulled but not yielded.
+        """
+        self._source = iter(chunks)
+        self._window = window
+        self._exhausted = False
+        self._chunks = {}
+        self._envelopes = {}
+        self._attempts = {}
+        self._crashes = _collections.Counter()
+        self._num_pulled = 0
+        self._num_yielded = 0
+        self._num_finished = 0
+        self._durations = []
+        self._pending = _collections.deque()
+        self._suspects = _collections.deque()
+        self._running = {}
+        self._completed = _queue.Queue()
+        self._recycling = False
+        self._end_time = None if self._deadline is None else _perf_counter() + self._deadline
+        # Cancellation wakes up a dispatcher that waits for the next completed future
+        wake_up = _functools.partial(self._completed.put, None)
+        if self._cancel_token is not None:
+            self._cancel_token._add_callback(wake_up)
+        try:
+            while True:
+                _check_cancelled(self._cancel_token)
+                while self._envelopes and (not ordered or self._num_yielded in self._envelopes):
+                    index = self._num_yielded if ordered else next(iter(self._envelopes))
+                    envelope = self._envelopes.pop(index)
+                    del self._chunks[index], self._attempts[index]
+                    self._num_yielded += 1
+                    yield envelope
+                if self._exhausted and self._num_yielded == self._num_pulled:
+                    break
+                self._launch_tasks()
+                if not self._running:
+                    continue
+                future = self._wait()
+                if future is not None:
+                    self._process(future)
+                self._enforce_time_limits()
+        finally:
+            if self._cancel_token is not None:
+                self._cancel_token._remove_callback(wake_up)
+            for future in list(self._running):
+                self._adapter.cancel(future)
+            self.num_abandoned = sum(1 for future in self._running if not future.done())
+
+    def _is_finished(self, index):
+        # Chunks are forgotten once their envelope was yielded
+        return index in self._envelopes or index not in self._chunks
+
+    def _pull(self):
+        """Move the next chunk from the source to the pending chunks if the window allows it."""
+        if self._exhausted:
+            return False
+        if self._window is not None and self._num_pulled - self._num_yielded >= self._window:
+            return False
+        try:
+            chunk = next(self._source)
+        except StopIteration:
+            self._exhausted = True
+            return False
+        index = self._num_pulled
+        self._chunks[index] = chunk
+        self._attempts[index] = 0
+        self._num_pulled += 1
+        self._pending.append(index)
+        return True
+
+    def _is_at_tail(self):
+        """Whether no further chunk can be launched, which is when stragglers matter."""
+        if self._pending:
+            return False
+        if self._exhausted:
+            return True
+        return self._window is not None and self._num_pulled - self._num_yielded >= self._window
+
+    def _launch(self, index, duplicate):
+        future = self._adapter.submit(index, self._chunks[index], duplicate)
+        self._running[future] = (index, _perf_counter(), duplicate)
+        self._attempts[index] += 1
+        future.add_done_callback(self._completed.put)
+
+    def _launch_tasks(self):
+        if self._recycling:
+            # Workers are replaced gracefully once all tasks in flight are finished
+            if self._running:
+                return
+            self._adapter.restart(abandoned=False)
+            self._recycling = False
+            self.events['worker_recycles'] += self._num_slots
+        if self._suspects:
+            # Suspects of a crash run in isolation, so that a repeated crash is attributable
+            while self._suspects and not self._running:
+                self._launch(self._suspects.popleft(), False)
+            return
+        while len(self._running) < self._max_in_flight and (self._pending or self._pull()):
+            self._launch(self._pending.popleft(), False)
+        if self._speculation is not None and self._is_at_tail():
+            for index in self._find_stragglers():
+                self._launch(index, True)
+                self.events['speculative_launches'] += 1
+
+    def _wait(self):
+        timeouts = [self._adapter.poll_interval]
+        if self._speculation is not None and self._is_at_tail():
+            timeouts.append(self._speculation.poll_interval)
+        now = _perf_counter()
+        if self._timeout is not None and self._running:
+            earliest_start = min(start_time for _, start_time, _ in self._running.values())
+            timeouts.append(max(0.0, earliest_start + self._timeout - now))
+        if self._end_time is not None:
+            timeouts.append(max(0.0, self._end_time - now))
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        try:
+            return self._completed.get(timeout=min(timeouts) if timeouts else None)
+        except _queue.Empty:
+            if self._adapter.is_broken():
+                self._recover_from_crash()
+            return None
+
+    def _process(self, future):
+        entry = self._running.pop(future, None)
+        if entry is None:
+            # Belongs to an executor that was replaced after a crash or a timeout
+            return
+        index, start_time, duplicate = entry
+        if self._is_finished(index) or future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            if self._adapter.is_crash(exception):
+                self._running[future] = entry
+                self._recover_from_crash()
+                return
+            raise exception
+        envelope = future.result()
+        self._finish(index, envelope)
+        self._check_recycling(envelope[1])
+        self._durations.append(_perf_counter() - start_time)
+        if duplicate:
+            self.events['speculative_wins'] += 1
+        for other, (other_index, _, _) in list(self._running.items()):
+            if other_index == index:
+                self._adapter.cancel(other)
+
+    def _check_recycling(self, info):
+        """Decide from the info of an envelope whether its worker needs to be recycled."""
+        limit = self._max_tasks_per_worker
+        if limit is not None and info.get('worker_tasks', 0) >= limit:
+            if not self._adapter.recycles_natively:
+                self._recycling = True
+            elif info['worker_tasks'] == limit:
+                self.events['worker_recycles'] += 1
+        limit = self._max_worker_memory
+        if limit is not None and info.get('memory', 0) > limit:
+            self._recycling = True
+
+    def _finish(self, index, envelope):
+        self._envelopes[index] = envelope
+        self._num_finished += 1
+
+    def _finish_with_error(self, index, error):
+        num_items = len(self._chunks[index])
+        self._finish(index, ([error] * num_items, self._chunk_info(num_items)))
+
+    def _enforce_time_limits(self):
+        """Stop tasks that exceeded the timeout and all tasks once the deadline passed."""
+        now = _perf_counter()
+        if self._end_time is not None and now >= self._end_time:
+            error = _DeadlineExceededError(
+                'The deadline of {} seconds was exceeded before this argument was '
+                'evaluated.'.format(self._deadline))
+            if self._window is None:
+                while self._pull():
+                    pass
+            for index in list(self._chunks):
+                if not self._is_finished(index):
+                    self._finish_with_error(index, error)
+                    self.events['deadline_exceeded'] += len(self._chunks[index])
+            self._exhausted = True
+            self._pending.clear()
+            self._suspects.clear()
+            return
+        if self._timeout is None:
+            return
+        expired = []
+        for future, (index, start_time, _) in self._running.items():
+            if not self._is_finished(index) and now - start_time > self._timeout:
+                expired.append(future)
+        if not expired:
+            return
+        error = _TaskTimeoutError(
+            'The evaluation of this argument took longer than the timeout of {} '
+            'seconds.'.format(self._timeout))
+        for future in expired:
+            index = self._running[future][0]
+            if not self._is_finished(index):
+                self._finish_with_error(index, error)
+                self.events['timeouts'] += 1
+        if self._adapter.can_cancel_running:
+            for future in expired:
+                self._adapter.cancel(future)
+            return
+        # Hanging tasks can only be stopped by replacing all worker processes, which
+        # means that the other tasks in flight need to be submitted again
+        interrupted = sorted({index for index, _, _ in self._running.values()
+                              if not self._is_finished(index)}, reverse=True)
+        self._running.clear()
+        self._adapter.restart()
+        self.events['worker_replacements'] += 1
+        self._pending.extendleft(interrupted)
+
+    def _recover_from_crash(self):
+        """Replace the broken executor and reschedule all tasks that were in flight."""
+        self.events['worker_crashes'] += 1
+        lost = []
+        for index, _, _ in self._running.values():
+            if not self._is_finished(index) and index not in lost:
+                lost.append(index)
+        isolated = len(self._running) == 1 and bool(lost)
+        self._running.clear()
+        self._adapter.restart()
+        self.events['worker_replacements'] += 1
+        if self._max_crash_retries is None:
+            raise _WorkerCrashError(_CRASH_MESSAGE)
+        if not isolated:
+            self._suspects.extend(sorted(lost))
+            return
+        index = lost[0]
+        self._crashes[index] += 1
+        if self._crashes[index] <= self._max_crash_retries:
+            self.events['crash_retries'] += 1
+            self._suspects.appendleft(index)
+            return
+        error = _WorkerCrashError(
+            'A worker process crashed {} times while evaluating the arguments of the same '
+            'task.'.format(self._crashes[index]))
+        if not self._return_crashes:
+            raise error
+        self._finish_with_error(index, error)
+
+    def _find_stragglers(self):
+        """Select running tasks that deserve a speculative duplicate on an idle slot."""
+        num_idle = self._num_slots - len(self._running)
+        if num_idle <= 0 or not self._durations:
+            return []
+        if self._num_finished < self._speculation.quantile * self._num_pulled:
+            return []
+        threshold = self._speculation.multiplier * _statistics.median(self._durations)
+        now = _perf_counter()
+        candidates = [
+            (now - start_time, index) for index, start_time, _ in self._running.values()
+            if not self._is_finished(index) and self._attempts[index] == 1
+            and now - start_time > threshold]
+        candidates.sort(reverse=True)
+        return [index for _, index in candidates[:num_idle]]
+
+
+def _plan_guided_chunks(costs, num_slots, max_chunk_size=None):
+    """Group argument indices into chunks of decreasing cost for dynamic dispatch.
+
+    Indices are sorted by decreasing cost, i.e. in longest-processing-time order. Chunks
+    are then formed by guided self-scheduling: each chunk receives about the remaining
+    total cost divided by the number of slots, so that chunk costs shrink towards the end
+    and the last tasks balance the load across all slots.
+
+    Args:
+        costs: A list of non-negative numbers, one estimated cost per argument
+        num_slots: Number of tasks that can run at the same time
+        max_chunk_size (optional): Upper limit for the number of arguments per chunk
+
+    Returns:
+        A list of lists of argument indices
+
+    Example:
+        >>> _plan_guided_chunks([1, 1, 8, 1, 1, 4], 2)
+        [[2], [5], [0, 1], [3], [4]]
+
+    References:
+        - https://doi.org/10.1109/TC.1987.5009495
+    """
+    if sum(costs) <= 0:
+        costs = [1] * len(costs)
+    order = sorted(range(len(costs)), key=lambda index: costs[index], reverse=True)
+    remaining_cost = float(sum(costs))
+    num_slots = max(1, num_slots)
+    chunks = []
+    chunk = []
+    chunk_cost = 0.0
+    for index in order:
+        cost = costs[index]
+        target = remaining_cost / num_slots
+        if chunk and (chunk_cost + cost > target or len(chunk) == max_chunk_size):
+            chunks.append(chunk)
+            remaining_cost -= chunk_cost
+            chunk = []
+            chunk_cost = 0.0
+        chunk.append(index)
+        chunk_cost += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _stable_hash(value):
+    """Hash of a picklable value that is the same in every process, unlike hash()."""
+    digest = _hashlib.blake2b(_pickle.dumps(value, protocol=4), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class _HashRing:
+    """Consistent hashing of keys onto a list of nodes, e.g. workers.
+
+    Each node is placed at several points of a ring of hash values, and a key belongs to
+    the node of the first point that follows the hash of the key. When a node is added or
+    removed, only the keys next to its points move to another node.
+
+    Args:
+        nodes: A list of distinct picklable node labels, e.g. worker addresses
+        num_points (optional): Number of points per node, which evens out the share of
+            keys of each node
+
+    Example:
+        >>> ring = _HashRing(['a', 'b', 'c'])
+        >>> ring.lookup('some key') == ring.lookup('some key')
+        True
+
+    References:
+        - https://doi.org/10.1145/258533.258660
+    """
+
+    def __init__(self, nodes, num_points=64):
+        points = sorted((_stable_hash((node, point)), position)
+                        for position, node in enumerate(nodes) for point in range(num_points))
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._positions = [position for _, position in points]
+
+    def lookup(self, key):
+        """Position of the node in the list of nodes that a key belongs to."""
+        index = _bisect.bisect(self._hashes, _stable_hash(key)) % len(self._hashes)
+        return self._positions[index]
+
+
+def _plan_routed_chunks(keys, nodes, chunk_size):
+    """Group argument indices into chunks whose arguments all belong to the same node.
+
+    Chunks of different nodes are interleaved, so that a dispatcher with a bounded number
+    of tasks in flight keeps all nodes busy.
+
+    Args:
+        keys: A list with the affinity key of each argument
+        nodes: A list of node labels, e.g. worker addresses
+        chunk_size: Upper limit for the number of arguments per chunk
+
+    Returns:
+        A tuple (index_chunks, routes), where routes holds the position of the node of
+        each chunk
+    """
+    ring = _HashRing(nodes)
+    node_indices = [[] for _ in nodes]
+    for index, key in enumerate(keys):
+        node_indices[ring.lookup(key)].append(index)
+    node_chunks = [
+        [(position, indices[start:start+chunk_size])
+         for start in range(0, len(indices), chunk_size)]
+        for position, indices in enumerate(node_indices)]
+    index_chunks, routes = [], []
+    for round_chunks in _itertools.zip_longest(*node_chunks):
+        for routed_chunk in round_chunks:
+            if routed_chunk is not None:
+                routes.append(routed_chunk[0])
+                index_chunks.append(routed_chunk[1])
+    return index_chunks, routes
+
+
+def _stop_processes(processes, grace_period=_TERMINATION_GRACE_PERIOD):
+    """Terminate worker processes and kill those that did not exit within the grace period."""
+    processes = list(processes)
+    for process in processes:
+        if process.exitcode is None:
+            process.terminate()
+    end_time = _perf_counter() + grace_period
+    for process in processes:
+        process.join(max(0.0, end_time - _perf_counter()))
+    for process in processes:
+        if process.exitcode is None:
+            process.kill()
+            process.join()
+
+
+def _kill_processes(processes):
+    """Kill all processes of a list that did not exit yet."""
+    for process in list(processes):
+        if process.exitcode is None:
+            process.kill()
+
+
+def _terminate_pool(pool, grace_period=_TERMINATION_GRACE_PERIOD):
+    """Terminate a multiprocessing pool and kill workers that did not exit within the grace period.
+
+    The pool terminates its workers itself, because it would replace workers that were
+    stopped from outside while its handler threads are still running. A watchdog kills
+    the workers the pool has at that time, so that terminate() returns in bounded time.
+    """
+    watchdog = _threading.Timer(grace_period, _kill_processes, args=(pool._pool,))
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        pool.terminate()
+    finally:
+        watchdog.cancel()
+    # Results that never arrive refer back to the pool, whose pipes would then stay open
+    # until the next garbage collection
+    pool._cache.clear()
+
+
+def _terminate_executor(executor):
+    """Shut down a process pool executor without waiting for tasks that are still running."""
+    _stop_processes((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=True)
@@ -0,0 +1,160 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Private serialization of tasks, chunks and results with a configurable serializer.
+
+Backends pickle whatever they send to workers with their own pickler. Objects that should
+be sent in the format of a :class:`~unified_map.policies.Serializer` are therefore
+wrapped in a _Packed object, which serializes its content into frames when the backend
+pickles it, and which turns back into the content itself when the backend unpickles it.
+This works the same way for process pools, Dask and Spark, and needs no changes to how
+they send data.
+
+A _SerializingTask wraps a chunk task, so that the task is packed when it is sent and
+the envelope it returns is packed when it was sent to a worker. Chunks are
+packed by the runners with pack() before they are submitted.
+"""
+
+import pickle as _pickle
+
+_LZ4 = 'lz4'
+_ZSTD = 'zstd'
+
+
+def _dumps_function(serializer):
+    """Return the dumps() function of the pickler of a serializer."""
+    if serializer is not None and serializer.pickler == 'cloudpickle':
+        import cloudpickle
+
+        return cloudpickle.dumps
+    return _pickle.dumps
+
+
+def _compress(codec, frame):
+    if codec == _LZ4:
+        import lz4.frame
+
+        return lz4.frame.compress(frame)
+    import zstandard
+
+    return zstandard.ZstdCompressor().compress(frame)
+
+
+def _decompress(codec, frame):
+    if codec == _LZ4:
+        import lz4.frame
+
+        return lz4.frame.decompress(frame)
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(frame)
+
+
+def _serialize(obj, serializer):
+    """Turn an object into frames, the first of which is the pickle stream.
+
+    Returns:
+        A tuple (codecs, frames), where codecs holds the compression codec of each frame
+        or None for an uncompressed one
+    """
+    dumps = _dumps_function(serializer)
+    buffers = []
+    if serializer.out_of_band:
+        stream = dumps(obj, protocol=5, buffer_callback=buffers.append)
+    else:
+        stream = dumps(obj, protocol=_pickle.HIGHEST_PROTOCOL)
+    # Raw views of out-of-band buffers are one-dimensional bytes, so len() is their size
+    frames = [stream] + [buffer.raw() for buffer in buffers]
+    codecs = [None] * len(frames)
+    if serializer.compression is not None:
+        for position, frame in enumerate(frames):
+            if len(frame) < serializer.compression_threshold:
+                continue
+            compressed = _compress(serializer.compression, frame)
+            # Incompressible frames, e.g. of random numbers, are sent as they are
+            if len(compressed) < len(frame):
+                frames[position] = compressed
+                codecs[position] = serializer.compression
+    return tuple(codecs), frames
+
+
+def _deserialize(codecs, *frames):
+    """Turn frames that were created by _serialize() back into the object."""
+    frames = [frame if codec is None else _decompress(codec, frame)
+              for codec, frame in zip(codecs, frames)]
+    return _pickle.loads(frames[0], buffers=frames[1:])
+
+
+class _Packed:
+    """Wrapper of an object that is serialized with a serializer when it is pickled.
+
+    Unpickling does not restore the wrapper but the object itself.
+    """
+
+    def __init__(self, obj, serializer):
+        self.obj = obj
+        self.serializer = serializer
+
+    def __len__(self):
+        # The dispatcher counts the arguments of chunks that failed or ran out of time
+        return len(self.obj)
+
+    def __reduce_ex__(self, protocol):
+        codecs, frames = _serialize(self.obj, self.serializer)
+        if protocol >= 5:
+            # The pickler of the backend can send buffers without copying them again
+            frames = [_pickle.PickleBuffer(frame) for frame in frames]
+        else:
+            frames = [bytes(frame) for frame in frames]
+        return _deserialize, (codecs,) + tuple(frames)
+
+
+def _unpacked(obj):
+    """Return the content of a wrapper that was not pickled, or the object itself."""
+    if isinstance(obj, _Packed):
+        return obj.obj
+    return obj
+
+
+class _SerializingTask:
+    """Chunk task that is sent, and whose envelopes are returned, in a serializer's format.
+
+    Envelopes are only packed by a task that was unpickled, i.e. sent to a worker, so that
+    a task that is evaluated where it was created, e.g. by a backend with a single job,
+    returns them as they are.
+    """
+
+    def __init__(self, task, serializer, unpickled=False):
+        self.task = task
+        self.serializer = serializer
+        self.unpickled = unpickled
+
+    def __reduce__(self):
+        return self.__class__, (_Packed(self.task, self.serializer), self.serializer, True)
+
+    def __call__(self, chunk):
+        envelope = self.task(_unpacked(chunk))
+        if not self.unpickled:
+            return envelope
+        return _Packed(envelope, self.serializer)
+
+    def map_partition(self, iterator):
+        """Evaluate a whole Spark partition as one chunk."""
+        yield self(list(iterator))
+
+    def pack(self, chunk):
+        """Wrap a chunk, so that it is sent in the format of the serializer."""
+        return _Packed(chunk, self.serializer)
+
+
+def _pack_chunks(task, chunks):
+    """Wrap chunks for a task that is sent in the format of a serializer, if it is one.
+
+    Returns:
+        A list if chunks is a list, otherwise an iterator
+    """
+    if not isinstance(task, _SerializingTask):
+        return chunks
+    if isinstance(chunks, list):
+        return [task.pack(chunk) for chunk in chunks]
+    return map(task.pack, chunks)
@@ -0,0 +1,174 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Columnar arguments for multivariate functions.
+
+Multivariate functions usually receive a list of argument tuples, one per function call.
+Large parameter sweeps are often held as separate columns instead, e.g. one list or array
+per parameter. Turning them into a list of tuples doubles the memory and costs time in
+the parent process, and the tuples are pickled one by one. All multivariate functions
+therefore also accept columns:
+
+- A :class:`Columns` object, which holds positional and keyword columns.
+- A dictionary that maps parameter names to columns, which are passed as keyword
+  arguments.
+- A pandas DataFrame, whose columns are passed as keyword arguments named like them.
+
+Chunks of columnar arguments are slices of the columns, e.g. views of NumPy arrays, and
+the tuple of values of each function call is only formed inside the worker that
+evaluates it.
+
+Example:
+    >>> import unified_map as umap
+    >>> def scale(x, y, factor=1):
+    ...     return (x + y) * factor
+    ...
+    >>> xs, ys = [1, 2, 3], [10, 20, 30]
+    >>> umap.multivariate.serial.map(scale, umap.columns.Columns(xs, ys))
+    [11, 22, 33]
+    >>> umap.multivariate.serial.map(scale, umap.columns.Columns(xs, ys, factor=[1, 0, -1]))
+    [11, 0, -33]
+    >>> umap.multivariate.serial.map(scale, dict(x=xs, y=ys))
+    [11, 22, 33]
+"""
+
+import abc as _abc
+
+
+class _Layout(_abc.ABC):
+    """Base class of argument lists whose slices can be formed without building value tuples.
+
+    Backends send slices of such argument lists to the workers, which only form the tuple
+    of values of each function call when they evaluate it. Subclasses provide len(),
+    slicing, indexing and iteration, and an attribute names with the keywords of the
+    trailing values of each tuple.
+    """
+
+    names = ()
+
+    def _bind(self, function):
+        """Wrap a function so that it accepts the value tuples of this argument list."""
+        if not self.names:
+            return function
+        return _KeywordCall(function, self._num_values() - len(self.names), self.names)
+
+    @_abc.abstractmethod
+    def _num_values(self):
+        """Number of values in each tuple, including the keyword ones."""
+
+
+class Columns(_Layout):
+    """Arguments of a multivariate function given as one column per parameter.
+
+    Each column is a sequence that supports len() and slicing, such as a list, a range, a
+    NumPy array or a pandas Series. All columns need to have the same length, which is the
+    number of function calls. Slicing a Columns object slices every column, and indexing
+    or iterating it forms tuples of values, positional ones first and keyword ones in the
+    order in which they were given.
+
+    Args:
+        *columns: Columns whose values are passed as positional arguments
+        **keyword_columns: Columns whose values are passed as keyword arguments
+
+    Raises:
+        ValueError: If no column is given or the columns differ in length.
+
+    Example:
+        >>> columns = Columns(range(4), [0.5, 1.5, 2.5, 3.5], label='abcd')
+        >>> len(columns)
+        4
+        >>> columns[1]
+        (1, 1.5, 'b')
+        >>> columns[2:]
+        Columns(2 positional, keywords=['label'], length=2)
+    """
+
+    def __init__(self, *columns, **keyword_columns):
+        self.columns = columns + tuple(keyword_columns.values())
+        self.names = tuple(keyword_columns)
+        if not self.columns:
+            raise ValueError('Columns needs at least one column.')
+        lengths = {len(column) for column in self.columns}
+        if len(lengths) > 1:
+            raise ValueError(
+                'All columns need to have the same length, got lengths {}.'.format(
+                    sorted(lengths)))
+        self._length = lengths.pop()
+
+    @classmethod
+    def _from_parts(cls, columns, names, length):
+        """Create a Columns object without validation, e.g. for a slice."""
+        instance = cls.__new__(cls)
+        instance.columns = tuple(columns)
+        instance.names = tuple(names)
+        instance._length = length
+        return instance
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            length = len(range(*index.indices(self._length)))
+            return self._from_parts(
+                [column[index] for column in self.columns], self.names, length)
+        return tuple(column[index] for column in self.columns)
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def __repr__(self):
+        return '{}({} positional, keywords={}, length={})'.format(
+            self.__class__.__name__, len(self.columns) - len(self.names), list(self.names),
+            self._length)
+
+    def _num_values(self):
+        return len(self.columns)
+
+
+class _KeywordCall:
+    """Picklable callable that passes trailing values as keyword arguments."""
+
+    def __init__(self, function, num_positional, names):
+        self.function = function
+        self.num_positional = num_positional
+        self.names = names
+
+    def __call__(self, *values):
+        num_positional = self.num_positional
+        keyword_arguments = dict(zip(self.names, values[num_positional:]))
+        return self.function(*values[:num_positional], **keyword_arguments)
+
+
+def _is_data_frame(argument_list):
+    """Recognize a pandas DataFrame without importing pandas."""
+    module = type(argument_list).__module__
+    return module.startswith('pandas') and hasattr(argument_list, 'columns')
+
+
+def _recognize(argument_list):
+    """Return columnar arguments as a Columns object, or None for other argument lists."""
+    if isinstance(argument_list, _Layout):
+        return argument_list
+    if isinstance(argument_list, dict):
+        return Columns(**argument_list)
+    if _is_data_frame(argument_list):
+        names = list(argument_list.columns)
+        columns = [argument_list[name].to_numpy() for name in names]
+        return Columns._from_parts(columns, names, len(argument_list))
+    return None
+
+
+def _prepare(function, argument_list):
+    """Turn columnar arguments into a Columns object and bind the function to them.
+
+    Other argument lists that can be sliced in the same way, like a
+    :class:`~unified_map.grid.Grid`, are kept as they are.
+
+    Returns:
+        A tuple (function, argument_list), which is unchanged for other argument lists
+    """
+    columns = _recognize(argument_list)
+    if columns is None:
+        return function, argument_list
+    return columns._bind(function), columns
@@ -0,0 +1,35 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Exceptions that are raised by parallel and distributed backends or placed in result slots."""
+
+
+class WorkerCrashError(RuntimeError):
+    """A worker process terminated abruptly while it was evaluating the function.
+
+    Typical causes are segmentation faults in C extensions or processes that were killed
+    by the operating system because they ran out of memory.
+    """
+
+
+class TaskTimeoutError(TimeoutError):
+    """The evaluation of an argument took longer than the timeout of its task.
+
+    Instead of being raised, an instance is placed in each result slot of the task that
+    was cancelled, so that results of all other tasks remain available.
+    """
+
+
+class DeadlineExceededError(TimeoutError):
+    """The deadline of a whole map call passed before an argument was evaluated.
+
+    Instead of being raised, an instance is placed in each result slot that is not
+    available when the deadline passes, so that all completed results are returned.
+    """
+
+
+class MapCancelledError(RuntimeError):
+    """A map call was stopped because its :class:`~unified_map.policies.CancelToken` was cancelled.
+
+    All worker processes of the map call are terminated before it is raised.
+    """
@@ -0,0 +1,174 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Parameter grids whose combinations are generated inside the workers.
+
+A parameter sweep over the Cartesian product of several axes, e.g. 100 x 100 x 50
+values, has many more combinations than axis values. Instead of a list of all
+combinations from :func:`itertools.product`, a :class:`Grid` holds only the axes and
+can be passed as argument list to any multivariate function. Backends split it into
+ranges of combination indices, and each worker decodes its own range into the tuples
+of values that the function is called with.
+
+Example:
+    >>> import unified_map as umap
+    >>> def volume(width, height, depth=1):
+    ...     return width * height * depth
+    ...
+    >>> grid = umap.grid.Grid([1, 2, 3], [10, 20], depth=[1, 2])
+    >>> results = umap.multivariate.serial.map(volume, grid)
+    >>> results[:6]
+    [10, 20, 20, 40, 20, 40]
+    >>> grid[3]
+    (1, 20, 2)
+"""
+
+from collections.abc import Sequence as _Sequence
+from functools import reduce as _reduce
+from itertools import product as _product
+from operator import mul as _mul
+
+from .columns import _Layout
+
+
+def _product_range(axes, shape, start, stop):
+    """Yield the combinations with indices from start to stop-1 of the product of axes.
+
+    Whole blocks of the first axis are left to itertools.product, and only the partial
+    blocks at both ends are handled recursively for the remaining axes.
+
+    Example:
+        >>> list(_product_range(([0, 1, 2], 'ab'), (3, 2), 1, 5))
+        [(0, 'b'), (1, 'a'), (1, 'b'), (2, 'a')]
+    """
+    if start >= stop:
+        return
+    first_axis, other_axes, other_shape = axes[0], axes[1:], shape[1:]
+    if not other_axes:
+        for value in first_axis[start:stop]:
+            yield (value,)
+        return
+    block_size = _reduce(_mul, other_shape, 1)
+    first, offset = divmod(start, block_size)
+    last, end = divmod(stop, block_size)
+    if first == last:
+        value = first_axis[first]
+        for values in _product_range(other_axes, other_shape, offset, end):
+            yield (value,) + values
+        return
+    if offset:
+        value = first_axis[first]
+        for values in _product_range(other_axes, other_shape, offset, block_size):
+            yield (value,) + values
+        first += 1
+    yield from _product(first_axis[first:last], *other_axes)
+    if end:
+        value = first_axis[last]
+        for values in _product_range(other_axes, other_shape, 0, end):
+            yield (value,) + values
+
+
+class Grid(_Layout):
+    """Arguments of a multivariate function that form the Cartesian product of axes.
+
+    Combinations are ordered like in :func:`itertools.product`, i.e. the last axis
+    varies fastest. Positional axes come first and keyword axes in the order in which
+    they were given. Slicing a grid returns a grid with the same axes and a range of
+    combination indices, and indexing or iterating it decodes combinations on demand.
+
+    Args:
+        *axes: Values of the parameters that are passed as positional arguments. Each
+            axis is an iterable object, which is turned into a list unless it is a
+            sequence like a list, a range or a NumPy array.
+        **keyword_axes: Values of the parameters that are passed as keyword arguments
+
+    Raises:
+        ValueError: If no axis is given.
+
+    Example:
+        >>> grid = Grid(range(100), range(100), range(50))
+        >>> len(grid)
+        500000
+        >>> grid[123456]
+        (24, 69, 6)
+        >>> grid[1000:3000]
+        Grid(shape=(100, 100, 50), keywords=[], indices=range(1000, 3000))
+    """
+
+    def __init__(self, *axes, **keyword_axes):
+        axes = axes + tuple(keyword_axes.values())
+        if not axes:
+            raise ValueError('Grid needs at least one axis.')
+        self.axes = tuple(
+            axis if isinstance(axis, _Sequence) or hasattr(axis, 'shape') else list(axis)
+            for axis in axes)
+        self.names = tuple(keyword_axes)
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self._indices = range(_reduce(_mul, self.shape, 1))
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            part = self.__class__.__new__(self.__class__)
+            part.axes, part.names, part.shape = self.axes, self.names, self.shape
+            part._indices = self._indices[index]
+            return part
+        return self._decode(self._indices[index])
+
+    def __iter__(self):
+        indices = self._indices
+        if indices.step == 1:
+            return _product_range(self.axes, self.shape, indices.start, indices.stop)
+        return map(self._decode, indices)
+
+    def __repr__(self):
+        return '{}(shape={}, keywords={}, indices={})'.format(
+            self.__class__.__name__, self.shape, list(self.names), self._indices)
+
+    def _decode(self, index):
+        """Turn the index of a combination into its tuple of values."""
+        values = []
+        for axis, size in zip(reversed(self.axes), reversed(self.shape)):
+            index, position = divmod(index, size)
+            values.append(axis[position])
+        values.reverse()
+        return tuple(values)
+
+    def _num_values(self):
+        return len(self.axes)
+
+    def reshape(self, results):
+        """Arrange the results of all combinations in an array shaped like the grid.
+
+        Args:
+            results: A list with one result per combination in the order of the grid,
+                as returned by a map function that was applied to the whole grid.
+                Results that are arrays themselves become trailing dimensions.
+
+        Returns:
+            A NumPy array whose first dimensions are the shape of the grid
+
+        Raises:
+            ImportError: If NumPy is not installed.
+            ValueError: If the grid is a slice or the number of results does not match.
+
+        Example:
+            >>> import unified_map as umap
+            >>> def add(x, y):
+            ...     return x + y
+            ...
+            >>> grid = umap.grid.Grid([0, 10], [1, 2, 3])
+            >>> grid.reshape(umap.multivariate.serial.map(add, grid)).tolist()
+            [[1, 2, 3], [11, 12, 13]]
+        """
+        import numpy
+
+        if self._indices != range(_reduce(_mul, self.shape, 1)):
+            raise ValueError('Only the results of a whole grid can be reshaped.')
+        if len(results) != len(self):
+            raise ValueError('Got {} results for a grid of {} combinations.'.format(
+                len(results), len(self)))
+        array = numpy.asarray(results)
+        return array.reshape(self.shape + array.shape[1:])
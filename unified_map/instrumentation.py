@@ -0,0 +1,127 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Instrumentation of parallel and distributed function evaluations."""
+
+
+class Report:
+    """Collect timing information about the evaluations of a map call.
+
+    An instance can be passed as ``report`` argument to a parallel or distributed function,
+    which fills it in place. A report that is passed to several calls describes the
+    most recent one. If results are streamed, the report is complete once all results
+    were consumed.
+
+    Attributes:
+        wall_time: Seconds from start to end of the call, measured in the parent process
+        setup_time: Seconds spent in initializer and warmup, summed over all workers
+        task_time: Seconds spent in evaluating the function, summed over all workers
+        num_items: Number of evaluated arguments
+        num_tasks: Number of tasks (chunks of arguments) that were sent to workers
+        workers: Dictionary that maps each worker id to its own setup_time, task_time,
+            num_items and num_tasks, as well as peak_memory in bytes if the memory of
+            workers was monitored and cache_hits and cache_misses if workers cached
+            results
+        events: Dictionary that counts notable events, e.g. how many speculative
+            duplicates were launched ('speculative_launches') and how many of them
+            finished before the original attempt ('speculative_wins'), how often the
+            evaluation of an argument was retried ('retries'), how many exceptions were
+            placed in the result list ('returned_exceptions'), how often a crashed
+            worker had to be replaced ('worker_crashes', 'worker_replacements'), how
+            many tasks were cancelled after their timeout ('timeouts') and how many
+            arguments were not evaluated before the deadline ('deadline_exceeded'), how
+            many workers were replaced because of their task count or memory usage
+            ('worker_recycles'), how many evaluations of equal arguments were saved
+            by deduplication ('saved_evaluations') and how many results were found in
+            or missing from the caches of workers ('cache_hits', 'cache_misses')
+        production_time: Seconds a background producer spent in producing arguments
+        producer_stall_time: Seconds a background producer waited for free space in its
+            buffer, which means that the workers could not keep up with the input
+        consumer_stall_time: Seconds the parent process waited for arguments from a
+            background producer, which means that the input could not keep up with the
+            workers
+
+    Example:
+        >>> import unified_map as umap
+        >>> def square(x):
+        ...     return x**2
+        ...
+        >>> report = umap.instrumentation.Report()
+        >>> umap.univariate.parallel.multiprocessing(square, [1, 2, 3, 4, 5], report=report)
+        [1, 4, 9, 16, 25]
+        >>> report.num_items
+        5
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.wall_time = 0.0
+        self.setup_time = 0.0
+        self.task_time = 0.0
+        self.num_items = 0
+        self.num_tasks = 0
+        self.workers = {}
+        self.events = {}
+        self.production_time = 0.0
+        self.producer_stall_time = 0.0
+        self.consumer_stall_time = 0.0
+
+    def _record(self, infos, wall_time, events=None):
+        """Aggregate the infos that were returned by workers together with the chunks."""
+        self._reset()
+        for info in infos:
+            self._add(info)
+        self._close(wall_time, events)
+
+    def _add(self, info):
+        """Aggregate the info of a single chunk, e.g. while results are streamed."""
+        for name, count in info.get('events', {}).items():
+            self.events[name] = self.events.get(name, 0) + count
+        worker = self.workers.setdefault(
+            info['worker'], dict(setup_time=0.0, task_time=0.0, num_items=0, num_tasks=0))
+        worker['setup_time'] += info['setup_time']
+        worker['task_time'] += info['task_time']
+        worker['num_items'] += info['num_items']
+        worker['num_tasks'] += 1
+        if 'memory' in info:
+            worker['peak_memory'] = max(worker.get('peak_memory', 0), info['memory'])
+        for name in ('cache_hits', 'cache_misses'):
+            if name in info.get('events', {}):
+                worker[name] = worker.get(name, 0) + info['events'][name]
+        self.setup_time += info['setup_time']
+        self.task_time += info['task_time']
+        self.num_items += info['num_items']
+        self.num_tasks += 1
+
+    def _close(self, wall_time, events=None):
+        """Set the wall time and add the events that were counted in the parent process."""
+        self.wall_time = wall_time
+        for name, count in (events or {}).items():
+            self.events[name] = self.events.get(name, 0) + count
+
+    @property
+    def num_workers(self):
+        """Number of distinct workers that evaluated at least one task."""
+        return len(self.workers)
+
+    @property
+    def cache_hit_rates(self):
+        """Dictionary that maps each worker id to the share of results found in its cache.
+
+        Only workers that looked up at least one result in their cache are included.
+        """
+        hit_rates = {}
+        for worker_id, worker in self.workers.items():
+            num_lookups = worker.get('cache_hits', 0) + worker.get('cache_misses', 0)
+            if num_lookups:
+                hit_rates[worker_id] = worker.get('cache_hits', 0) / num_lookups
+        return hit_rates
+
+    def __repr__(self):
+        return (
+            '{}(wall_time={:.6f}, setup_time={:.6f}, task_time={:.6f}, num_items={}, '
+            'num_tasks={}, num_workers={})'.format(
+                self.__class__.__name__, self.wall_time, self.setup_time, self.task_time,
+                self.num_items, self.num_tasks, self.num_workers))
@@ -0,0 +1,993 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""A reusable mapper that holds the configuration and the resources of a backend."""
+
+import functools as _functools
+import threading as _threading
+from collections import namedtuple as _namedtuple
+from concurrent.futures import Future as _Future
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from itertools import starmap as _starmap
+from multiprocessing import cpu_count as _cpu_count
+
+from . import _engine
+from . import cluster_setup as _cluster_setup
+from . import columns as _columns
+from . import remote as _remote
+from ._scheduling import _check_cancelled
+from .policies import CancelToken as _CancelToken
+from .policies import _normalize_error_policy
+
+_DETECTED_NUM_CORES = _cpu_count()
+
+_PARALLEL_RUNNERS = {
+    'parallel.dask': _engine.run_dask,
+    'parallel.futures': _engine.run_futures,
+    'parallel.joblib': _engine.run_joblib,
+    'parallel.multiprocessing': _engine.run_multiprocessing,
+}
+
+_DISTRIBUTED_RUNNERS = {
+    'distributed.dask': _engine.run_distributed_dask,
+    'distributed.spark': _engine.run_spark,
+}
+
+_BACKENDS = ('serial',) + tuple(_PARALLEL_RUNNERS) + tuple(_DISTRIBUTED_RUNNERS)
+
+# Backends whose worker processes can evaluate single function calls submitted by a mapper
+_SUBMITTING_BACKENDS = ('parallel.futures', 'parallel.multiprocessing')
+
+# Backends that can stream results in the order in which they are finished
+_UNORDERED_BACKENDS = ('parallel.futures', 'parallel.multiprocessing', 'distributed.dask')
+
+Match = _namedtuple('Match', ['index', 'argument', 'result'])
+Match.__doc__ = """The first argument whose result satisfies the predicate of a search.
+
+Attributes:
+    index: Position of the argument in the argument list
+    argument: The argument, or tuple of arguments of a multivariate function
+    result: The result of the function for this argument
+"""
+
+
+def _connection(backend):
+    """Get the cluster connection of a distributed backend.
+
+    Raises:
+        ConnectionError: If no connection to a scheduler was established.
+    """
+    if backend == 'distributed.dask':
+        connection = _cluster_setup.dask._connection
+        error_message = (
+            'No connection was established to a Dask scheduler that distributes jobs to workers. '
+            "Please use unified_map.cluster_setup.dask and/or Dask's command line "
+            'interface for\n'
+            '  1. Starting a scheduler\n'
+            '  2. Starting several workers\n'
+            '  3. Connecting to the scheduler')
+    else:
+        connection = _cluster_setup.spark._connection
+        error_message = (
+            'No connection ("context") was established to a Spark scheduler ("master") that '
+            'distributes jobs to workers ("slaves"). '
+            "Please use unified_map.cluster_setup.spark and/or Apache Spark's command line "
+            'interface for\n'
+            '  1. Starting a scheduler\n'
+            '  2. Starting several workers\n'
+            '  3. Connecting to the scheduler')
+    if connection is None:
+        raise ConnectionError(error_message)
+    return connection
+
+
+def _check_options(options):
+    """Reject options that a mapper sets itself.
+
+    Raises:
+        ValueError: If such an option is found.
+    """
+    for name in ('stream', 'unpack', 'num_cores', 'connection', 'session'):
+        if name in options:
+            raise ValueError(
+                '{} can not be passed as an option of a mapper, use imap() or istarmap() '
+                'for streaming and num_workers for the number of workers.'.format(name))
+
+
+def _single_result(envelope_future):
+    """Create a future for the only result in the envelope of another future."""
+    future = _Future()
+    future.set_running_or_notify_cancel()
+
+    def transfer(done_future):
+        exception = done_future.exception()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            results, _ = done_future.result()
+            future.set_result(results[0])
+
+    envelope_future.add_done_callback(transfer)
+    return future
+
+
+def _check_aggregating_options(options, kind):
+    """Reject options that would put error objects instead of results into an aggregation.
+
+    Deduplication, affinity keys, result dtypes and sinks are rejected as well, because an
+    aggregation does not evaluate single arguments but whole chunks or indexed arguments.
+
+    Raises:
+        ValueError: If such an option is found.
+    """
+    for name in ('timeout', 'deadline', 'cost', 'dedupe', 'affinity_key', 'result_dtype',
+                 'sink'):
+        value = options.get(name)
+        if value is not None and value is not False:
+            raise ValueError('{} can not be used in a {} call.'.format(name, kind))
+    error_policy = _normalize_error_policy(options.get('error_policy', 'raise'))
+    if error_policy != 'raise' and error_policy.then != 'raise':
+        raise ValueError('A {} call can not return exceptions instead of results.'.format(kind))
+
+
+class _ChunkReducer:
+    """Picklable callable that reduces the results of a chunk of arguments in a worker."""
+
+    def __init__(self, function, reducer, unpack):
+        self.function = function
+        self.reducer = reducer
+        self.unpack = unpack
+
+    def __call__(self, chunk):
+        if self.unpack:
+            results = _starmap(self.function, chunk)
+        else:
+            results = map(self.function, chunk)
+        return _functools.reduce(self.reducer, results)
+
+
+class _PartialReducer:
+    """Picklable callable that reduces a chunk of partial values in a worker."""
+
+    def __init__(self, reducer):
+        self.reducer = reducer
+
+    def __call__(self, chunk):
+        return _functools.reduce(self.reducer, chunk)
+
+
+class _Search:
+    """Picklable callable that evaluates a function on an indexed argument in a worker.
+
+    Only a match is sent back with its index, argument and result, all other arguments
+    lead to None.
+    """
+
+    def __init__(self, function, predicate, unpack, negate=False):
+        self.function = function
+        self.predicate = predicate
+        self.unpack = unpack
+        self.negate = negate
+
+    def __call__(self, indexed_argument):
+        index, argument = indexed_argument
+        if self.unpack:
+            result = self.function(*argument)
+        else:
+            result = self.function(argument)
+        if self.predicate is None:
+            matched = bool(result)
+        else:
+            matched = bool(self.predicate(result))
+        if matched != self.negate:
+            return index, argument, result
+        return None
+
+
+def _check_each(iterator, cancel_token):
+    """Yield from an iterator and check a cancel token before each item."""
+    for item in iterator:
+        _check_cancelled(cancel_token)
+        yield item
+
+
+class MapHandle:
+    """Handle of a map call that runs in the background.
+
+    It is returned by :meth:`Mapper.submit_map` and :meth:`Mapper.submit_starmap`. The
+    results of the map call are collected by a background thread in input order, so
+    that the caller can do other work, e.g. preparing the next batch of arguments,
+    while the workers are busy.
+    """
+
+    def __init__(self, create_iterator, cancel_token):
+        self._cancel_token = cancel_token
+        self._results = []
+        self._exception = None
+        self._finished = _threading.Event()
+        self._thread = _threading.Thread(target=self._collect, args=(create_iterator,),
+                                         daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        if not self.done():
+            state = 'running'
+        elif self._exception is not None:
+            state = 'failed'
+        else:
+            state = 'finished'
+        return '<{} {} with {} results>'.format(
+            self.__class__.__name__, state, len(self._results))
+
+    def _collect(self, create_iterator):
+        try:
+            for result in create_iterator():
+                self._results.append(result)
+        except BaseException as exception:
+            self._exception = exception
+        finally:
+            self._finished.set()
+
+    def done(self):
+        """Check whether the map call finished, failed or was cancelled.
+
+        Returns:
+            True if no further results will be added
+        """
+        return self._finished.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the map call to finish and get all of its results.
+
+        Args:
+            timeout (optional): Maximum number of seconds to wait. The default is to wait
+                as long as it takes.
+
+        Returns:
+            List of output results
+
+        Raises:
+            TimeoutError: If the map call did not finish within the timeout.
+            MapCancelledError: If the map call was cancelled.
+            Exception: Any exception that stopped the map call, e.g. one raised by the
+                function with the default error policy.
+        """
+        if not self._finished.wait(timeout):
+            raise TimeoutError(
+                'The map call did not finish within {} seconds.'.format(timeout))
+        if self._exception is not None:
+            raise self._exception
+        return list(self._results)
+
+    def partial_results(self):
+        """Get the results that are available so far without waiting.
+
+        Returns:
+            List of output results for a prefix of the arguments, which is the complete
+            list once the map call finished
+        """
+        return list(self._results)
+
+    def cancel(self):
+        """Stop the map call, which terminates its worker processes.
+
+        Results that were collected before remain available via
+        :meth:`partial_results`, while :meth:`result` raises a
+        :class:`~unified_map.exceptions.MapCancelledError`.
+
+        Returns:
+            True if the map call was still running, False if it was already done
+        """
+        if self.done():
+            return False
+        self._cancel_token.cancel()
+        return True
+
+
+class Mapper:
+    """Apply functions to lists of arguments with a backend that is configured once.
+
+    A mapper holds a backend, its number of workers and further options of the
+    corresponding map function, e.g. an error policy or a cost estimate, so that many map
+    calls share one configuration. Used as a context manager, it also keeps worker
+    processes alive between map calls, so that process start-up as well as initializer
+    and warmup in each worker are only paid once. Outside of a with statement, each map
+    call starts and stops its own worker processes like the map functions do.
+
+    Args:
+        backend (optional): Name of the backend, which is 'serial', 'parallel.dask',
+            'parallel.futures', 'parallel.joblib', 'parallel.multiprocessing',
+            'distributed.dask' or 'distributed.spark'.
+        num_workers (optional): Number of worker processes of a parallel backend. The
+            default is the number of detected cores. Serial and distributed backends do
+            not accept it, because they run in this process or on the workers of a cluster.
+        report (optional): A :class:`~unified_map.instrumentation.Report` object that is
+            filled by each map call with timing information, which lists setup time
+            (initializer and warmup) separately from task time.
+        **options: Further keyword arguments of the map functions of the backend, which
+            are described below. They apply to all map calls and can be overridden by
+            keyword arguments of a single call.
+
+    Keyword Args:
+        initializer: A callable object that is called once in each worker before it
+            evaluates the function for the first time, e.g. to load a model or to open a
+            database connection. It can store objects in :data:`unified_map.worker.state`
+            to make them reachable from the function.
+        initargs: A tuple of arguments that is passed to the initializer.
+        warmup: A callable object without arguments that is called once in each worker
+            after the initializer, e.g. to trigger compilation or to fill caches.
+        speculation: A :class:`~unified_map.policies.Speculation` object that enables
+            speculative re-execution of stragglers. Once most tasks are done, a task that
+            runs much longer than the median is duplicated on an idle worker and the result
+            of whichever attempt finishes first is used. Accepted by 'parallel.futures' and
+            'distributed.dask'.
+        error_policy: What happens if the function raises an exception. 'raise' (default)
+            raises it and discards all results, 'return_exceptions' places the exception
+            object in the result list instead of a result, and a
+            :class:`~unified_map.policies.Retry` object retries the evaluation with
+            exponential backoff. If a worker process of 'parallel.futures' or
+            'parallel.multiprocessing' crashes, the affected arguments are evaluated again
+            on a fresh worker unless the policy is 'raise', in which case a
+            :class:`~unified_map.exceptions.WorkerCrashError` is raised. Tasks of crashed
+            workers are rescheduled by the Dask scheduler as often as the policy allows,
+            and retried by Spark itself according to its spark.task.maxFailures setting.
+        timeout: Seconds after which a running task is cancelled. Its result slots get a
+            :class:`~unified_map.exceptions.TaskTimeoutError` instead of a result. Worker
+            processes of a parallel backend that run it are replaced, and with Spark a task
+            evaluates a whole partition. Accepted by 'parallel.futures',
+            'parallel.multiprocessing' and the distributed backends.
+        deadline: Seconds after which the whole map call stops. All results that are not
+            available by then are replaced with a
+            :class:`~unified_map.exceptions.DeadlineExceededError`. Accepted by the same
+            backends as timeout.
+        cost: Estimated cost of each argument, either as a callable that is applied to an
+            argument, unpacked like for the function with starmap, or as a list with one
+            number per argument. Expensive arguments are dispatched first and work is handed
+            out in chunks of decreasing size. Results are still in input order. Accepted by
+            the same backends as timeout.
+        max_tasks_per_worker: Number of tasks after which a worker process is replaced by a
+            fresh one, e.g. to release memory that leaks in C extensions. No queued work is
+            lost. Since an executor of 'parallel.futures' cannot retire single workers, all
+            of them are replaced together once the running tasks are finished. Accepted by
+            'parallel.futures' and 'parallel.multiprocessing'.
+        max_worker_memory: Resident set size in bytes above which worker processes are
+            replaced by fresh ones. Since neither an executor nor a pool can retire single
+            workers, all of them are replaced together once the running tasks are finished.
+            Accepted by 'parallel.futures' and 'parallel.multiprocessing'.
+        memory_per_task: Estimated peak memory in bytes that is needed to evaluate one
+            argument. A parallel backend uses fewer worker processes if the memory budget
+            does not suffice for all of them, and 'distributed.dask' only submits tasks
+            while the memory budget allows it. Not accepted by 'distributed.spark'.
+        max_inflight_bytes: Memory budget in bytes for all tasks in flight. If only
+            memory_per_task is given, a parallel backend uses the memory that is available
+            on this machine, respecting the limits of containers, and 'distributed.dask'
+            the memory that is still available on all workers of the cluster. Not accepted
+            by 'distributed.spark'.
+        prefetch: When streaming, the maximum number of arguments that are pulled ahead of
+            the oldest result that was not returned yet, or with 'parallel.dask',
+            'parallel.joblib' and 'distributed.spark' the number of arguments that are
+            evaluated together in one batch. The default is four per core, of the cluster
+            for distributed backends.
+        producer: A :class:`~unified_map.policies.Producer` object, 'thread' or 'process'.
+            The argument iterable is then consumed in the background with a bounded buffer,
+            which overlaps expensive input production with the evaluation of the function.
+            Accepted by the parallel backends.
+        cancel_token: A :class:`~unified_map.policies.CancelToken` object. Once it is
+            cancelled, no further arguments are dispatched and a
+            :class:`~unified_map.exceptions.MapCancelledError` is raised. The worker
+            processes of 'parallel.futures' and 'parallel.multiprocessing' are terminated
+            and the futures in flight of 'distributed.dask' are cancelled. The other
+            backends only return results as a whole, so they check it between batches of
+            prefetch arguments and do not start a further batch.
+        dedupe: If True, equal arguments of equal types are evaluated only once and their
+            result is placed at every position where they occur. The number of saved
+            evaluations is counted in the report. All arguments are collected up front,
+            therefore it can not be combined with stream. Unhashable arguments are compared
+            by their pickled bytes.
+        affinity_key: A callable that returns a key for an argument, unpacked like for the
+            function with starmap. Arguments are assigned to worker processes by consistent
+            hashing of their keys, so that arguments with equal keys are evaluated by the
+            same worker, whose in-process caches, e.g. of functools.lru_cache, then stay
+            warm. Keys need to be picklable. Accepted by 'parallel.futures',
+            'parallel.multiprocessing' and 'distributed.dask'.
+        inherit_arguments: If True, the worker processes are forked after the function and
+            the argument list were stored in the parent process, so that they inherit both
+            via copy-on-write memory. Tasks then only carry index ranges, which means that
+            the input arguments are never pickled and only the results are sent back.
+            Requires the "fork" start method, which is not available on Windows. Accepted
+            by 'parallel.multiprocessing'.
+        worker_cache_size: Number of results that each worker process keeps in a
+            least-recently-used cache, keyed by function and argument, including the types
+            of all values in it. Hashable arguments whose result is in the cache are not
+            evaluated again, also in later calls of a mapper whose workers stay alive. The
+            hit rate of each worker is available in the report.
+        serializer: How tasks, arguments and results are serialized before they are sent
+            to and from workers, either 'pickle' for pickle protocol 5 with out-of-band
+            buffers, 'cloudpickle' to pickle functions by value, e.g. lambdas, or a
+            :class:`~unified_map.policies.Serializer` object, which can also compress large
+            payloads. The default leaves serialization to the backend.
+        result_dtype: A NumPy dtype or its name, e.g. 'float64' or 'int32', for a function
+            that returns numbers. Each worker then packs the results of a chunk into one
+            contiguous buffer, which is sent instead of one object per result, and a NumPy
+            array is returned instead of a list. It can not be combined with streaming,
+            timeout, deadline or an error policy that returns exceptions.
+        sink: A :class:`~unified_map.sinks.Sink` object. Each worker then writes the results
+            of its chunks to shard files of its own instead of sending them back, and a
+            :class:`~unified_map.sinks.Manifest` with the paths and index ranges of all
+            shards is returned. It can not be combined with streaming, dedupe, cost,
+            affinity_key, result_dtype, timeout, deadline or an error policy that returns
+            exceptions.
+
+    Raises:
+        ValueError: If the backend is unknown or an argument does not fit it.
+
+    Example:
+        >>> import unified_map as umap
+        >>> def square(x):
+        ...     return x**2
+        ...
+        >>> def add(x, y):
+        ...     return x + y
+        ...
+        >>> with umap.mapper.Mapper('parallel.futures', num_workers=2) as mapper:
+        ...     mapper.map(square, [1, 2, 3])
+        ...     mapper.starmap(add, [(1, 2), (3, 4)])
+        ...     mapper.submit(add, 5, 6).result()
+        [1, 4, 9]
+        [3, 7]
+        11
+    """
+
+    def __init__(self, backend='serial', num_workers=None, report=None, **options):
+        if backend not in _BACKENDS:
+            raise ValueError('backend needs to be one of {}, got {!r}'.format(
+                ', '.join(repr(name) for name in _BACKENDS), backend))
+        if backend in _PARALLEL_RUNNERS:
+            if num_workers is None:
+                num_workers = _DETECTED_NUM_CORES
+            if num_workers < 1:
+                raise ValueError(
+                    'num_workers needs to be positive, got {}'.format(num_workers))
+        elif num_workers is not None:
+            raise ValueError('The {} backend does not accept num_workers.'.format(backend))
+        if backend == 'serial' and (options or report is not None):
+            raise ValueError('The serial backend does not accept options or a report.')
+        _check_options(options)
+        self.backend = backend
+        self.num_workers = num_workers
+        self.report = report
+        self.options = options
+        self._session = None
+        self._lock = _threading.Lock()
+        self._submit_adapter = None
+        self._submit_threads = None
+        self._handles = []
+
+    def __enter__(self):
+        if self._session is None:
+            self._session = _engine._Session()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '{}({!r}, num_workers={})'.format(
+            self.__class__.__name__, self.backend, self.num_workers)
+
+    def close(self):
+        """Shut down the worker processes that were kept alive between map calls.
+
+        Map calls that were submitted with :meth:`submit_map` or :meth:`submit_starmap`
+        are waited for first.
+        """
+        with self._lock:
+            handles, self._handles = self._handles, []
+        for handle in handles:
+            handle._finished.wait()
+        with self._lock:
+            submit_adapter, self._submit_adapter = self._submit_adapter, None
+            submit_threads, self._submit_threads = self._submit_threads, None
+            session, self._session = self._session, None
+        if submit_threads is not None:
+            submit_threads.shutdown(wait=True)
+        if submit_adapter is not None:
+            submit_adapter.shutdown(abandoned=False)
+        if session is not None:
+            session.close()
+
+    def map(self, function, argument_list, **options):
+        """Apply a univariate function to a list of arguments.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            List of output results
+        """
+        return self._run(function, argument_list, False, False, options)
+
+    def starmap(self, function, argument_list, **options):
+        """Apply a multivariate function to a list of argument tuples.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            List of output results
+        """
+        return self._run(function, argument_list, True, False, options)
+
+    def imap(self, function, argument_list, **options):
+        """Apply a univariate function lazily to an iterable of arguments.
+
+        Arguments are pulled from the iterable only shortly before they are needed, as in
+        the stream mode of the map functions.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            Iterator over the output results
+        """
+        return self._run(function, argument_list, False, True, options)
+
+    def istarmap(self, function, argument_list, **options):
+        """Apply a multivariate function lazily to an iterable of argument tuples.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            Iterator over the output results
+        """
+        return self._run(function, argument_list, True, True, options)
+
+    def submit(self, function, *args):
+        """Evaluate a single function call asynchronously.
+
+        Within a with statement, the futures and multiprocessing backends send the call to
+        a worker process that stays alive for further calls. If a worker process crashes,
+        the futures of all pending calls fail with a
+        :class:`~unified_map.exceptions.WorkerCrashError` and later calls run on fresh
+        workers. Other backends evaluate the call as a map call with a single argument tuple
+        in a background thread, and the serial backend evaluates it immediately.
+
+        Args:
+            function: A callable object
+            *args: Arguments that are passed to the function
+
+        Returns:
+            A :class:`concurrent.futures.Future` object that holds the result
+        """
+        if self.backend == 'serial':
+            future = _Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args))
+            except Exception as exception:
+                future.set_exception(exception)
+            return future
+        with self._lock:
+            if self._session is not None and self.backend in _SUBMITTING_BACKENDS:
+                if self._submit_adapter is None:
+                    self._submit_adapter = self._create_submit_adapter()
+                task = _engine._create_task(
+                    function, True, self.options.get('initializer'),
+                    self.options.get('initargs', ()), self.options.get('warmup'),
+                    _normalize_error_policy(self.options.get('error_policy', 'raise')),
+                    session=self._session, serializer=self.options.get('serializer'))
+                chunk = _engine._serialization._pack_chunks(task, [[args]])[0]
+                return _single_result(self._submit_adapter.submit_task(task, chunk))
+            if self._submit_threads is None:
+                self._submit_threads = _ThreadPoolExecutor(max_workers=self.num_workers or 1)
+            return self._submit_threads.submit(self._submit_as_map, function, args)
+
+    def submit_map(self, function, argument_list, **options):
+        """Apply a univariate function to a list of arguments in the background.
+
+        Arguments are pulled from the iterable as in :meth:`imap`, so that results
+        become available in input order while the map call is running.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            A :class:`MapHandle` object
+
+        Example:
+            >>> import time
+            >>> import unified_map as umap
+            >>> with umap.mapper.Mapper('parallel.futures', num_workers=2) as mapper:
+            ...     handle = mapper.submit_map(time.sleep, [0.1, 0.1, 0.1])
+            ...     handle.done()
+            ...     handle.result(timeout=10)
+            False
+            [None, None, None]
+        """
+        return self._submit(function, argument_list, False, options)
+
+    def submit_starmap(self, function, argument_list, **options):
+        """Apply a multivariate function to a list of argument tuples in the background.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            A :class:`MapHandle` object
+        """
+        return self._submit(function, argument_list, True, options)
+
+    def _submit(self, function, argument_list, unpack, options):
+        cancel_token = options.pop('cancel_token', None) or self.options.get('cancel_token')
+        if cancel_token is None:
+            cancel_token = _CancelToken()
+        if self.backend == 'serial':
+            if options:
+                raise ValueError('The serial backend does not accept options.')
+
+            def create_iterator():
+                results = self._run(function, argument_list, unpack, True, {})
+                return _check_each(results, cancel_token)
+        else:
+            _check_options(options)
+            options['cancel_token'] = cancel_token
+
+            def create_iterator():
+                return self._run(function, argument_list, unpack, True, options)
+        handle = MapHandle(create_iterator, cancel_token)
+        with self._lock:
+            self._handles = [other for other in self._handles if not other.done()]
+            self._handles.append(handle)
+        return handle
+
+    def map_remote(self, function, argument_list):
+        """Apply a univariate function on a cluster and keep the results there.
+
+        Only the worker setup of the mapper, i.e. initializer, initargs and warmup,
+        applies to the function and to all follow-up steps.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+
+        Returns:
+            A :class:`~unified_map.remote.RemoteResults` object
+
+        Raises:
+            ValueError: If the backend of the mapper is not a distributed one.
+        """
+        return self._run_remote(_remote._MAP, function, argument_list)
+
+    def starmap_remote(self, function, argument_list):
+        """Apply a multivariate function on a cluster and keep the results there.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+
+        Returns:
+            A :class:`~unified_map.remote.RemoteResults` object
+
+        Raises:
+            ValueError: If the backend of the mapper is not a distributed one.
+        """
+        return self._run_remote(_remote._STARMAP, function, argument_list)
+
+    def _run_remote(self, kind, function, argument_list):
+        if self.backend not in _DISTRIBUTED_RUNNERS:
+            raise ValueError(
+                'Results can only be kept remote with a distributed backend, '
+                'not with {}.'.format(self.backend))
+        connection = _connection(self.backend)
+        setup_options = (self.options.get('initializer'), self.options.get('initargs', ()),
+                         self.options.get('warmup'))
+        if self._session is None:
+            setup = _engine._Setup(*setup_options)
+        else:
+            setup = self._session.setup(*setup_options)
+        if kind == _remote._STARMAP:
+            function, argument_list = _columns._prepare(function, argument_list)
+        return _remote._create(self.backend, connection, kind, function, argument_list, setup)
+
+    def map_reduce(self, function, reducer, argument_list, initial=_remote._NO_INITIAL,
+                   chunk_size=None, **options):
+        """Apply a univariate function to a list of arguments and reduce the results.
+
+        Arguments are grouped into chunks, and each worker reduces the results of a chunk
+        before it sends back a single partial value. The partial values are then reduced
+        as a tree: if there are more of them than the backend has workers, the workers
+        reduce one group of consecutive partial values each, and this process only
+        combines the remaining values. Everything is reduced in input order, and only a
+        handful of values travel back instead of one result per argument.
+
+        Args:
+            function: A callable object that accepts one argument
+            reducer: A callable object that accepts two values and returns one. It needs
+                to be associative, because results are reduced in chunks.
+            argument_list: An iterable object of input arguments
+            initial (optional): A value that is placed before all results, and that is
+                returned if there are no arguments, like in :func:`functools.reduce`.
+            chunk_size (optional): Number of arguments whose results are reduced by one
+                task. If it is given, chunks are pulled lazily from argument_list as in
+                :meth:`imap`. The default splits the arguments into four chunks per worker.
+            **options: Keyword arguments that override options of the mapper for this call.
+                Options that replace results by exceptions, i.e. timeout, deadline and
+                error policies that return exceptions, as well as cost are not accepted.
+
+        Returns:
+            The reduced value
+
+        Raises:
+            TypeError: If there are no arguments and no initial value.
+            ValueError: If an option does not fit a reduction.
+
+        Example:
+            >>> import operator
+            >>> import unified_map as umap
+            >>> mapper = umap.mapper.Mapper('parallel.multiprocessing', num_workers=2)
+            >>> mapper.map_reduce(abs, operator.add, [-1, 2, -3, 4])
+            10
+        """
+        return self._map_reduce(function, reducer, argument_list, initial, chunk_size, False,
+                                options)
+
+    def starmap_reduce(self, function, reducer, argument_list, initial=_remote._NO_INITIAL,
+                       chunk_size=None, **options):
+        """Apply a multivariate function to a list of argument tuples and reduce the results.
+
+        Results are reduced in chunks by the workers and the partial values as a tree, as
+        described in :meth:`map_reduce`.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            reducer: A callable object that accepts two values and returns one. It needs
+                to be associative, because results are reduced in chunks.
+            argument_list: An iterable object of input argument tuples
+            initial (optional): A value that is placed before all results, and that is
+                returned if there are no arguments.
+            chunk_size (optional): Number of arguments whose results are reduced by one
+                task. The default splits the arguments into four chunks per worker.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            The reduced value
+
+        Raises:
+            TypeError: If there are no arguments and no initial value.
+            ValueError: If an option does not fit a reduction.
+        """
+        return self._map_reduce(function, reducer, argument_list, initial, chunk_size, True,
+                                options)
+
+    def _map_reduce(self, function, reducer, argument_list, initial, chunk_size, unpack,
+                    options):
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk_size needs to be positive, got {}'.format(chunk_size))
+        if self.backend == 'serial':
+            results = self._run(function, argument_list, unpack, True, options)
+            reduced = _remote._reduce_chunk(reducer, results)
+            return _remote._finish_reduction(reducer, reduced, initial)
+        _check_aggregating_options(dict(self.options, **options), 'map-reduce')
+        if unpack:
+            function, argument_list = _columns._prepare(function, argument_list)
+        task = _ChunkReducer(function, reducer, unpack)
+        if chunk_size is None:
+            argument_list = _engine._as_list(argument_list)
+            chunk_size = _engine._pool_chunk_size(len(argument_list), self._num_slots())
+            chunks = _engine._split_into_chunks(argument_list, chunk_size)
+            partial_values = self._run(task, chunks, False, False, options)
+        else:
+            chunks = _engine._iter_chunks(argument_list, chunk_size)
+            partial_values = list(self._run(task, chunks, False, True, options))
+        num_slots = self._num_slots()
+        if len(partial_values) > max(num_slots, 2):
+            # A round of worker tasks leaves at most one partial value per worker
+            group_size = -(-len(partial_values) // num_slots)
+            groups = _engine._split_into_chunks(partial_values, group_size)
+            partial_values = self._run(_PartialReducer(reducer), groups, False, False,
+                                       dict(options, report=None))
+        reduced = _remote._reduce_chunk(reducer, partial_values)
+        return _remote._finish_reduction(reducer, reduced, initial)
+
+    def find_first(self, function, argument_list, predicate=None, ordered=True, **options):
+        """Find an argument whose result satisfies a predicate and stop all other work.
+
+        Arguments are pulled from the iterable as in :meth:`imap`. The predicate is
+        evaluated in the workers, so that only a match is sent back. As soon as the answer
+        is known, no further arguments are dispatched and the worker processes, which
+        may still evaluate other arguments, are terminated.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            predicate (optional): A callable object that accepts a result and returns
+                whether it is a match. The default checks if the result is true.
+            ordered (optional): If True, the match with the lowest index is returned,
+                which means waiting for all arguments before it. If False, whichever match
+                is found first is returned. The futures, multiprocessing and distributed
+                Dask backends then process results in the order in which they are
+                finished, the other backends always in input order.
+            **options: Keyword arguments that override options of the mapper for this call.
+                Options that replace results by exceptions, i.e. timeout, deadline and
+                error policies that return exceptions, as well as cost are not accepted.
+
+        Returns:
+            A :class:`Match` with index, argument and result, or None if no result
+            satisfies the predicate
+
+        Raises:
+            ValueError: If an option does not fit a search.
+
+        Example:
+            >>> import unified_map as umap
+            >>> mapper = umap.mapper.Mapper('parallel.multiprocessing', num_workers=2)
+            >>> mapper.find_first(abs, [0, 0, -3, 4, 0])
+            Match(index=2, argument=-3, result=3)
+        """
+        return self._search(function, argument_list, predicate, False, ordered, False, options)
+
+    def starfind_first(self, function, argument_list, predicate=None, ordered=True,
+                       **options):
+        """Find a tuple of arguments whose result satisfies a predicate, see :meth:`find_first`.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            predicate (optional): A callable object that accepts a result and returns
+                whether it is a match. The default checks if the result is true.
+            ordered (optional): If True, the match with the lowest index is returned,
+                otherwise whichever match is found first.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            A :class:`Match` with index, argument tuple and result, or None if no result
+            satisfies the predicate
+        """
+        return self._search(function, argument_list, predicate, False, ordered, True, options)
+
+    def any_map(self, function, argument_list, predicate=None, **options):
+        """Check whether any result satisfies a predicate, stopping at the first one.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            predicate (optional): A callable object that accepts a result and returns a
+                truth value. The default uses the result itself.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            True if a result satisfies the predicate, otherwise False
+        """
+        match = self._search(function, argument_list, predicate, False, False, False, options)
+        return match is not None
+
+    def any_starmap(self, function, argument_list, predicate=None, **options):
+        """Check whether any result of a multivariate function satisfies a predicate.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            predicate (optional): A callable object that accepts a result and returns a
+                truth value. The default uses the result itself.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            True if a result satisfies the predicate, otherwise False
+        """
+        match = self._search(function, argument_list, predicate, False, False, True, options)
+        return match is not None
+
+    def all_map(self, function, argument_list, predicate=None, **options):
+        """Check whether all results satisfy a predicate, stopping at the first that fails.
+
+        Args:
+            function: A callable object that accepts one argument
+            argument_list: An iterable object of input arguments
+            predicate (optional): A callable object that accepts a result and returns a
+                truth value. The default uses the result itself.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            True if all results satisfy the predicate, which includes an empty argument
+            list, otherwise False
+        """
+        match = self._search(function, argument_list, predicate, True, False, False, options)
+        return match is None
+
+    def all_starmap(self, function, argument_list, predicate=None, **options):
+        """Check whether all results of a multivariate function satisfy a predicate.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+            argument_list: An iterable object of input argument tuples
+            predicate (optional): A callable object that accepts a result and returns a
+                truth value. The default uses the result itself.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            True if all results satisfy the predicate, otherwise False
+        """
+        match = self._search(function, argument_list, predicate, True, False, True, options)
+        return match is None
+
+    def _search(self, function, argument_list, predicate, negate, ordered, unpack, options):
+        if self.backend != 'serial':
+            _check_aggregating_options(dict(self.options, **options), 'search')
+        if unpack:
+            function, argument_list = _columns._prepare(function, argument_list)
+        task = _Search(function, predicate, unpack, negate)
+        matches = self._run(task, enumerate(argument_list), False, True, options, ordered)
+        try:
+            for match in matches:
+                if match is not None:
+                    return Match(*match)
+            return None
+        finally:
+            # Closing a stream early terminates the worker processes that are still busy
+            if hasattr(matches, 'close'):
+                matches.close()
+
+    def _num_slots(self):
+        """Number of tasks that the backend can evaluate at the same time."""
+        if self.backend in _PARALLEL_RUNNERS:
+            return self.num_workers
+        connection = _connection(self.backend)
+        if self.backend == 'distributed.dask':
+            return sum(connection.ncores().values())
+        return connection.defaultParallelism
+
+    def _create_submit_adapter(self):
+        scheduling = _engine._scheduling
+        if self.backend == 'parallel.futures':
+            adapter = scheduling._FuturesAdapter(None, self.num_workers)
+        else:
+            adapter = scheduling._PoolAdapter(None, self.num_workers)
+        return scheduling._Submitter(adapter)
+
+    def _submit_as_map(self, function, args):
+        return self._run(function, [args], True, False, dict(report=None))[0]
+
+    def _run(self, function, argument_list, unpack, stream, options, ordered=True):
+        if unpack:
+            function, argument_list = _columns._prepare(function, argument_list)
+            if isinstance(argument_list, _columns._Layout):
+                # Callables that are applied to unpacked arguments receive keywords as well
+                for name in ('cost', 'affinity_key'):
+                    value = options.get(name, self.options.get(name))
+                    if callable(value):
+                        options = dict(options, **{name: argument_list._bind(value)})
+        if self.backend == 'serial':
+            if options:
+                raise ValueError('The serial backend does not accept options.')
+            if unpack:
+                iterator = _starmap(function, argument_list)
+            else:
+                iterator = map(function, argument_list)
+            return iterator if stream else list(iterator)
+        _check_options(options)
+        options = dict(self.options, **options)
+        options.setdefault('report', self.report)
+        if stream:
+            options['stream'] = True
+            if not ordered and self.backend in _UNORDERED_BACKENDS:
+                options['ordered'] = False
+        if self.backend in _PARALLEL_RUNNERS:
+            run = _PARALLEL_RUNNERS[self.backend]
+            return run(function, argument_list, unpack=unpack, num_cores=self.num_workers,
+                       session=self._session, **options)
+        run = _DISTRIBUTED_RUNNERS[self.backend]
+        return run(function, argument_list, unpack=unpack,
+                   connection=_connection(self.backend), session=self._session, **options)
@@ -1,9 +1,34 @@
 # Copyright 2018 Robert Haas
 # For license information, see LICENSE.TXT in the package root directory
 
+from itertools import chain as _chain
+from itertools import tee as _tee
+from operator import itemgetter as _itemgetter
+
+from .. import columns as _columns
+
 _map_alias = map
 
 
+def _transpose_lazily(argument_list):
+    """Split an iterable of argument collections into one lazy iterator per position.
+
+    In contrast to zip(*argument_list), no argument is pulled before it is needed. Since
+    map() advances all iterators in lockstep, tee() only buffers a single element.
+
+    Example:
+        >>> [list(column) for column in _transpose_lazily([(1, 2), (3, 4), (5, 6)])]
+        [[1, 3, 5], [2, 4, 6]]
+    """
+    iterator = iter(argument_list)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return []
+    copies = _tee(_chain([first], iterator), len(first))
+    return [_map_alias(_itemgetter(position), copy) for position, copy in enumerate(copies)]
+
+
 def for_loop(function, argument_list):
     """Apply a multivariate function to a list of arguments in a serial fashion.
 
@@ -11,7 +36,8 @@ def for_loop(function, argument_list):
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
 
     Returns:
         List of output results
@@ -27,23 +53,27 @@ def for_loop(function, argument_list):
         - https://docs.python.org/3/reference/compound_stmts.html#the-for-statement
         - https://docs.python.org/3/tutorial/controlflow.html#for-statements
     """
+    function, argument_list = _columns._prepare(function, argument_list)
     result_list = []
     for args in argument_list:
         result_list.append(function(*args))
     return result_list
 
 
-def generator_expression(function, argument_list):
+def generator_expression(function, argument_list, stream=False):
     """Apply a multivariate function to a list of arguments in a serial fashion.
 
     Uses Python's built-in generator expressions.
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
+        stream (optional): If True, the generator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def add(x, y, z):
@@ -55,22 +85,28 @@ def generator_expression(function, argument_list):
     References:
         - https://www.python.org/dev/peps/pep-0289
     """
+    function, argument_list = _columns._prepare(function, argument_list)
     gen_expr = (function(*args) for args in argument_list)
+    if stream:
+        return gen_expr
     result_list = list(gen_expr)
     return result_list
 
 
-def generator_function(function, argument_list):
+def generator_function(function, argument_list, stream=False):
     """Apply a multivariate function to a list of arguments in a serial fashion.
 
     Uses Python's built-in generator function syntax to return a generator iterator.
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
+        stream (optional): If True, the generator iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def add(x, y, z):
@@ -87,7 +123,10 @@ def generator_function(function, argument_list):
         for args in argument_list:
             yield function(*args)
 
+    function, argument_list = _columns._prepare(function, argument_list)
     generator_iterator = generator_func(function, argument_list)
+    if stream:
+        return generator_iterator
     result_list = list(generator_iterator)
     return result_list
 
@@ -99,7 +138,8 @@ def list_comprehension(function, argument_list):
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
 
     Returns:
         List of output results
@@ -114,21 +154,25 @@ def list_comprehension(function, argument_list):
     References:
         - https://docs.python.org/3/tutorial/datastructures.html#list-comprehensions
     """
+    function, argument_list = _columns._prepare(function, argument_list)
     result_list = [function(*args) for args in argument_list]
     return result_list
 
 
-def map(function, argument_list):
+def map(function, argument_list, stream=False):
     """Apply a multivariate function to a list of arguments in a serial fashion.
 
-    Uses Python's built-in map() and zip() functions.
+    Uses Python's built-in map() function on one lazy iterator per argument position.
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
+        stream (optional): If True, the iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def add(x, y, z):
@@ -140,22 +184,32 @@ def map(function, argument_list):
     References:
         - https://docs.python.org/3/library/functions.html#map
     """
-    iterator = _map_alias(function, *zip(*argument_list))
+    function, argument_list = _columns._prepare(function, argument_list)
+    if isinstance(argument_list, _columns.Columns):
+        columns = argument_list.columns
+    else:
+        columns = _transpose_lazily(argument_list)
+    iterator = _map_alias(function, *columns) if columns else iter([])
+    if stream:
+        return iterator
     result_list = list(iterator)
     return result_list
 
 
-def starmap(function, argument_list):
+def starmap(function, argument_list, stream=False):
     """Apply a multivariate function to a list of arguments in a serial fashion.
 
     Uses the starmap() function from itertools in Python's standard library.
 
     Args:
         function: A callable object that accepts more than one argument
-        argument_list: An iterable object of input argument collections
+        argument_list: An iterable object of input argument collections, or columnar
+            arguments or a grid, see :mod:`unified_map.columns` and :mod:`unified_map.grid`
+        stream (optional): If True, the iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def add(x, y, z):
@@ -169,6 +223,9 @@ def starmap(function, argument_list):
     """
     from itertools import starmap as _starmap
 
+    function, argument_list = _columns._prepare(function, argument_list)
     iterator = _starmap(function, argument_list)
+    if stream:
+        return iterator
     result_list = list(iterator)
     return result_list
@@ -0,0 +1,164 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Pipelines of element-wise stages that are fused into a single task per argument.
+
+Chaining map calls, e.g. ``serial.map(g, parallel.multiprocessing(f, args))``, sends
+every intermediate result back to the main process and, for the next parallel stage,
+out to the workers again. A pipeline instead applies all of its stages one after another
+to each argument inside a worker, so that only final results cross process boundaries.
+
+Example:
+    >>> import unified_map as umap
+    >>> def square(x):
+    ...     return x**2
+    ...
+    >>> def is_odd(x):
+    ...     return x % 2 == 1
+    ...
+    >>> umap.pipeline.Pipeline(range(6)).map(square).filter(is_odd).map(str).run()
+    ['1', '9', '25']
+"""
+
+from .mapper import Mapper as _Mapper
+
+_MAP = 'map'
+_STARMAP = 'starmap'
+_FILTER = 'filter'
+
+
+class _FilteredOut:
+    """Marker for an argument that was removed by a filter stage.
+
+    It is pickled by reference, so that it remains the same object in every process.
+    """
+
+    def __reduce__(self):
+        return '_FILTERED_OUT'
+
+    def __repr__(self):
+        return '<filtered out>'
+
+
+_FILTERED_OUT = _FilteredOut()
+
+
+class _FusedStages:
+    """Picklable callable that applies all stages of a pipeline to one argument."""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def __call__(self, argument):
+        value = argument
+        for kind, function in self.stages:
+            if kind == _MAP:
+                value = function(value)
+            elif kind == _STARMAP:
+                value = function(*value)
+            elif not function(value):
+                return _FILTERED_OUT
+        return value
+
+
+def _without_filtered(results):
+    """Yield all results that were not removed by a filter stage."""
+    for result in results:
+        if result is not _FILTERED_OUT:
+            yield result
+
+
+class Pipeline:
+    """A sequence of element-wise stages that is applied to a list of arguments.
+
+    Stages are added with :meth:`map`, :meth:`starmap` and :meth:`filter`, each of
+    which returns a new pipeline, so that a common prefix can be shared by several
+    pipelines. Nothing is evaluated before :meth:`run` is called, which hands the fused
+    stages as one function to a :class:`~unified_map.mapper.Mapper` of any backend.
+
+    Args:
+        argument_list: An iterable object of input arguments
+
+    Example:
+        >>> import unified_map as umap
+        >>> def add(x, y):
+        ...     return x + y
+        ...
+        >>> def double(x):
+        ...     return 2 * x
+        ...
+        >>> with umap.mapper.Mapper('parallel.futures', num_workers=2) as mapper:
+        ...     umap.pipeline.Pipeline([(1, 2), (3, 4)]).starmap(add).map(double).run(mapper)
+        [6, 14]
+    """
+
+    def __init__(self, argument_list, stages=()):
+        self.argument_list = argument_list
+        self.stages = tuple(stages)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ' -> '.join(
+            '{}({})'.format(kind, getattr(function, '__name__', repr(function)))
+            for kind, function in self.stages))
+
+    def _add(self, kind, function):
+        return self.__class__(self.argument_list, self.stages + ((kind, function),))
+
+    def map(self, function):
+        """Add a stage that applies a univariate function to each value.
+
+        Args:
+            function: A callable object that accepts one argument
+
+        Returns:
+            A new :class:`Pipeline` object
+        """
+        return self._add(_MAP, function)
+
+    def starmap(self, function):
+        """Add a stage that applies a multivariate function to each tuple of values.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+
+        Returns:
+            A new :class:`Pipeline` object
+        """
+        return self._add(_STARMAP, function)
+
+    def filter(self, predicate):
+        """Add a stage that only keeps values for which a predicate is true.
+
+        Args:
+            predicate: A callable object that accepts one argument
+
+        Returns:
+            A new :class:`Pipeline` object
+        """
+        return self._add(_FILTER, predicate)
+
+    def run(self, mapper=None, stream=False, **options):
+        """Evaluate all stages for each argument in one task.
+
+        Args:
+            mapper (optional): A :class:`~unified_map.mapper.Mapper` object whose backend
+                and options are used. The default is a serial mapper.
+            stream (optional): If True, an iterator over the results is returned instead
+                of a list, as with :meth:`~unified_map.mapper.Mapper.imap`.
+            **options: Keyword arguments that override options of the mapper for this call
+
+        Returns:
+            List of final results of all arguments that passed every filter stage, or an
+            iterator over them if stream is True
+
+        Raises:
+            ValueError: If the pipeline has no stages.
+        """
+        if not self.stages:
+            raise ValueError('A pipeline needs at least one stage before it can be run.')
+        if mapper is None:
+            mapper = _Mapper()
+        function = _FusedStages(self.stages)
+        if stream:
+            return _without_filtered(mapper.imap(function, self.argument_list, **options))
+        return list(_without_filtered(mapper.map(function, self.argument_list, **options)))
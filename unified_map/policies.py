@@ -0,0 +1,306 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Policies that configure how parallel and distributed backends schedule their tasks."""
+
+import threading as _threading
+
+
+class Speculation:
+    """Speculative re-execution of straggling tasks.
+
+    Once a given fraction of all tasks has finished, each running task whose duration
+    exceeds a multiple of the median duration of finished tasks is launched a second time
+    on an idle worker. The result of whichever attempt finishes first is used and the
+    other attempt is cancelled.
+
+    Args:
+        quantile (optional): Fraction of tasks that needs to be finished before any task
+            is considered to be a straggler.
+        multiplier (optional): A running task is a straggler if it runs longer than this
+            number times the median duration of finished tasks.
+        poll_interval (optional): Seconds between two checks for stragglers.
+
+    Raises:
+        ValueError: If an argument is out of its valid range.
+
+    Example:
+        >>> import unified_map as umap
+        >>> def square(x):
+        ...     return x**2
+        ...
+        >>> speculation = umap.policies.Speculation(quantile=0.5, multiplier=4.0)
+        >>> umap.univariate.parallel.futures(square, [1, 2, 3, 4, 5], speculation=speculation)
+        [1, 4, 9, 16, 25]
+
+    References:
+        - https://spark.apache.org/docs/latest/configuration.html#scheduling
+    """
+
+    def __init__(self, quantile=0.75, multiplier=1.5, poll_interval=0.05):
+        if not 0.0 <= quantile <= 1.0:
+            raise ValueError('quantile needs to be between 0.0 and 1.0, got {}'.format(quantile))
+        if multiplier <= 0.0:
+            raise ValueError('multiplier needs to be positive, got {}'.format(multiplier))
+        if poll_interval <= 0.0:
+            raise ValueError(
+                'poll_interval needs to be positive, got {}'.format(poll_interval))
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.poll_interval = poll_interval
+
+    def __repr__(self):
+        return '{}(quantile={}, multiplier={}, poll_interval={})'.format(
+            self.__class__.__name__, self.quantile, self.multiplier, self.poll_interval)
+
+
+class Retry:
+    """Error policy that retries the evaluation of an argument that raised an exception.
+
+    The evaluation of an argument is repeated up to num_retries times inside the worker,
+    waiting backoff seconds before the first retry and doubling the waiting time for each
+    further retry. If a worker process crashes, the affected arguments are evaluated again
+    on a fresh worker, which also counts as a retry.
+
+    Args:
+        num_retries (optional): Maximum number of retries per argument.
+        backoff (optional): Seconds to wait before the first retry.
+        then (optional): What to do when all retries failed, either 'raise' to raise the
+            last exception or 'return_exceptions' to place it in the result list.
+
+    Raises:
+        ValueError: If an argument is out of its valid range.
+
+    Example:
+        >>> import unified_map as umap
+        >>> def inverse(x):
+        ...     return 1/x
+        ...
+        >>> retry = umap.policies.Retry(num_retries=2, then='return_exceptions')
+        >>> umap.univariate.parallel.futures(inverse, [1, 0, 2], error_policy=retry)
+        [1.0, ZeroDivisionError('division by zero'), 0.5]
+    """
+
+    def __init__(self, num_retries=3, backoff=0.0, then='raise'):
+        if num_retries < 0:
+            raise ValueError(
+                'num_retries needs to be zero or positive, got {}'.format(num_retries))
+        if backoff < 0.0:
+            raise ValueError('backoff needs to be zero or positive, got {}'.format(backoff))
+        if then not in ('raise', 'return_exceptions'):
+            raise ValueError(
+                "then needs to be 'raise' or 'return_exceptions', got {!r}".format(then))
+        self.num_retries = num_retries
+        self.backoff = backoff
+        self.then = then
+
+    def __repr__(self):
+        return '{}(num_retries={}, backoff={}, then={!r})'.format(
+            self.__class__.__name__, self.num_retries, self.backoff, self.then)
+
+
+class Producer:
+    """Background production of input arguments for parallel backends.
+
+    The argument iterable is consumed in a background thread or process, which passes
+    arguments through a bounded buffer to the parent process. This overlaps expensive
+    input production, e.g. parsing or decompressing records from files, with the
+    evaluation of previous arguments in the workers. A
+    :class:`~unified_map.instrumentation.Report` shows whether the producer or the
+    consumer had to wait.
+
+    Args:
+        kind (optional): Either 'thread', which suits iterables that release the GIL,
+            e.g. by reading files, or 'process', which suits CPU-bound iterables. A
+            process is forked if possible, otherwise the iterable needs to be picklable.
+        buffer_size (optional): Maximum number of arguments that are produced ahead.
+
+    Raises:
+        ValueError: If an argument is out of its valid range.
+
+    Example:
+        >>> import unified_map as umap
+        >>> def square(x):
+        ...     return x**2
+        ...
+        >>> lines = (int(line) for line in ['1', '2', '3'])
+        >>> producer = umap.policies.Producer(kind='thread', buffer_size=16)
+        >>> umap.univariate.parallel.futures(square, lines, producer=producer)
+        [1, 4, 9]
+    """
+
+    def __init__(self, kind='thread', buffer_size=64):
+        if kind not in ('thread', 'process'):
+            raise ValueError("kind needs to be 'thread' or 'process', got {!r}".format(kind))
+        if buffer_size < 1:
+            raise ValueError('buffer_size needs to be positive, got {}'.format(buffer_size))
+        self.kind = kind
+        self.buffer_size = buffer_size
+
+    def __repr__(self):
+        return '{}(kind={!r}, buffer_size={})'.format(
+            self.__class__.__name__, self.kind, self.buffer_size)
+
+
+class Serializer:
+    """Serialization of tasks, arguments and results that are sent to and from workers.
+
+    Backends usually pickle everything with their own pickler, which is the pickle module
+    for the process pools of the standard library. A serializer instead turns each task,
+    chunk of arguments and chunk of results into frames itself before a backend sends it:
+
+    - With the pickler 'cloudpickle', functions are pickled by value, so that lambdas and
+      functions that were defined interactively or inside other functions can be sent.
+    - With out-of-band buffers, pickle protocol 5 keeps the buffers of objects like NumPy
+      arrays and bytearrays out of the pickle stream. They are sent as frames of their
+      own instead of being copied into the stream, and objects are restored on top of
+      the received frames without copying them again.
+    - With a compression, each frame of at least compression_threshold bytes is
+      compressed, which reduces the bytes sent for large compressible payloads at the
+      cost of CPU time on both sides. Frames that do not get smaller are sent as they are.
+
+    Args:
+        pickler (optional): Either 'pickle' or 'cloudpickle', which needs to be installed.
+        out_of_band (optional): If True, buffers are sent as frames of their own.
+        compression (optional): None, 'lz4' or 'zstd', which need the packages lz4 or
+            zstandard to be installed.
+        compression_threshold (optional): Minimum size in bytes of a frame that is
+            compressed.
+
+    Raises:
+        ValueError: If an argument is out of its valid range.
+
+    Example:
+        >>> import unified_map as umap
+        >>> serializer = umap.policies.Serializer(pickler='cloudpickle')
+        >>> umap.univariate.parallel.futures(lambda x: x**2, [1, 2, 3], serializer=serializer)
+        [1, 4, 9]
+    """
+
+    def __init__(self, pickler='pickle', out_of_band=True, compression=None,
+                 compression_threshold=64 * 1024):
+        if pickler not in ('pickle', 'cloudpickle'):
+            raise ValueError(
+                "pickler needs to be 'pickle' or 'cloudpickle', got {!r}".format(pickler))
+        if compression not in (None, 'lz4', 'zstd'):
+            raise ValueError(
+                "compression needs to be None, 'lz4' or 'zstd', got {!r}".format(compression))
+        if compression_threshold < 0:
+            raise ValueError('compression_threshold needs to be non-negative, got {}'.format(
+                compression_threshold))
+        self.pickler = pickler
+        self.out_of_band = out_of_band
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+
+    def __repr__(self):
+        return (
+            '{}(pickler={!r}, out_of_band={}, compression={!r}, '
+            'compression_threshold={})'.format(
+                self.__class__.__name__, self.pickler, self.out_of_band, self.compression,
+                self.compression_threshold))
+
+
+class CancelToken:
+    """Explicit cancellation of running map calls of parallel backends.
+
+    A token is passed to one or more map calls and cancelled from another thread, e.g. by
+    a signal handler or a request handler of a service. Each map call then stops
+    dispatching arguments, terminates its worker processes within a bounded time and
+    raises a :class:`~unified_map.exceptions.MapCancelledError`. A cancelled token stays
+    cancelled, so a new one is needed for further map calls.
+
+    Example:
+        >>> import threading
+        >>> import time
+        >>> import unified_map as umap
+        >>> token = umap.policies.CancelToken()
+        >>> timer = threading.Timer(0.5, token.cancel)
+        >>> timer.start()
+        >>> umap.univariate.parallel.futures(time.sleep, [5, 5, 5], cancel_token=token)
+        Traceback (most recent call last):
+        ...
+        unified_map.exceptions.MapCancelledError: The map call was cancelled.
+    """
+
+    def __init__(self):
+        self._event = _threading.Event()
+        self._lock = _threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        """Whether cancel() was called."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel all map calls that use this token."""
+        with self._lock:
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def _add_callback(self, callback):
+        """Call a function on cancellation, immediately if the token is already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def __repr__(self):
+        return '{}(cancelled={})'.format(self.__class__.__name__, self.cancelled)
+
+
+def _normalize_error_policy(error_policy):
+    """Turn the error_policy argument of a backend into a Retry object or the string 'raise'.
+
+    Raises:
+        ValueError: If error_policy is not 'raise', 'return_exceptions' or a Retry object.
+    """
+    if isinstance(error_policy, Retry):
+        return error_policy
+    if error_policy == 'raise':
+        return 'raise'
+    if error_policy == 'return_exceptions':
+        return Retry(num_retries=0, then='return_exceptions')
+    raise ValueError(
+        "error_policy needs to be 'raise', 'return_exceptions' or a Retry object, "
+        'got {!r}'.format(error_policy))
+
+
+def _normalize_serializer(serializer):
+    """Turn the serializer argument of a backend into a Serializer object or None.
+
+    Raises:
+        ValueError: If serializer is not None, 'pickle', 'cloudpickle' or a Serializer
+            object.
+    """
+    if serializer is None or isinstance(serializer, Serializer):
+        return serializer
+    if serializer in ('pickle', 'cloudpickle'):
+        return Serializer(pickler=serializer)
+    raise ValueError(
+        "serializer needs to be None, 'pickle', 'cloudpickle' or a Serializer object, "
+        'got {!r}'.format(serializer))
+
+
+def _normalize_producer(producer):
+    """Turn the producer argument of a backend into a Producer object or None.
+
+    Raises:
+        ValueError: If producer is not None, 'thread', 'process' or a Producer object.
+    """
+    if producer is None or isinstance(producer, Producer):
+        return producer
+    if producer in ('thread', 'process'):
+        return Producer(kind=producer)
+    raise ValueError(
+        "producer needs to be None, 'thread', 'process' or a Producer object, "
+        'got {!r}'.format(producer))
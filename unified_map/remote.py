@@ -0,0 +1,278 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Results of distributed map calls that stay on the cluster.
+
+A distributed map call usually ends by moving all results from the workers to this
+process. If the next step is another map or a reduction, the results can instead stay
+where they were computed: :meth:`~unified_map.mapper.Mapper.map_remote` returns a
+:class:`RemoteResults` object, whose follow-up maps, filters and reductions are evaluated
+by the workers, and only :meth:`RemoteResults.gather` moves results to this process.
+
+With Dask, remote results are futures, one per chunk of arguments, whose data the
+scheduler keeps in the memory of the workers. With Spark, they form a resilient
+distributed dataset (RDD) that is cached by the executors.
+
+Example:
+    >>> import unified_map as umap
+    >>> def square(x):
+    ...     return x**2
+    ...
+    >>> def add(x, y):
+    ...     return x + y
+    ...
+    >>> mapper = umap.mapper.Mapper('distributed.dask')
+    >>> with mapper.map_remote(square, range(5)) as squares:
+    ...     squares.map(str).gather()
+    ...     squares.reduce(add)
+    ['0', '1', '4', '9', '16']
+    30
+"""
+
+import abc as _abc
+import functools as _functools
+
+from ._engine import _as_list, _pool_chunk_size, _split_into_chunks
+from .columns import _Layout
+
+_MAP = 'map'
+_STARMAP = 'starmap'
+_FILTER = 'filter'
+_NO_INITIAL = object()
+
+
+class _RemoteStage:
+    """Picklable callable that applies a function to a chunk or a partition in a worker."""
+
+    def __init__(self, kind, function, setup):
+        self.kind = kind
+        self.function = function
+        self.setup = setup
+
+    def __call__(self, values):
+        self.setup.ensure_done()
+        function = self.function
+        if self.kind == _FILTER:
+            return [value for value in values if function(value)]
+        if self.kind == _STARMAP:
+            return [function(*value) for value in values]
+        return [function(value) for value in values]
+
+    def map_partition(self, iterator):
+        """Apply the stage to a whole Spark partition."""
+        return self(iterator)
+
+
+def _reduce_chunk(reducer, values):
+    """Reduce an iterable of values to a list with one value, or none if it is empty."""
+    iterator = iter(values)
+    for first in iterator:
+        return [_functools.reduce(reducer, iterator, first)]
+    return []
+
+
+def _combine(reducer, left, right):
+    """Combine two reduced chunks in a worker."""
+    if left and right:
+        return [reducer(left[0], right[0])]
+    return left or right
+
+
+def _finish_reduction(reducer, reduced, initial):
+    """Turn the reduced list of all chunks into the final value in this process.
+
+    Raises:
+        TypeError: If there are no values and no initial value, like functools.reduce().
+    """
+    if reduced:
+        value = reduced[0]
+        return value if initial is _NO_INITIAL else reducer(initial, value)
+    if initial is _NO_INITIAL:
+        raise TypeError('reduce() of empty results with no initial value')
+    return initial
+
+
+class RemoteResults(_abc.ABC):
+    """Results of a map call that are kept in the memory of the workers of a cluster.
+
+    Objects of this class are created by :meth:`~unified_map.mapper.Mapper.map_remote`
+    and :meth:`~unified_map.mapper.Mapper.starmap_remote`. Each follow-up map or filter
+    returns new remote results and leaves the previous ones on the cluster until they are
+    released, so that they can be used by several follow-up steps. Used as a context
+    manager, the results are released at the end of the with statement.
+
+    Reductions with :meth:`reduce` first reduce each chunk or partition in the worker
+    that holds it and then combine the partial values, which needs an associative
+    reducer.
+
+    Subclasses for a cluster framework implement gather, release and the creation of
+    follow-up results.
+    """
+
+    def __init__(self, setup):
+        self._setup = setup
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def map(self, function):
+        """Apply a univariate function to each result on the cluster.
+
+        Args:
+            function: A callable object that accepts one argument
+
+        Returns:
+            New :class:`RemoteResults`
+        """
+        return self._apply(_RemoteStage(_MAP, function, self._setup))
+
+    def starmap(self, function):
+        """Apply a multivariate function to each result, which is a tuple, on the cluster.
+
+        Args:
+            function: A callable object that accepts one or more arguments
+
+        Returns:
+            New :class:`RemoteResults`
+        """
+        return self._apply(_RemoteStage(_STARMAP, function, self._setup))
+
+    def filter(self, predicate):
+        """Keep only results for which a predicate is true.
+
+        Args:
+            predicate: A callable object that accepts one argument
+
+        Returns:
+            New :class:`RemoteResults`
+        """
+        return self._apply(_RemoteStage(_FILTER, predicate, self._setup))
+
+    def reduce(self, reducer, initial=_NO_INITIAL):
+        """Combine all results into one value, mostly on the cluster.
+
+        Args:
+            reducer: A callable object that accepts two values and returns one. It needs
+                to be associative, because partial values are combined in a tree.
+            initial (optional): A value that is combined with the reduced results, and
+                that is returned if there are no results.
+
+        Returns:
+            The reduced value
+
+        Raises:
+            TypeError: If there are no results and no initial value.
+        """
+        return _finish_reduction(reducer, self._reduce(reducer), initial)
+
+    @_abc.abstractmethod
+    def gather(self):
+        """Move all results to this process.
+
+        Returns:
+            List of results in input order
+        """
+
+    @_abc.abstractmethod
+    def release(self):
+        """Allow the cluster to free the memory of the results."""
+
+    @_abc.abstractmethod
+    def _apply(self, stage):
+        """Create new remote results by applying a stage to each chunk or partition."""
+
+    @_abc.abstractmethod
+    def _reduce(self, reducer):
+        """Reduce all chunks or partitions to a list with at most one value."""
+
+
+class _DaskResults(RemoteResults):
+    """Remote results held by Dask futures, one per chunk."""
+
+    def __init__(self, client, futures, setup):
+        super().__init__(setup)
+        self._client = client
+        self._futures = futures
+
+    def __repr__(self):
+        return '<{} with {} chunks on a Dask cluster>'.format(
+            self.__class__.__name__, len(self._futures))
+
+    def gather(self):
+        return [result for chunk in self._client.gather(self._futures) for result in chunk]
+
+    def release(self):
+        # Dropping the references instead of cancelling the futures keeps results that were
+        # derived from them computable
+        for future in self._futures:
+            future.release()
+        self._futures = []
+
+    def _apply(self, stage):
+        futures = self._client.map(stage, self._futures, pure=False)
+        return self.__class__(self._client, futures, self._setup)
+
+    def _reduce(self, reducer):
+        submit = self._client.submit
+        futures = [submit(_reduce_chunk, reducer, future, pure=False)
+                   for future in self._futures]
+        while len(futures) > 1:
+            combined = [submit(_combine, reducer, left, right, pure=False)
+                        for left, right in zip(futures[::2], futures[1::2])]
+            if len(futures) % 2:
+                combined.append(futures[-1])
+            futures = combined
+        if not futures:
+            return []
+        return futures[0].result()
+
+
+class _SparkResults(RemoteResults):
+    """Remote results held by a cached resilient distributed dataset (RDD)."""
+
+    def __init__(self, rdd, setup):
+        super().__init__(setup)
+        self._rdd = rdd
+
+    def __repr__(self):
+        return '<{} with {} partitions on a Spark cluster>'.format(
+            self.__class__.__name__, self._rdd.getNumPartitions())
+
+    def gather(self):
+        return self._rdd.collect()
+
+    def release(self):
+        self._rdd.unpersist()
+
+    def _apply(self, stage):
+        rdd = self._rdd.mapPartitions(stage.map_partition, preservesPartitioning=True)
+        return self.__class__(rdd.cache(), self._setup)
+
+    def _reduce(self, reducer):
+        reduce_partition = _functools.partial(_reduce_chunk, reducer)
+        reduced = self._rdd.mapPartitions(reduce_partition).collect()
+        return _reduce_chunk(reducer, reduced)
+
+
+def _create(backend, connection, kind, function, argument_list, setup):
+    """Evaluate a first stage on the cluster and keep its results there."""
+    stage = _RemoteStage(kind, function, setup)
+    if backend == 'distributed.dask':
+        argument_list = _as_list(argument_list)
+        num_slots = sum(connection.ncores().values())
+        chunks = _split_into_chunks(
+            argument_list, _pool_chunk_size(len(argument_list), num_slots))
+        futures = [connection.submit(stage, chunk, pure=False) for chunk in chunks]
+        return _DaskResults(connection, futures, setup)
+    if isinstance(argument_list, _Layout):
+        # Partitions receive slices of columns or of a grid and form value tuples there
+        chunks = _split_into_chunks(argument_list, _pool_chunk_size(
+            len(argument_list), connection.defaultParallelism))
+        rdd = connection.parallelize(chunks, max(1, len(chunks))).flatMap(iter)
+    else:
+        rdd = connection.parallelize(argument_list)
+    rdd = rdd.mapPartitions(stage.map_partition)
+    return _SparkResults(rdd.cache(), setup)
@@ -0,0 +1,291 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""Results that workers write to sharded files instead of sending them back.
+
+A map call usually sends every result back to this process, which then needs the memory
+for all of them and becomes the bottleneck when they are written to disk afterwards.
+With a :class:`Sink`, each worker writes the results of the chunks it evaluates to
+shard files of its own, and only a small description of each shard travels back. The
+map call returns a :class:`Manifest` that lists the shards in input order, together with
+the range of argument indices whose results each of them holds.
+
+Example:
+    >>> import tempfile
+    >>> import unified_map as umap
+    >>> sink = umap.sinks.Sink(tempfile.mkdtemp(), format='jsonl')
+    >>> manifest = umap.univariate.parallel.futures(abs, [-2, -1, 0, 1, 2], sink=sink)
+    >>> manifest.num_results
+    5
+    >>> list(manifest.read())
+    [2, 1, 0, 1, 2]
+"""
+
+import json as _json
+import os as _os
+import uuid as _uuid
+from collections import namedtuple as _namedtuple
+from itertools import chain as _chain
+from itertools import islice as _islice
+
+_EXTENSIONS = {
+    'jsonl': '.jsonl',
+    'npy': '.npy',
+    'parquet': '.parquet',
+}
+
+# Column and schema metadata of Parquet shards whose results are not dictionaries
+_VALUE_COLUMN = 'result'
+_VALUES_METADATA = {b'unified_map.values': b'true'}
+
+
+Shard = _namedtuple('Shard', ['path', 'start', 'stop'])
+Shard.__doc__ = """A file that holds the results of the arguments with indices start to stop-1."""
+
+
+class Sink:
+    """Shard files in a directory that the workers of a map call write its results to.
+
+    Each chunk of arguments becomes one shard, which is first written under a temporary
+    name and renamed once it is complete, so that a shard that is listed in a manifest is
+    never partial. Results are written in batches while the chunk is evaluated, except
+    for 'npy' shards, which are written as a whole.
+
+    Args:
+        directory: Path of a directory that all workers can write to, which is created if
+            it does not exist. With a cluster, it needs to be on a file system that is
+            shared by all machines, otherwise each shard ends up on the local disk of the
+            worker that wrote it.
+        format (optional): 'jsonl' writes one JSON document per result and line. 'npy'
+            writes one NumPy array per shard, whose first dimension runs over the results,
+            and needs NumPy in the workers. 'parquet' writes one table per shard and needs
+            pyarrow in the workers. Results that are dictionaries become rows with a
+            column per key, other results a single column named 'result'.
+        dtype (optional): NumPy dtype of the arrays in 'npy' shards. The default lets
+            NumPy infer it from the results.
+        prefix (optional): Beginning of the file names of all shards.
+        batch_size (optional): Number of results that are buffered in memory before they
+            are written to a shard at once.
+
+    Raises:
+        ValueError: If an argument is out of its valid range.
+    """
+
+    def __init__(self, directory, format='jsonl', dtype=None, prefix='part-', batch_size=1000):
+        if format not in _EXTENSIONS:
+            raise ValueError(
+                "format needs to be 'jsonl', 'npy' or 'parquet', got {!r}".format(format))
+        if batch_size < 1:
+            raise ValueError('batch_size needs to be positive, got {}'.format(batch_size))
+        self.directory = _os.fspath(directory)
+        self.format = format
+        self.dtype = dtype
+        self.prefix = prefix
+        self.batch_size = batch_size
+
+    def __repr__(self):
+        return '{}(directory={!r}, format={!r}, dtype={!r}, prefix={!r}, batch_size={})'.format(
+            self.__class__.__name__, self.directory, self.format, self.dtype, self.prefix,
+            self.batch_size)
+
+
+class Manifest:
+    """Shards that hold the results of a map call with a :class:`Sink`, in input order.
+
+    Iterating a manifest yields its :class:`Shard` objects, whose index ranges are
+    consecutive and together cover all arguments.
+
+    Attributes:
+        sink: The :class:`Sink` that the shards were written to
+        shards: List of :class:`Shard` objects
+    """
+
+    def __init__(self, sink, shards):
+        self.sink = sink
+        self.shards = shards
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __repr__(self):
+        return '<{} with {} results in {} {} shards>'.format(
+            self.__class__.__name__, self.num_results, len(self.shards), self.sink.format)
+
+    @property
+    def num_results(self):
+        """Number of results in all shards."""
+        return self.shards[-1].stop if self.shards else 0
+
+    def read(self):
+        """Read the results of all shards one by one.
+
+        Returns:
+            An iterator over the results in input order. Results of 'npy' shards are
+            elements of NumPy arrays.
+        """
+        read_shard = _READERS[self.sink.format]
+        for shard in self.shards:
+            yield from read_shard(shard.path)
+
+
+def _batches(results, batch_size):
+    """Yield consecutive lists of at most batch_size results."""
+    iterator = iter(results)
+    while True:
+        batch = list(_islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _write_jsonl(path, batches, sink):
+    num_results = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        for batch in batches:
+            file.write(''.join(_json.dumps(result) + '\n' for result in batch))
+            num_results += len(batch)
+    return num_results
+
+
+def _write_npy(path, batches, sink):
+    import numpy
+
+    array = numpy.asarray([result for batch in batches for result in batch], dtype=sink.dtype)
+    with open(path, 'wb') as file:
+        numpy.save(file, array)
+    return len(array)
+
+
+def _arrow_table(pyarrow, batch, schema):
+    """Turn a batch of results into a table, using the schema of the first batch if given."""
+    if isinstance(batch[0], dict):
+        return pyarrow.Table.from_pylist(batch, schema=schema)
+    rows = [{_VALUE_COLUMN: result} for result in batch]
+    table = pyarrow.Table.from_pylist(rows, schema=schema)
+    return table if schema is not None else table.replace_schema_metadata(_VALUES_METADATA)
+
+
+def _write_parquet(path, batches, sink):
+    import pyarrow
+    import pyarrow.parquet
+
+    num_results = 0
+    writer = None
+    try:
+        for batch in batches:
+            table = _arrow_table(pyarrow, batch, None if writer is None else writer.schema)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            num_results += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return num_results
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            yield _json.loads(line)
+
+
+def _read_npy(path):
+    import numpy
+
+    yield from numpy.load(path, mmap_mode='r')
+
+
+def _read_parquet(path):
+    import pyarrow.parquet
+
+    file = pyarrow.parquet.ParquetFile(path)
+    values = file.schema_arrow.metadata == _VALUES_METADATA
+    for batch in file.iter_batches():
+        if values:
+            yield from batch.column(_VALUE_COLUMN).to_pylist()
+        else:
+            yield from batch.to_pylist()
+
+
+_WRITERS = {
+    'jsonl': _write_jsonl,
+    'npy': _write_npy,
+    'parquet': _write_parquet,
+}
+
+_READERS = {
+    'jsonl': _read_jsonl,
+    'npy': _read_npy,
+    'parquet': _read_parquet,
+}
+
+
+class _ShardWriter:
+    """Picklable writer of the shards of one map call, which chunk tasks use in workers.
+
+    All files of a map call start with the prefix of the sink and a token of the call,
+    so that this process can tell apart the shards of abandoned attempts.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.stem = '{}{}-'.format(sink.prefix, _uuid.uuid4().hex[:12])
+
+    def write(self, results):
+        """Write an iterable of results to a new shard while they are produced.
+
+        Returns:
+            A :class:`Shard` with the range 0 to the number of results, whose path is None
+            if there were no results
+        """
+        sink = self.sink
+        batches = _batches(results, sink.batch_size)
+        first_batch = next(batches, None)
+        if first_batch is None:
+            return Shard(None, 0, 0)
+        _os.makedirs(sink.directory, exist_ok=True)
+        name = self.stem + _uuid.uuid4().hex[:12] + _EXTENSIONS[sink.format]
+        path = _os.path.join(sink.directory, name)
+        temporary_path = path + '.tmp'
+        try:
+            num_results = _WRITERS[sink.format](
+                temporary_path, _chain([first_batch], batches), sink)
+            _os.replace(temporary_path, path)
+        except BaseException:
+            if _os.path.exists(temporary_path):
+                _os.remove(temporary_path)
+            raise
+        return Shard(path, 0, num_results)
+
+    def manifest(self, written_shards):
+        """Place the shards of all chunks, in input order, at consecutive index ranges."""
+        shards = []
+        start = 0
+        for shard in written_shards:
+            if shard.path is not None:
+                shards.append(Shard(shard.path, start, start + shard.stop))
+                start += shard.stop
+        self.remove_unlisted([shard.path for shard in shards])
+        return Manifest(self.sink, shards)
+
+    def remove_unlisted(self, paths):
+        """Remove files of this map call that are not among the given shards.
+
+        This is a best effort, because the directory may not be visible to this process
+        and abandoned attempts may still be writing.
+        """
+        listed = {_os.path.basename(path) for path in paths}
+        try:
+            names = _os.listdir(self.sink.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(self.stem) and name not in listed:
+                try:
+                    _os.remove(_os.path.join(self.sink.directory, name))
+                except OSError:
+                    pass
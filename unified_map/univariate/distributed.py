@@ -1,21 +1,32 @@
 # Copyright 2018 Robert Haas
 # For license information, see LICENSE.TXT in the package root directory
 
-from .. import cluster_setup as _cluster_setup
+from .. import mapper as _mapper
 
 
-def dask(function, argument_list):
+def dask(function, argument_list, initializer=None, initargs=(), warmup=None, speculation=None,
+         error_policy='raise', timeout=None, deadline=None, cost=None, memory_per_task=None,
+         max_inflight_bytes=None, stream=False, prefetch=None, cancel_token=None, dedupe=False,
+         affinity_key=None, worker_cache_size=None, serializer=None, result_dtype=None, sink=None,
+         report=None):
     """Apply a univariate function to a list of arguments in a distributed fashion.
 
     Uses Dask's delayed() function to build a task graph and compute() function with
     a cluster connection to calculate results.
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
 
     Raises:
         ConnectionError: If no connection to a Dask scheduler was established.
@@ -37,36 +48,40 @@ def dask(function, argument_list):
     """
     # TODO: docstring reference to cluster setup
 
-    from dask import delayed, compute
-
-    if _cluster_setup.dask._connection is None:
-        error_message = (
-            'No connection was established to a Dask scheduler that distributes jobs to workers. '
-            "Please use unified_map.cluster_setup.dask and/or Dask's command line "
-            'interface for\n'
-            '  1. Starting a scheduler\n'
-            '  2. Starting several workers\n'
-            '  3. Connecting to the scheduler')
-        raise ConnectionError(error_message)
-
-    jobs = [delayed(function)(arg) for arg in argument_list]
-    result_tuple = compute(*jobs, get=_cluster_setup.dask._connection.get)
-    result_list = list(result_tuple)
-    return result_list
-
-
-def spark(function, argument_list):
+    mapper = _mapper.Mapper(
+        'distributed.dask', initializer=initializer, initargs=initargs, warmup=warmup,
+        speculation=speculation, error_policy=error_policy, timeout=timeout, deadline=deadline,
+        cost=cost, memory_per_task=memory_per_task, max_inflight_bytes=max_inflight_bytes,
+        prefetch=prefetch, cancel_token=cancel_token, dedupe=dedupe,
+        affinity_key=affinity_key, worker_cache_size=worker_cache_size,
+        serializer=serializer, result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
+
+
+def spark(function, argument_list, initializer=None, initargs=(), warmup=None,
+          error_policy='raise', timeout=None, deadline=None, cost=None, stream=False,
+          prefetch=None, cancel_token=None, dedupe=False, worker_cache_size=None, serializer=None,
+          result_dtype=None, sink=None, report=None):
     """Apply a univariate function to a list of arguments in a distributed fashion.
 
-    Uses Apache Spark's map() and collect() functions provided by a
+    Uses Apache Spark's mapPartitions() and collect() functions provided by a
     resilient distributed dataset (RDD).
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
 
     Raises:
         ConnectionError: If no connection ("context") to a Spark scheduler ("master")
@@ -87,18 +102,12 @@ def spark(function, argument_list):
         - https://spark.apache.org/docs/latest/api/python/index.html
         - https://spark.apache.org/docs/latest/rdd-programming-guide.html
     """
-    if _cluster_setup.spark._connection is None:
-        error_message = (
-            'No connection ("context") was established to a Spark scheduler ("master") that '
-            'distributes jobs to workers ("slaves"). '
-            "Please use unified_map.cluster_setup.spark and/or Apache Spark's command line "
-            'interface for\n'
-            '  1. Starting a scheduler\n'
-            '  2. Starting several workers\n'
-            '  3. Connecting to the scheduler')
-        raise ConnectionError(error_message)
-
-    input_rdd = _cluster_setup.spark._connection.parallelize(argument_list)
-    output_rdd = input_rdd.map(function)
-    results = output_rdd.collect()
-    return results
+    mapper = _mapper.Mapper(
+        'distributed.spark', initializer=initializer, initargs=initargs, warmup=warmup,
+        error_policy=error_policy, timeout=timeout, deadline=deadline, cost=cost,
+        prefetch=prefetch, cancel_token=cancel_token, dedupe=dedupe,
+        worker_cache_size=worker_cache_size, serializer=serializer,
+        result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
@@ -1,24 +1,32 @@
 # Copyright 2018 Robert Haas
 # For license information, see LICENSE.TXT in the package root directory
 
-from multiprocessing import cpu_count as _cpu_count
+from .. import mapper as _mapper
 
-_DETECTED_NUM_CORES = _cpu_count()
 
-
-def dask(function, argument_list, num_cores=None):
+def dask(function, argument_list, num_cores=None, initializer=None, initargs=(), warmup=None,
+         error_policy='raise', memory_per_task=None, max_inflight_bytes=None, stream=False,
+         prefetch=None, producer=None, cancel_token=None, dedupe=False, worker_cache_size=None,
+         serializer=None, result_dtype=None, sink=None, report=None):
     """Apply a univariate function to a list of arguments in a parallel fashion.
 
     Uses Dask's delayed() function to build a task graph and compute() function to
     calculate results.
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
         num_cores (optional): Number of cores to use for calculation.
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
 
     Example:
         >>> def square(x):
@@ -32,30 +40,45 @@ def dask(function, argument_list, num_cores=None):
         - https://dask.pydata.org/en/latest/scheduler-overview.html
         - https://dask.pydata.org/en/latest/delayed.html
     """
-    from dask import compute, delayed
-    from dask import multiprocessing as _multiprocessing
-
-    if num_cores is None:
-        num_cores = _DETECTED_NUM_CORES
-
-    jobs_generator = (delayed(function)(arg) for arg in argument_list)
-    result_tuple = compute(*jobs_generator, get=_multiprocessing.get, num_workers=num_cores)
-    result_list = list(result_tuple)
-    return result_list
-
-
-def futures(function, argument_list, num_cores=None):
+    mapper = _mapper.Mapper(
+        'parallel.dask', num_workers=num_cores, initializer=initializer, initargs=initargs,
+        warmup=warmup, error_policy=error_policy, memory_per_task=memory_per_task,
+        max_inflight_bytes=max_inflight_bytes, prefetch=prefetch, producer=producer,
+        cancel_token=cancel_token, dedupe=dedupe,
+        worker_cache_size=worker_cache_size, serializer=serializer,
+        result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
+
+
+def futures(function, argument_list, num_cores=None, initializer=None, initargs=(), warmup=None,
+            speculation=None, error_policy='raise', timeout=None, deadline=None, cost=None,
+            max_tasks_per_worker=None, max_worker_memory=None, memory_per_task=None,
+            max_inflight_bytes=None, stream=False, prefetch=None, producer=None, cancel_token=None,
+            dedupe=False, affinity_key=None, worker_cache_size=None, serializer=None,
+            result_dtype=None, sink=None, report=None):
     """Apply a univariate function to a list of arguments in a parallel fashion.
 
     Uses Python's built-in futures with a process pool executor.
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
         num_cores (optional): Number of cores to use for calculation.
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
+
+    Raises:
+        WorkerCrashError: If a worker process crashed and error_policy is 'raise'.
 
     Example:
         >>> def square(x):
@@ -67,33 +90,43 @@ def futures(function, argument_list, num_cores=None):
     References:
      - https://docs.python.org/3/library/concurrent.futures.html#concurrent.futures.Executor.map
     """
-    # TODO: possible bug that leads to freezing, see
-    # https://stackoverflow.com/questions/48218897/python-doctest-hangs-using-processpoolexecutor
-
-    from concurrent.futures import ProcessPoolExecutor
-
-    if num_cores is None:
-        num_cores = _DETECTED_NUM_CORES
-
-    with ProcessPoolExecutor(max_workers=num_cores) as executor:
-        iterator = executor.map(function, argument_list)
-        result_list = list(iterator)
-        return result_list
-
-
-def joblib(function, argument_list, num_cores=None):
+    mapper = _mapper.Mapper(
+        'parallel.futures', num_workers=num_cores, initializer=initializer, initargs=initargs,
+        warmup=warmup, speculation=speculation, error_policy=error_policy, timeout=timeout,
+        deadline=deadline, cost=cost, max_tasks_per_worker=max_tasks_per_worker,
+        max_worker_memory=max_worker_memory, memory_per_task=memory_per_task,
+        max_inflight_bytes=max_inflight_bytes, prefetch=prefetch, producer=producer,
+        cancel_token=cancel_token, dedupe=dedupe, affinity_key=affinity_key,
+        worker_cache_size=worker_cache_size, serializer=serializer,
+        result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
+
+
+def joblib(function, argument_list, num_cores=None, initializer=None, initargs=(), warmup=None,
+           error_policy='raise', memory_per_task=None, max_inflight_bytes=None, stream=False,
+           prefetch=None, producer=None, cancel_token=None, dedupe=False, worker_cache_size=None,
+           serializer=None, result_dtype=None, sink=None, report=None):
     """Apply a univariate function to a list of arguments in a parallel fashion.
 
     Uses Joblib's delayed() function with a parallel executor that starts multiple
     processes.
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
         num_cores (optional): Number of cores to use for calculation.
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
 
     Example:
         >>> def square(x):
@@ -105,30 +138,48 @@ def joblib(function, argument_list, num_cores=None):
     References:
         - https://pythonhosted.org/joblib/parallel.html
     """
-    from joblib import delayed, Parallel
-
-    if num_cores is None:
-        num_cores = _DETECTED_NUM_CORES
-
-    parallel_executor = Parallel(n_jobs=num_cores, backend='multiprocessing')
-    jobs_generator = (delayed(function)(arg) for arg in argument_list)
-    result_list = parallel_executor(jobs_generator)
-    return result_list
-
-
-def multiprocessing(function, argument_list, num_cores=None):
+    mapper = _mapper.Mapper(
+        'parallel.joblib', num_workers=num_cores, initializer=initializer, initargs=initargs,
+        warmup=warmup, error_policy=error_policy, memory_per_task=memory_per_task,
+        max_inflight_bytes=max_inflight_bytes, prefetch=prefetch, producer=producer,
+        cancel_token=cancel_token, dedupe=dedupe,
+        worker_cache_size=worker_cache_size, serializer=serializer,
+        result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
+
+
+def multiprocessing(function, argument_list, num_cores=None, inherit_arguments=False,
+                    initializer=None, initargs=(), warmup=None, error_policy='raise', timeout=None,
+                    deadline=None, cost=None, max_tasks_per_worker=None, max_worker_memory=None,
+                    memory_per_task=None, max_inflight_bytes=None, stream=False, prefetch=None,
+                    producer=None, cancel_token=None, dedupe=False, affinity_key=None,
+                    worker_cache_size=None, serializer=None, result_dtype=None, sink=None,
+                    report=None):
     """Apply a univariate function to a list of arguments in a parallel fashion.
 
-    Uses the parallel map() function with a pool of processes from multiprocessing in
+    Uses the apply_async() function of a pool of processes from multiprocessing in
     Python's standard library.
 
+    Keyword arguments that are not listed below are options of this backend, which are
+    described at :class:`~unified_map.mapper.Mapper`.
+
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
         num_cores (optional): Number of cores to use for calculation.
+        stream (optional): If True, arguments are pulled lazily from argument_list and an
+            iterator over the results is returned instead of a list, so that huge
+            or infinite iterables are processed in constant memory.
 
     Returns:
-        List of output results
+        List of output results, a NumPy array if result_dtype is given, a manifest if sink
+        is given, or an iterator over the results if stream is True
+
+    Raises:
+        ValueError: If inherit_arguments is True but the "fork" start method is unavailable.
+        WorkerCrashError: If a worker process crashed and error_policy is 'raise'.
 
     Example:
         >>> def square(x):
@@ -139,13 +190,17 @@ def multiprocessing(function, argument_list, num_cores=None):
 
     References:
         - https://docs.python.org/3/library/multiprocessing.html
-        - https://docs.python.org/3/library/multiprocessing.html#multiprocessing.pool.Pool.map
+        - https://docs.python.org/3/library/multiprocessing.html#module-multiprocessing.pool
     """
-    from multiprocessing import Pool
-
-    if num_cores is None:
-        num_cores = _DETECTED_NUM_CORES
-
-    pool = Pool(processes=num_cores)
-    result_list = pool.map(function, argument_list)
-    return result_list
+    mapper = _mapper.Mapper(
+        'parallel.multiprocessing', num_workers=num_cores, inherit_arguments=inherit_arguments,
+        initializer=initializer, initargs=initargs, warmup=warmup, error_policy=error_policy,
+        timeout=timeout, deadline=deadline, cost=cost, max_tasks_per_worker=max_tasks_per_worker,
+        max_worker_memory=max_worker_memory, memory_per_task=memory_per_task,
+        max_inflight_bytes=max_inflight_bytes, prefetch=prefetch, producer=producer,
+        cancel_token=cancel_token, dedupe=dedupe, affinity_key=affinity_key,
+        worker_cache_size=worker_cache_size, serializer=serializer,
+        result_dtype=result_dtype, sink=sink, report=report)
+    if stream:
+        return mapper.imap(function, argument_list)
+    return mapper.map(function, argument_list)
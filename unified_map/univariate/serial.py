@@ -33,7 +33,7 @@ def for_loop(function, argument_list):
     return result_list
 
 
-def generator_expression(function, argument_list):
+def generator_expression(function, argument_list, stream=False):
     """Apply a univariate function to a list of arguments in a serial fashion.
 
     Uses Python's built-in generator expressions.
@@ -41,9 +41,11 @@ def generator_expression(function, argument_list):
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, the generator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def square(x):
@@ -56,11 +58,13 @@ def generator_expression(function, argument_list):
         - https://www.python.org/dev/peps/pep-0289
     """
     gen_expr = (function(arg) for arg in argument_list)
+    if stream:
+        return gen_expr
     result_list = list(gen_expr)
     return result_list
 
 
-def generator_function(function, argument_list):
+def generator_function(function, argument_list, stream=False):
     """Apply a univariate function to a list of arguments in a serial fashion.
 
     Uses Python's built-in generator function syntax to return a generator iterator.
@@ -68,9 +72,11 @@ def generator_function(function, argument_list):
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, the generator iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def square(x):
@@ -88,6 +94,8 @@ def generator_function(function, argument_list):
             yield function(arg)
 
     generator_iterator = generator_func(function, argument_list)
+    if stream:
+        return generator_iterator
     result_list = list(generator_iterator)
     return result_list
 
@@ -118,7 +126,7 @@ def list_comprehension(function, argument_list):
     return result_list
 
 
-def map(function, argument_list):
+def map(function, argument_list, stream=False):
     """Apply a univariate function to a list of arguments in a serial fashion.
 
     Uses Python's built-in map() function.
@@ -126,9 +134,11 @@ def map(function, argument_list):
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, the iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def square(x):
@@ -141,11 +151,13 @@ def map(function, argument_list):
         - https://docs.python.org/3/library/functions.html#map
     """
     iterator = _map_alias(function, argument_list)
+    if stream:
+        return iterator
     result_list = list(iterator)
     return result_list
 
 
-def starmap(function, argument_list):
+def starmap(function, argument_list, stream=False):
     """Apply a univariate function to a list of arguments in a serial fashion.
 
     Uses the starmap() function from itertools in Python's standard library and
@@ -154,9 +166,11 @@ def starmap(function, argument_list):
     Args:
         function: A callable object that accepts one argument
         argument_list: An iterable object of input arguments
+        stream (optional): If True, the iterator is returned instead of a list of
+            results, so that huge or infinite iterables are processed lazily.
 
     Returns:
-        List of output results
+        List of output results, or an iterator over them if stream is True
 
     Example:
         >>> def square(x):
@@ -171,5 +185,7 @@ def starmap(function, argument_list):
     from itertools import starmap as _starmap
 
     iterator = _starmap(function, zip(argument_list))
+    if stream:
+        return iterator
     result_list = list(iterator)
     return result_list
@@ -0,0 +1,26 @@
+# Copyright 2018 Robert Haas
+# For license information, see LICENSE.TXT in the package root directory
+
+"""State that lives inside a worker process and persists between its tasks.
+
+Parallel and distributed functions accept an ``initializer`` that is called once in each
+worker before it evaluates its first argument. The initializer can put expensive objects
+into :data:`state`, from where the mapped function can read them in every later call.
+
+Example:
+    >>> import re
+    >>> import unified_map as umap
+    >>> from unified_map import worker
+    >>>
+    >>> def initializer(pattern):
+    ...     worker.state['regex'] = re.compile(pattern)
+    ...
+    >>> def count_digits(text):
+    ...     return len(worker.state['regex'].findall(text))
+    ...
+    >>> umap.univariate.parallel.multiprocessing(
+    ...     count_digits, ['a1', 'b22'], initializer=initializer, initargs=(r'\\d',))
+    [1, 2]
+"""
+
+state = {}